@@ -1,5 +1,6 @@
 from typing import Optional, Tuple, List, Union
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 # import cv2 # to manipulate images and videos
 # import os # to navigate in the directories
 # import shutil # to remove directories
@@ -10,6 +11,7 @@ import numpy as np
 # Custom typing
 Framenumbers = Optional[Union[np.ndarray, List[int]]]
 Subregion = Optional[Tuple[Optional[int], Optional[int], Optional[int], Optional[int]]]#  start_x, start_y, end_x, end_y
+MissingRuns = Tuple[np.ndarray, np.ndarray] # starts, lengths
 
 ###### GENERAL VIDEO READING
 
@@ -25,21 +27,31 @@ def is_this_a_video(acquisition_path:str) -> bool:
     :param acquisition_path:
     :return:
     """
+    if get_acquisition_type(acquisition_path) is None:
+        log_warn(f"There is no video at {acquisition_path}.")
+        return False
+    return True
+
+def get_acquisition_type(acquisition_path:str) -> Optional[str]:
+    """
+    Finds which kind of video there is for the given acquisition path.
+
+    :param acquisition_path:
+    :return: 'gcv', 't16', 't8', 'lcv', 'mp4' or 'mov', or None if there is no video.
+    """
     if is_this_a_gcv(acquisition_path):
-        return True
+        return 'gcv'
     elif is_this_a_t16(acquisition_path):
-        return True
+        return 't16'
     elif is_this_a_t8(acquisition_path):
-        return True
+        return 't8'
     elif is_this_a_lcv(acquisition_path):
-        return True
+        return 'lcv'
     elif is_this_a_mp4(acquisition_path):
-        return True
+        return 'mp4'
     elif is_this_a_mov(acquisition_path):
-        return True
-    else:
-        log_warn(f"There is no video at {acquisition_path}.")
-        return False
+        return 'mov'
+    return None
 
 def find_available_videos(dataset_path: str, type:Optional[str]=None) ->List[str]:
     all_types = ['gcv', 't16', 't8', 'flv', 'mp4', 'mov']
@@ -79,45 +91,59 @@ def describe_dataset(dataset_path: str, type:Optional[str]=None, makeitshort=Fal
         for acquisition in available_acquisitions:
             display(f"- '{acquisition}' (TODO type(s))")
 
-def find_available_datasets(root_path: str) ->List[str]:
+def find_available_datasets(root_path: str, n_workers:Optional[int] = None) ->List[str]:
+    """
+    Lists the folders of root_path which contain videos. The folders are explored concurrently.
+    See also get_catalog, which also describes the videos and remembers them.
 
+    :param root_path:
+    :param n_workers: The number of threads (default_catalog_workers by default)
+    :return:
+    """
     log_debug(f'Possible datasets in {root_path}: {os.listdir(root_path)}')
-    available_datasets = [d for d in os.listdir(root_path) if os.path.isdir(os.path.join(root_path, d)) and len(find_available_videos(os.path.join(root_path, d))) > 0]
+    possible_datasets = [d for d in os.listdir(root_path) if os.path.isdir(os.path.join(root_path, d))]
+    with ThreadPoolExecutor(max_workers=n_workers or default_catalog_workers) as executor:
+        has_videos = list(executor.map(lambda d: len(find_available_videos(os.path.join(root_path, d))) > 0, possible_datasets))
+    available_datasets = [d for d, has_video in zip(possible_datasets, has_videos) if has_video]
     return available_datasets
 
-def get_number_of_available_frames(acquisition_path: str) -> Optional[int]:
-    if not is_this_a_video(acquisition_path):
+def get_number_of_available_frames(acquisition_path: str, acquisition_type:Optional[str]=None) -> Optional[int]:
+    if acquisition_type is None:
+        acquisition_type = get_acquisition_type(acquisition_path)
+    if acquisition_type is None:
         log_error(f"There is no video at {acquisition_path}. Could not get number of available frames.")
         return None
-    if is_this_a_gcv(acquisition_path):
+    if acquisition_type == 'gcv':
         return get_number_of_available_frames_gcv(acquisition_path)
-    elif is_this_a_t16(acquisition_path):
+    elif acquisition_type == 't16':
         return get_number_of_available_frames_t16(acquisition_path)
-    elif is_this_a_t8(acquisition_path):
+    elif acquisition_type == 't8':
         return get_number_of_available_frames_t8(acquisition_path)
-    elif is_this_a_lcv(acquisition_path):
+    elif acquisition_type == 'lcv':
         return get_number_of_available_frames_lcv(acquisition_path)
-    elif is_this_a_mp4(acquisition_path):
+    elif acquisition_type == 'mp4':
         return get_number_of_available_frames_mp4(acquisition_path)
-    elif is_this_a_mov(acquisition_path):
+    elif acquisition_type == 'mov':
         return get_number_of_available_frames_mov(acquisition_path)
     else:
         log_error(f'Cannot get number of available frames for {acquisition_path}')
     return None
 
-def get_acquisition_frequency(acquisition_path:str, unit = None, verbose:Optional[int]=None) -> float:
-    if not is_this_a_video(acquisition_path):
+def get_acquisition_frequency(acquisition_path:str, unit = None, verbose:Optional[int]=None, acquisition_type:Optional[str]=None) -> float:
+    if acquisition_type is None:
+        acquisition_type = get_acquisition_type(acquisition_path)
+    if acquisition_type is None:
         log_error(f"There is no video at {acquisition_path}. Could not get acquisition frequency.")
         return -1.
-    if is_this_a_gcv(acquisition_path):
+    if acquisition_type == 'gcv':
         return get_acquisition_frequency_gcv(acquisition_path, unit=unit, verbose=verbose)
-    if is_this_a_t16(acquisition_path):
+    if acquisition_type == 't16':
         return get_acquisition_frequency_t16(acquisition_path, unit=unit)
-    if is_this_a_t8(acquisition_path):
+    if acquisition_type == 't8':
         return get_acquisition_frequency_t8(acquisition_path, unit=unit)
-    if is_this_a_mov(acquisition_path):
+    if acquisition_type == 'mov':
         return get_acquisition_frequency_mov(acquisition_path, unit=unit, verbose=verbose)
-    if is_this_a_mp4(acquisition_path):
+    if acquisition_type == 'mp4':
         return get_acquisition_frequency_mp4(acquisition_path, unit=unit, verbose=verbose)
     else:
         log_error(f"Could not get acquisition frequency for {acquisition_path}: returning -1.")
@@ -125,18 +151,19 @@ def get_acquisition_frequency(acquisition_path:str, unit = None, verbose:Optiona
 
 def get_acquisition_duration(acquisition_path:str, framenumbers:Optional[np.ndarray], unit = None, verbose:Optional[int]=None) -> Optional[float]:
     log_subtrace('func:get_acquisition_duration')
-    framenumbers = format_framenumbers(acquisition_path, framenumbers, verbose=verbose)
+    acquisition_type = get_acquisition_type(acquisition_path)
+    framenumbers = format_framenumbers(acquisition_path, framenumbers, verbose=verbose, acquisition_type=acquisition_type)
     if framenumbers is None:
         log_error("ERROR Wrong framenumber, couldnt format it")
         return None
 
-    if is_this_a_gcv(acquisition_path):
+    if acquisition_type == 'gcv':
         return get_acquisition_duration_gcv(acquisition_path, framenumbers=framenumbers, unit=unit, verbose=verbose)
-    elif is_this_a_t16(acquisition_path):
+    elif acquisition_type == 't16':
         return get_acquisition_duration_t16(acquisition_path, framenumbers=framenumbers, unit=unit)
     else:
         fns = len(framenumbers)
-        freq_hz = get_acquisition_frequency(acquisition_path, unit='Hz', verbose=verbose)
+        freq_hz = get_acquisition_frequency(acquisition_path, unit='Hz', verbose=verbose, acquisition_type=acquisition_type)
         try:
             duration_s = fns / freq_hz
             return duration_s
@@ -145,11 +172,24 @@ def get_acquisition_duration(acquisition_path:str, framenumbers:Optional[np.ndar
         log_error('Could not get acquisition duration')
         return None
 
-def format_framenumbers(acquisition_path:str, framenumbers:Framenumbers=None, verbose:Optional[int]=None) -> Optional[np.ndarray]:
-    if not is_this_a_video(acquisition_path):
+def format_framenumbers(acquisition_path:str, framenumbers:Framenumbers=None, verbose:Optional[int]=None, acquisition_type:Optional[str]=None) -> Optional[np.ndarray]:
+    if acquisition_type is None:
+        acquisition_type = get_acquisition_type(acquisition_path)
+    if acquisition_type is None:
         log_debug(f"There is no video at {acquisition_path}. Could not format the framenumbers {framenumbers}.")
         return None
-    number_of_available_frames = get_number_of_available_frames(acquisition_path)
+    number_of_available_frames = get_number_of_available_frames(acquisition_path, acquisition_type=acquisition_type)
+    return check_framenumbers(framenumbers, number_of_available_frames, verbose=verbose)
+
+def check_framenumbers(framenumbers:Framenumbers, number_of_available_frames:Optional[int], verbose:Optional[int]=None) -> Optional[np.ndarray]:
+    """
+    Formats the framenumbers as an array, and checks that they are compatible with the number of available frames.
+
+    :param framenumbers: The requested framenumbers (None means all the frames)
+    :param number_of_available_frames:
+    :param verbose:
+    :return:
+    """
     if number_of_available_frames is None:
         log_debug('No available frames. Formatted framenumber is None.')
         return None
@@ -160,59 +200,92 @@ def format_framenumbers(acquisition_path:str, framenumbers:Framenumbers=None, ve
     if framenumbers.min() < 0:
         log_error('Asked for negative framenumber ??')
         return None
-    if framenumbers.max() >= get_number_of_available_frames(acquisition_path):
-        log_error(f'Requested framenumber {framenumbers.max()} while there are only {get_number_of_available_frames(acquisition_path)} frames for this dataset.')
+    if framenumbers.max() >= number_of_available_frames:
+        log_error(f'Requested framenumber {framenumbers.max()} while there are only {number_of_available_frames} frames for this dataset.')
         return None
     return framenumbers
 
+def get_frame_geometry(acquisition_path:str, acquisition_type:Optional[str]=None) -> Optional[Tuple[int, int]]:
+    """
+    Gets the (height, width) of the frames of a video, from its metadata (no frame is decoded).
+
+    :param acquisition_path:
+    :param acquisition_type:
+    :return:
+    """
+    if acquisition_type is None:
+        acquisition_type = get_acquisition_type(acquisition_path)
+    if acquisition_type == 'gcv':
+        return get_frame_geometry_gcv(acquisition_path)
+    elif acquisition_type == 't16' or acquisition_type == 't8':
+        return get_frame_geometry_tiff(acquisition_path)
+    elif acquisition_type == 'lcv':
+        return get_frame_geometry_lcv(acquisition_path)
+    elif acquisition_type == 'mp4':
+        return get_frame_geometry_mp4(acquisition_path)
+    elif acquisition_type == 'mov':
+        return get_frame_geometry_mov(acquisition_path)
+    log_error(f'Cannot get frame geometry: there is no video at {acquisition_path}')
+    return None
+
+def crop_geometry(height:int, width:int, subregion:Subregion = None) -> Tuple[int, int]:
+    """
+    The (height, width) of frames of shape (height, width) once cropped to the subregion, without touching any frame.
+
+    :param height:
+    :param width:
+    :param subregion:
+    :return:
+    """
+    if subregion is None:
+        return height, width
+    start_x, start_y, end_x, end_y = subregion
+    return len(range(height)[start_y:end_y]), len(range(width)[start_x:end_x])
+
 def get_geometry(acquisition_path:str, framenumbers:Framenumbers = None, subregion:Subregion = None, verbose:Optional[int]=None) -> Optional[Tuple]:
     log_subtrace('func:get_geometry')
-    if not is_this_a_video(acquisition_path):
+    acquisition_type = get_acquisition_type(acquisition_path)
+    if acquisition_type is None:
         log_error(f"There is no video at {acquisition_path}. Could not get geometry.")
         return None
-    formatted_fns = format_framenumbers(acquisition_path, framenumbers, verbose=verbose)
+    formatted_fns = format_framenumbers(acquisition_path, framenumbers, verbose=verbose, acquisition_type=acquisition_type)
     if formatted_fns is None: return None
 
     length = formatted_fns.size
 
-    frame = get_frame(acquisition_path, int(formatted_fns[0]), subregion=subregion, verbose=verbose)
+    frame_geometry = get_frame_geometry(acquisition_path, acquisition_type=acquisition_type)
 
-    if frame is None: return None
+    if frame_geometry is None: return None
 
-    height, width = frame.shape
+    height, width = crop_geometry(*frame_geometry, subregion=subregion)
 
     return length, height, width
 
-def get_frames(acquisition_path:str, framenumbers:Framenumbers=None, subregion:Subregion = None, verbose:Optional[int]=None) -> Optional[np.ndarray]:
-    if not is_this_a_video(acquisition_path):
+def get_frames(acquisition_path:str, framenumbers:Framenumbers=None, subregion:Subregion = None, verbose:Optional[int]=None,
+               use_memmap:bool = False) -> Optional[np.ndarray]:
+    """
+    Gets the frames of a video.
+
+    :param acquisition_path:
+    :param framenumbers: The framenumbers (None means all the frames)
+    :param subregion: The region to crop (start_x, start_y, end_x, end_y)
+    :param verbose:
+    :param use_memmap: For GCV videos, return (read-only) views on the memory-mapped rawvideo instead of copying the
+        frames in memory. See get_frames_rawvideo_memmap.
+    :return:
+    """
+    acquisition_type = get_acquisition_type(acquisition_path)
+    if acquisition_type is None:
         log_error(f"There is no video at {acquisition_path}. Could not get frames")
         return None
-    framenumbers = format_framenumbers(acquisition_path, framenumbers, verbose=verbose)
+    framenumbers = format_framenumbers(acquisition_path, framenumbers, verbose=verbose, acquisition_type=acquisition_type)
     if framenumbers is None:
         log_warn(f"No framenumbers specified: could not get frames for {acquisition_path}")
         return None
 
-    # Retrieve the frames
-    frames = None
-    if is_this_a_gcv(acquisition_path):
-        frames = get_frames_gcv(acquisition_path, framenumbers, verbose=verbose)
-    elif is_this_a_t16(acquisition_path):
-        frames = get_frames_t16(acquisition_path, framenumbers)
-    elif is_this_a_t8(acquisition_path):
-        frames = get_frames_t8(acquisition_path, framenumbers)
-    elif is_this_a_lcv(acquisition_path):
-        frames = get_frames_lcv(acquisition_path, framenumbers, verbose=verbose)
-    elif is_this_a_mp4(acquisition_path):
-        frames = get_frames_mp4(acquisition_path, framenumbers, verbose=verbose)
-    elif is_this_a_mov(acquisition_path):
-        frames = get_frames_mov(acquisition_path, framenumbers, verbose=verbose)
-    else:
-        log_subtrace('ERROR INCOMING func:get_frames')
-        log_error(f'Cannot get frames: there is no video at {acquisition_path}')
-        return None
-
-    # crop the subregion
-    frames = crop_frames(frames, subregion=subregion)
+    # Retrieve the frames, cropped to the subregion
+    frames = get_frames_of_type(acquisition_path, acquisition_type, framenumbers, verbose=verbose, use_memmap=use_memmap,
+                                subregion=subregion)
 
     # # reverse the y direction
     # # so that we can visualize with plt.imshow and origin='lower'
@@ -222,6 +295,44 @@ def get_frames(acquisition_path:str, framenumbers:Framenumbers=None, subregion:S
 
     return frames
 
+def get_frames_of_type(acquisition_path:str, acquisition_type:str, framenumbers:np.ndarray, verbose:Optional[int]=None,
+                       use_memmap:bool = False, subregion:Subregion = None) -> Optional[np.ndarray]:
+    """
+    Reads the (already formatted) framenumbers of a video whose type is known, without probing the video type again.
+
+    The frames are cropped to the subregion. When possible (GCV, uncompressed tiff) only the rows of the subregion are
+    read, otherwise the frames are read entirely and then cropped. Except with use_memmap, the result is a compact
+    array and not a view on the uncropped frames, so that these can be freed.
+
+    :param acquisition_path:
+    :param acquisition_type:
+    :param framenumbers:
+    :param verbose:
+    :param use_memmap: see get_frames
+    :param subregion:
+    :return:
+    """
+    if acquisition_type == 'gcv':
+        return get_frames_gcv(acquisition_path, framenumbers, verbose=verbose, use_memmap=use_memmap, subregion=subregion)
+
+    if acquisition_type == 't16':
+        return get_frames_t16(acquisition_path, framenumbers, subregion=subregion)
+    if acquisition_type == 't8':
+        return get_frames_t8(acquisition_path, framenumbers, subregion=subregion)
+
+    frames = None
+    if acquisition_type == 'lcv':
+        frames = get_frames_lcv(acquisition_path, framenumbers, verbose=verbose)
+    elif acquisition_type == 'mp4':
+        frames = get_frames_mp4(acquisition_path, framenumbers, verbose=verbose)
+    elif acquisition_type == 'mov':
+        frames = get_frames_mov(acquisition_path, framenumbers, verbose=verbose)
+    else:
+        log_subtrace('ERROR INCOMING func:get_frames')
+        log_error(f'Cannot get frames: there is no video at {acquisition_path}')
+        return None
+    return compact_crop_frames(frames, subregion=subregion)
+
 def get_frame(acquisition_path:str, framenumber:Optional[int], subregion:Subregion = None, verbose:Optional[int]=None) -> Optional[np.ndarray]:
     if not is_this_a_video(acquisition_path):
         log_error(f"There is no video at {acquisition_path}. Could not get frame {framenumber}.")
@@ -236,19 +347,20 @@ def get_frame(acquisition_path:str, framenumber:Optional[int], subregion:Subregi
     return frames[0]
 
 def get_times(acquisition_path:str, framenumbers:Optional[np.ndarray] = None, unit = None, verbose:Optional[int]=None) -> Optional[np.ndarray]:
-    framenumbers = format_framenumbers(acquisition_path, framenumbers, verbose=verbose)
+    acquisition_type = get_acquisition_type(acquisition_path)
+    framenumbers = format_framenumbers(acquisition_path, framenumbers, verbose=verbose, acquisition_type=acquisition_type)
     if framenumbers is None:
         log_error("ERROR Wrong framenumber, couldnt format it", verbose=verbose)
         return None
 
     # Retrieve the frames
     times = None
-    if is_this_a_gcv(acquisition_path):
+    if acquisition_type == 'gcv':
         times = get_times_gcv(acquisition_path, framenumbers, unit=unit, verbose=verbose)
-    elif is_this_a_t16(acquisition_path):
+    elif acquisition_type == 't16':
         times = (np.arange(framenumbers.max()+1) / get_acquisition_frequency_t16(acquisition_path))[framenumbers]
     else:
-        freq_hz = get_acquisition_frequency(acquisition_path, unit='Hz', verbose=verbose)
+        freq_hz = get_acquisition_frequency(acquisition_path, unit='Hz', verbose=verbose, acquisition_type=acquisition_type)
         try:
             times = framenumbers / freq_hz
             return times
@@ -259,46 +371,88 @@ def get_times(acquisition_path:str, framenumbers:Optional[np.ndarray] = None, un
 
     return times
 
-def missing_frames(acquisition_path: str, verbose:Optional[int]=None) -> List:
+def missing_runs(acquisition_path: str, verbose:Optional[int]=None) -> MissingRuns:
     """
-    Identifies missing frame in a video.
+    Identifies missing frame in a video, as runs of consecutive missing frames.
 
     :param acquisition_path:
     :param verbose:
-    :return:
+    :return: (starts, lengths), the first missing frame of each run and the number of missing frames in it, sorted.
     """
     if is_this_a_gcv(acquisition_path):
-        return missing_framenumbers_gcv(acquisition_path, verbose=verbose)
+        return missing_runs_gcv(acquisition_path, verbose=verbose)
     else:
         log_warn(f'Could not deduce the number of missing frames for video {acquisition_path}', verbose=verbose)
-    return []
+    return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+def missing_runs_to_chunks(missing_runs:MissingRuns) -> List:
+    """
+    Expands runs of missing frames into a list of chunks, each chunk being the list of the missing frames of a run.
+
+    :param missing_runs: (starts, lengths)
+    :return:
+    """
+    starts, lengths = missing_runs
+    return [list(start + np.arange(length)) for start, length in zip(starts, lengths) if length > 0]
+
+def intersect_missing_runs(missing_runs:MissingRuns, framenumbers:np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the missing frames which are in the given framenumbers.
+
+    :param missing_runs: (starts, lengths)
+    :param framenumbers:
+    :return: (missing_framenumbers, counts): the missing frames which are in framenumbers, sorted run by run,
+        and the number of them in each run.
+    """
+    starts, lengths = missing_runs
+    requested = np.unique(framenumbers)
+    first = np.searchsorted(requested, starts, side='left')
+    counts = np.searchsorted(requested, starts + lengths, side='left') - first
+    # indices of the requested framenumbers in [first, first+count) for each run, concatenated
+    offsets = np.repeat(first - (np.cumsum(counts) - counts), counts)
+    missing_framenumbers = requested[offsets + np.arange(np.sum(counts))]
+    return missing_framenumbers, counts
+
+def split_missing_frames(missing_framenumbers:np.ndarray, counts:np.ndarray) -> List:
+    """
+    Makes a list of chunks from the output of intersect_missing_runs, omitting the empty chunks.
+
+    :param missing_framenumbers:
+    :param counts:
+    :return:
+    """
+    chunks = np.split(missing_framenumbers, np.cumsum(counts)[:-1])
+    return [list(chunk) for chunk in chunks if len(chunk) > 0]
+
+def missing_frames(acquisition_path: str, verbose:Optional[int]=None) -> List:
+    """
+    Identifies missing frame in a video.
+
+    :param acquisition_path:
+    :param verbose:
+    :return:
+    """
+    return missing_runs_to_chunks(missing_runs(acquisition_path, verbose=verbose))
 
 def missing_frames_in_framenumbers(acquisition_path: str, framenumbers:Optional[np.ndarray]=None, verbose:Optional[int]=None) -> List:
     log_subtrace('func:get_acquisition_duration')
-    all_missing_chunks = missing_frames(acquisition_path, verbose=verbose)
+    all_missing_runs = missing_runs(acquisition_path, verbose=verbose)
     explicit_framenumbers = format_framenumbers(acquisition_path, framenumbers, verbose=verbose)
 
     # get the missing frames which are in the requested framenumbers
-    missing_chunks_in_framenumbers = []
-    for chunk in all_missing_chunks:
-        chunk_missing = []
-        for frame in chunk:
-            if frame in explicit_framenumbers:
-                chunk_missing.append(frame)
-        if len(chunk_missing) > 0:
-            missing_chunks_in_framenumbers.append(chunk_missing)
-
-    return missing_chunks_in_framenumbers
+    return split_missing_frames(*intersect_missing_runs(all_missing_runs, explicit_framenumbers))
 
 def are_there_missing_frames(acquisition_path: str, framenumbers:Optional[np.ndarray]=None, verbose:Optional[int]=None) -> bool:
-    missing_chunks = missing_frames_in_framenumbers(acquisition_path, framenumbers=framenumbers, verbose=verbose)
+    all_missing_runs = missing_runs(acquisition_path, verbose=verbose)
+    explicit_framenumbers = format_framenumbers(acquisition_path, framenumbers, verbose=verbose)
+    missing_framenumbers, counts = intersect_missing_runs(all_missing_runs, explicit_framenumbers)
 
-    nbr_of_missing_chunks = len(missing_chunks)
-    nbr_of_missing_frames = np.sum([len(chunk) for chunk in missing_chunks])
+    nbr_of_missing_chunks = np.count_nonzero(counts)
+    nbr_of_missing_frames = np.sum(counts)
 
     if  nbr_of_missing_chunks > 0:
         log_trace(f'There are {nbr_of_missing_chunks} missing chunks ({nbr_of_missing_frames} frames total)', verbose=verbose)
-        log_trace(f'Missing chunks: {missing_chunks}', verbose=verbose)
+        log_trace(f'Missing chunks: {split_missing_frames(missing_framenumbers, counts)}', verbose=verbose)
         return True
 
     log_trace('No missing frames', verbose=verbose)
@@ -366,6 +520,10 @@ from .reading_gcv import *
 
 from .reading_tiffs import *
 
+### COMPRESSED VIDEO (lcv, mp4, mov) READING
+
+from .reading_compressed import *
+
 ### LOSSLESSLY COMPRESSED VIDEO (lcv) READING
 
 from .reading_lcv import *
@@ -402,6 +560,11 @@ def crop_frames(frames, subregion:Subregion = None):
         return frames[:, start_y:end_y, start_x:end_x]
     return frames
 
+def compact_crop_frames(frames, subregion:Subregion = None):
+    """Crops the frames to the subregion, copying them if necessary so that the result does not keep the uncropped frames in memory."""
+    if frames is None: return None
+    return np.ascontiguousarray(crop_frames(frames, subregion=subregion))
+
 def crop_frame(frame, subregion:Subregion = None):
     return crop_frames(np.array([frame]), subregion=subregion)[0]
 
@@ -438,6 +601,22 @@ def resize_frame(frame, resize_factor:int = 1):
 
 from .saving_videos import *
 
+###### ACQUISITION HANDLE
+
+from .acquisition import *
+
+###### DATASET CATALOG
+
+from .catalog import *
+
+###### GCV CONVERSION
+
+from .saving_gcv import *
+
+###### BACKGROUND
+
+from .background import *
+
 ###### GET INFO
 def get_t_frames(acquisition_path:str, framenumbers:Framenumbers = None, verbose:Optional[int]=None) -> Optional[np.ndarray]:
     """Returns the time, in frames (integers)"""
@@ -0,0 +1,359 @@
+from typing import Optional, Any, Tuple, Dict, List, Union
+import numpy as np
+import os # to navigate in the directories
+import threading # to read the frames in the background
+import queue
+
+from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace, log_subtrace
+
+from . import Framenumbers, Subregion
+from . import get_acquisition_type, check_framenumbers, get_frame_geometry, crop_geometry, compact_crop_frames, get_frames_of_type
+from . import get_number_of_available_frames, get_acquisition_frequency
+from . import retrieve_meta, retrieve_stamps, get_camera_timestamps, get_rawvideo_path, missing_runs_gcv
+from . import MissingRuns, missing_runs_to_chunks, intersect_missing_runs, split_missing_frames
+from . import get_acquisition_duration_t16, get_acquisition_frequency_t16
+from . import get_frame_geometry_gcv, get_frames_gcv, memmap_rawvideo, capture_lcv, get_frames_lcv, capture_mp4, get_frames_mp4, capture_mov, get_frames_mov
+
+# The default number of frames per chunk when iterating over the frames of an acquisition
+default_chunk_size:int = 500
+# The default number of chunks read in advance, in the background, when iterating with prefetching
+default_prefetch_depth:int = 2
+
+###### PREFETCHING
+
+def prefetch(iterable, prefetch_depth:Optional[int] = None):
+    """
+    Iterates over an iterable while its next items are computed in advance, in a background thread.
+
+    This is used to read (and decode) the next chunks of frames while the current one is being analysed, so that the
+    disk and the CPU are never idle. At most prefetch_depth items wait in memory (in addition to the one being used):
+    with prefetch_depth=1, this is double buffering.
+
+    :param iterable:
+    :param prefetch_depth: The number of items computed in advance (default_prefetch_depth by default)
+    :return:
+    """
+    if prefetch_depth is None:
+        prefetch_depth = default_prefetch_depth
+    if prefetch_depth <= 0:
+        yield from iterable
+        return
+
+    items = queue.Queue(maxsize=prefetch_depth)
+    stop = threading.Event()
+    end_of_iteration = object()
+
+    def producer():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stop.is_set():
+                    break
+        except BaseException as e: # the exception is raised again in the main thread
+            items.put((end_of_iteration, e))
+            return
+        items.put((end_of_iteration, None))
+
+    thread = threading.Thread(target=producer, name='g2ltk-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, exception = items.get()
+            if item is end_of_iteration:
+                if exception is not None:
+                    raise exception
+                break
+            yield item
+    finally:
+        # if we stop before the end, tell the producer to stop and let it finish
+        stop.set()
+        while thread.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+###### ACQUISITION HANDLE
+
+class Acquisition:
+    """
+    A handle on the video of an acquisition.
+
+    The type of the video is detected once, and what does not change (number of frames, geometry, frequency,
+    meta, stamps) is cached, so that repeated calls do not probe the filesystem or the decoders again.
+    It exposes the same reading API as the datareading module, without the acquisition_path argument.
+
+    The file handles are kept open between calls: close the acquisition when done, or use it as a context manager
+        with datareading.open_acquisition(acquisition_path) as acquisition:
+            frames = acquisition.get_frames(framenumbers, subregion=roi)
+    """
+    def __init__(self, acquisition_path:str, acquisition_type:Optional[str] = None, verbose:Optional[int]=None,
+                 decoder:Optional[str] = None):
+        self._rawvideo_file:Optional[Any] = None # gcv
+        self._rawvideo_memmap:Optional[np.memmap] = None # gcv
+        self._video:Optional[Any] = None # lcv, mp4, mov
+        self._cache:Dict[str, Any] = {}
+
+        self.acquisition_path:str = acquisition_path
+        self.acquisition_type:Optional[str] = get_acquisition_type(acquisition_path) if acquisition_type is None else acquisition_type
+        self.verbose:Optional[int] = verbose
+        self.decoder:Optional[str] = decoder # for compressed videos, see reading_compressed.default_compressed_decoder
+
+    def __repr__(self) -> str:
+        return f"Acquisition('{self.acquisition_path}', type={self.acquisition_type})"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self) -> None:
+        """Releases the opened files and decoders. The acquisition can still be used afterward (they will be reopened)."""
+        if self._rawvideo_file is not None:
+            self._rawvideo_file.close()
+            self._rawvideo_file = None
+        self._rawvideo_memmap = None # the mapping is closed once the frames viewing it are deleted
+        if self._video is not None:
+            self._video.release()
+            self._video = None
+
+    def _cached(self, key:str, compute_fn):
+        if key not in self._cache:
+            self._cache[key] = compute_fn()
+        return self._cache[key]
+
+    ### GENERAL INFO
+
+    def is_a_video(self) -> bool:
+        return self.acquisition_type is not None
+
+    @property
+    def meta(self) -> Optional[Dict[str, str]]:
+        if self.acquisition_type != 'gcv':
+            return None
+        return self._cached('meta', lambda: retrieve_meta(self.acquisition_path))
+
+    @property
+    def stamps(self) -> Optional[Dict[str, np.ndarray]]:
+        if self.acquisition_type != 'gcv':
+            return None
+        return self._cached('stamps', lambda: retrieve_stamps(self.acquisition_path, verbose=self.verbose))
+
+    def get_number_of_available_frames(self) -> Optional[int]:
+        if not self.is_a_video():
+            log_error(f"There is no video at {self.acquisition_path}. Could not get number of available frames.")
+            return None
+        return self._cached('number_of_available_frames',
+                            lambda: get_number_of_available_frames(self.acquisition_path, acquisition_type=self.acquisition_type))
+
+    def get_acquisition_frequency(self, unit = None) -> float:
+        return self._cached(f'acquisition_frequency_{unit}',
+                            lambda: get_acquisition_frequency(self.acquisition_path, unit=unit, verbose=self.verbose,
+                                                              acquisition_type=self.acquisition_type))
+
+    def get_frame_geometry(self) -> Optional[Tuple[int, int]]:
+        if not self.is_a_video():
+            log_error(f"There is no video at {self.acquisition_path}. Could not get geometry.")
+            return None
+        if self.acquisition_type == 'gcv':
+            return self._cached('frame_geometry', lambda: get_frame_geometry_gcv(self.acquisition_path, meta=self.meta))
+        return self._cached('frame_geometry', lambda: get_frame_geometry(self.acquisition_path, acquisition_type=self.acquisition_type))
+
+    def format_framenumbers(self, framenumbers:Framenumbers=None) -> Optional[np.ndarray]:
+        if not self.is_a_video():
+            log_debug(f"There is no video at {self.acquisition_path}. Could not format the framenumbers {framenumbers}.")
+            return None
+        return check_framenumbers(framenumbers, self.get_number_of_available_frames(), verbose=self.verbose)
+
+    def get_geometry(self, framenumbers:Framenumbers = None, subregion:Subregion = None) -> Optional[Tuple]:
+        formatted_fns = self.format_framenumbers(framenumbers)
+        if formatted_fns is None: return None
+        frame_geometry = self.get_frame_geometry()
+        if frame_geometry is None: return None
+        height, width = crop_geometry(*frame_geometry, subregion=subregion)
+        return formatted_fns.size, height, width
+
+    ### TIME
+
+    def get_times(self, framenumbers:Framenumbers = None, unit = None) -> Optional[np.ndarray]:
+        framenumbers = self.format_framenumbers(framenumbers)
+        if framenumbers is None:
+            log_error("ERROR Wrong framenumber, couldnt format it", verbose=self.verbose)
+            return None
+        if self.acquisition_type == 'gcv':
+            return get_camera_timestamps(self.stamps, unit=unit)[framenumbers]
+        if self.acquisition_type == 't16':
+            return framenumbers / get_acquisition_frequency_t16(self.acquisition_path)
+        freq_hz = self.get_acquisition_frequency(unit='Hz')
+        try:
+            return framenumbers / freq_hz
+        except:
+            pass
+        log_error('Could not get times')
+        return None
+
+    def get_acquisition_duration(self, framenumbers:Framenumbers = None, unit = None) -> Optional[float]:
+        framenumbers = self.format_framenumbers(framenumbers)
+        if framenumbers is None:
+            log_error("ERROR Wrong framenumber, couldnt format it")
+            return None
+        if self.acquisition_type == 'gcv':
+            camera_timestamps = get_camera_timestamps(self.stamps, unit=unit)[framenumbers]
+            return np.max(camera_timestamps) - np.min(camera_timestamps)
+        if self.acquisition_type == 't16':
+            return get_acquisition_duration_t16(self.acquisition_path, framenumbers=framenumbers, unit=unit)
+        freq_hz = self.get_acquisition_frequency(unit='Hz')
+        try:
+            return len(framenumbers) / freq_hz
+        except:
+            pass
+        log_error('Could not get acquisition duration')
+        return None
+
+    ### MISSING FRAMES
+
+    def missing_runs(self) -> MissingRuns:
+        if self.acquisition_type == 'gcv':
+            return self._cached('missing_runs', lambda: missing_runs_gcv(self.acquisition_path, verbose=self.verbose, stamps=self.stamps))
+        log_warn(f'Could not deduce the number of missing frames for video {self.acquisition_path}', verbose=self.verbose)
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    def missing_frames(self) -> List:
+        return missing_runs_to_chunks(self.missing_runs())
+
+    def missing_frames_in_framenumbers(self, framenumbers:Framenumbers = None) -> List:
+        explicit_framenumbers = self.format_framenumbers(framenumbers)
+        return split_missing_frames(*intersect_missing_runs(self.missing_runs(), explicit_framenumbers))
+
+    def are_there_missing_frames(self, framenumbers:Framenumbers = None) -> bool:
+        explicit_framenumbers = self.format_framenumbers(framenumbers)
+        _, counts = intersect_missing_runs(self.missing_runs(), explicit_framenumbers)
+        return bool(np.sum(counts) > 0)
+
+    ### FRAMES
+
+    def _get_video(self) -> Optional[Any]:
+        if self._video is None:
+            capture_fn = {'lcv': capture_lcv, 'mp4': capture_mp4, 'mov': capture_mov}[self.acquisition_type]
+            self._video = capture_fn(self.acquisition_path, decoder=self.decoder)
+        return self._video
+
+    def _get_rawvideo_file(self) -> Any:
+        if self._rawvideo_file is None:
+            self._rawvideo_file = open(get_rawvideo_path(self.acquisition_path), 'rb')
+        return self._rawvideo_file
+
+    def _get_rawvideo_memmap(self) -> np.memmap:
+        if self._rawvideo_memmap is None:
+            self._rawvideo_memmap = memmap_rawvideo(self.acquisition_path, meta=self.meta)
+        return self._rawvideo_memmap
+
+    def get_frames(self, framenumbers:Framenumbers=None, subregion:Subregion = None, use_memmap:bool = False) -> Optional[np.ndarray]:
+        if not self.is_a_video():
+            log_error(f"There is no video at {self.acquisition_path}. Could not get frames")
+            return None
+        framenumbers = self.format_framenumbers(framenumbers)
+        if framenumbers is None:
+            log_warn(f"No framenumbers specified: could not get frames for {self.acquisition_path}")
+            return None
+
+        if self.acquisition_type == 'gcv' and use_memmap:
+            return get_frames_gcv(self.acquisition_path, framenumbers, verbose=self.verbose, subregion=subregion,
+                                  meta=self.meta, rawvideo_memmap=self._get_rawvideo_memmap())
+        elif self.acquisition_type == 'gcv':
+            return get_frames_gcv(self.acquisition_path, framenumbers, verbose=self.verbose, subregion=subregion,
+                                  meta=self.meta, rawvideo_file=self._get_rawvideo_file())
+        elif self.acquisition_type in ['lcv', 'mp4', 'mov']:
+            get_frames_fn = {'lcv': get_frames_lcv, 'mp4': get_frames_mp4, 'mov': get_frames_mov}[self.acquisition_type]
+            frames = get_frames_fn(self.acquisition_path, framenumbers, verbose=self.verbose, video=self._get_video())
+            return compact_crop_frames(frames, subregion=subregion)
+        return get_frames_of_type(self.acquisition_path, self.acquisition_type, framenumbers, verbose=self.verbose,
+                                  subregion=subregion)
+
+    def get_frame(self, framenumber:Optional[int], subregion:Subregion = None) -> Optional[np.ndarray]:
+        if framenumber is None:
+            log_warn(f"No framenumber specified: could not get frame for {self.acquisition_path}")
+            return None
+        frames = self.get_frames(np.array([framenumber]), subregion=subregion)
+        if frames is None:
+            log_warn(f"Could not get frame {framenumber} for {self.acquisition_path}")
+            return None
+        return frames[0]
+
+    def iter_frames(self, framenumbers:Framenumbers=None, subregion:Subregion = None, chunk_size:Optional[int] = None,
+                    use_memmap:bool = False, prefetch_depth:int = 0):
+        """
+        Iterates over the frames by chunks, so that long acquisitions can be processed with a bounded memory.
+
+        :param framenumbers: The framenumbers (None means all the frames)
+        :param subregion:
+        :param chunk_size: The maximum number of frames per chunk (default_chunk_size by default)
+        :param use_memmap: see get_frames
+        :param prefetch_depth: The number of chunks read in advance in a background thread (see prefetch). 0 means no prefetching.
+        :return: Yields (frames, framenumbers, times) for each chunk, times being in seconds.
+        """
+        if prefetch_depth > 0:
+            yield from prefetch(self.iter_frames(framenumbers, subregion=subregion, chunk_size=chunk_size,
+                                                 use_memmap=use_memmap, prefetch_depth=0),
+                                prefetch_depth=prefetch_depth)
+            return
+        if chunk_size is None:
+            chunk_size = default_chunk_size
+        framenumbers = self.format_framenumbers(framenumbers)
+        if framenumbers is None:
+            log_warn(f"No framenumbers specified: could not iterate over the frames of {self.acquisition_path}")
+            return
+        times = self.get_times(framenumbers, unit='s')
+        for chunk_start in range(0, len(framenumbers), chunk_size):
+            chunk_framenumbers = framenumbers[chunk_start:chunk_start + chunk_size]
+            chunk_times = None if times is None else times[chunk_start:chunk_start + chunk_size]
+            yield self.get_frames(chunk_framenumbers, subregion=subregion, use_memmap=use_memmap), chunk_framenumbers, chunk_times
+
+def open_acquisition(acquisition_path:str, verbose:Optional[int]=None, decoder:Optional[str] = None) -> Optional[Acquisition]:
+    """
+    Opens a handle on the video of an acquisition, see Acquisition.
+
+    :param acquisition_path:
+    :param verbose:
+    :param decoder: For compressed videos, 'bgr' or 'gray' (see reading_compressed.default_compressed_decoder)
+    :return: The acquisition, or None if there is no video at acquisition_path.
+    """
+    acquisition = Acquisition(acquisition_path, verbose=verbose, decoder=decoder)
+    if not acquisition.is_a_video():
+        log_error(f"There is no video at {acquisition_path}. Could not open the acquisition.")
+        return None
+    return acquisition
+
+def iter_frames(acquisition_path:str, framenumbers:Framenumbers=None, subregion:Subregion = None, chunk_size:Optional[int] = None,
+                verbose:Optional[int]=None, use_memmap:bool = False, prefetch_depth:int = 0):
+    """
+    Iterates over the frames of a video by chunks, so that long acquisitions can be processed with a bounded memory.
+
+        for frames, framenumbers, times in datareading.iter_frames(acquisition_path, chunk_size=1000):
+            ...
+
+    :param acquisition_path:
+    :param framenumbers: The framenumbers (None means all the frames)
+    :param subregion:
+    :param chunk_size: The maximum number of frames per chunk (default_chunk_size by default)
+    :param verbose:
+    :param use_memmap: see get_frames
+    :param prefetch_depth: The number of chunks read in advance in a background thread (see prefetch). 0 means no prefetching.
+    :return: Yields (frames, framenumbers, times) for each chunk, times being in seconds.
+    """
+    acquisition = open_acquisition(acquisition_path, verbose=verbose)
+    if acquisition is None:
+        return
+    with acquisition:
+        yield from acquisition.iter_frames(framenumbers, subregion=subregion, chunk_size=chunk_size, use_memmap=use_memmap,
+                                           prefetch_depth=prefetch_depth)
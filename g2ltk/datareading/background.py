@@ -0,0 +1,427 @@
+from typing import Optional, Any, Tuple, Dict, List, Union, Callable, Iterable
+import numpy as np
+import os # to navigate in the directories
+import time
+import hashlib # to identify the framenumbers
+from collections import OrderedDict
+
+from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace, log_subtrace
+
+from . import Framenumbers, Subregion
+from . import open_acquisition, get_acquisition_signature, prefetch, default_prefetch_depth
+
+# The number of background images kept in memory, see get_median_bckgnd
+median_bckgnd_cache_size:int = 4
+median_bckgnd_cache:OrderedDict = OrderedDict()
+# The signature of an acquisition (see get_acquisition_signature) stats all its files, e.g. all the images of a tiff
+# video: it is only computed again after this time (s), or when the acquisition folder changed
+median_bckgnd_signature_lifetime:float = 10.
+# acquisition_path -> (time, modification time of the acquisition folder, signature)
+median_bckgnd_signatures:Dict[str, Tuple[float, Optional[int], Optional[Tuple[int, ...]]]] = {}
+# The number of frame values whose histogram counters are indexed at once by streaming_median
+median_index_block_size:int = 2**20
+
+###### BACKGROUND
+
+# The frames without their background, median or rolling (see iter_frames_without_median_bckgnd and
+# iter_frames_without_rolling_bckgnd), are all shifted by the same offset so that their minimum over all the frames is
+# 0: whatever the background removed, the finders get the frames on the same scale.
+
+def iter_pixel_blocks(chunk:np.ndarray, block_size:int) -> Iterable[Tuple[np.ndarray, int]]:
+    """
+    Splits a chunk of frames (n, height, width) in blocks of rows, of at most block_size values (unless a single row is
+    longer). The blocks have all the frames of the chunk when possible, so that each counter is indexed many times.
+
+    :return: The blocks (views on the chunk), and the index of the first row of each block
+    """
+    length, height, width = chunk.shape
+    frames_per_block = max(1, min(length, block_size // max(width, 1)))
+    rows_per_block = max(1, block_size // max(frames_per_block * width, 1))
+    for i_frame in range(0, length, frames_per_block):
+        for start_y in range(0, height, rows_per_block):
+            yield chunk[i_frame:i_frame + frames_per_block, start_y:start_y + rows_per_block], start_y
+
+def streaming_median(iter_chunks:Callable[[], Iterable[np.ndarray]], height:int, width:int, length:int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the exact per-pixel median of 8-bits frames given by chunks, without having them all in memory.
+
+    The frames are read twice: the first pass counts, for each pixel, the values in 16 bins of 16 grey levels, which
+    tells in which bin the median is; the second pass counts the values in this bin only. This needs 16 counters per
+    pixel, instead of sorting the values of each pixel.
+
+    The indices of the counters (8 bytes per value) are computed by blocks of median_index_block_size values, in
+    buffers allocated once.
+
+    :param iter_chunks: A function returning a new iterator over the chunks of frames, shape (n, height, width) and dtype uint8
+    :param height:
+    :param width:
+    :param length: The total number of frames
+    :return: The median (float, same result as np.median) and the minimum (uint8) of each pixel.
+    """
+    n_pixels = height * width
+    n_bins = n_pixels * 16
+    pixel_bins = (np.arange(n_pixels, dtype=np.intp) * 16).reshape(height, width)
+    block_size = max(median_index_block_size, width)
+    index_buffer = np.empty(block_size, dtype=np.intp)
+    masked_buffer = np.empty(block_size, dtype=np.intp)
+
+    def block_bins(block:np.ndarray, start_y:int, low_bits:bool) -> Tuple[np.ndarray, slice]:
+        # the counters of the rows of the block: their indices, and where they are in the whole histogram
+        n_rows = block.shape[1]
+        index = index_buffer[:block.size].reshape(block.shape)
+        if low_bits:
+            np.bitwise_and(block, 15, out=index)
+        else:
+            np.right_shift(block, 4, out=index)
+        index += pixel_bins[:n_rows]
+        return index, slice(start_y * width * 16, (start_y + n_rows) * width * 16)
+
+    # first pass: histograms of the 4 high bits
+    coarse_hist = np.zeros(n_bins, dtype=np.int64)
+    minimum = np.full((height, width), 255, dtype=np.uint8)
+    for chunk in iter_chunks():
+        for block, start_y in iter_pixel_blocks(chunk, block_size):
+            index, bins = block_bins(block, start_y, low_bits=False)
+            coarse_hist[bins] += np.bincount(index.ravel(), minlength=bins.stop - bins.start)
+        np.minimum(minimum, chunk.min(axis=0), out=minimum)
+    coarse_cumsum = np.cumsum(coarse_hist.reshape(height, width, 16), axis=2)
+
+    # the median is the mean of the values of these ranks (they are the same if length is odd)
+    ranks = sorted({(length - 1) // 2, length // 2})
+    coarse_bins, residual_ranks = [], []
+    for rank in ranks:
+        coarse_bin = np.sum(coarse_cumsum <= rank, axis=2)
+        below = np.take_along_axis(coarse_cumsum, np.maximum(coarse_bin - 1, 0)[:, :, None], axis=2)[:, :, 0]
+        coarse_bins.append(coarse_bin.astype(np.uint8))
+        residual_ranks.append(rank - np.where(coarse_bin > 0, below, 0))
+
+    # second pass: histograms of the 4 low bits, only counting the values in the bin of the median
+    fine_hists = [np.zeros(n_bins, dtype=np.int64) for rank in ranks]
+    for chunk in iter_chunks():
+        for block, start_y in iter_pixel_blocks(chunk, block_size):
+            index, bins = block_bins(block, start_y, low_bits=True)
+            n_block_bins = bins.stop - bins.start
+            high_bits = block >> 4
+            masked = masked_buffer[:block.size].reshape(block.shape)
+            for coarse_bin, fine_hist in zip(coarse_bins, fine_hists):
+                # the values outside the bin are counted in an extra counter, which is discarded
+                masked.fill(n_block_bins)
+                np.copyto(masked, index, where=high_bits == coarse_bin[start_y:start_y + block.shape[1]])
+                fine_hist[bins] += np.bincount(masked.ravel(), minlength=n_block_bins + 1)[:n_block_bins]
+
+    values = []
+    for coarse_bin, residual_rank, fine_hist in zip(coarse_bins, residual_ranks, fine_hists):
+        fine_cumsum = np.cumsum(fine_hist.reshape(height, width, 16), axis=2)
+        fine_bin = np.sum(fine_cumsum <= residual_rank[:, :, None], axis=2)
+        values.append(coarse_bin.astype(float) * 16 + fine_bin)
+
+    return np.mean(values, axis=0), minimum
+
+def get_recent_acquisition_signature(acquisition_path:str) -> Optional[Tuple[int, ...]]:
+    """The signature of the acquisition (see get_acquisition_signature), reused if it was computed recently."""
+    folder_mtime = os.stat(acquisition_path).st_mtime_ns if os.path.isdir(acquisition_path) else None
+    cached = median_bckgnd_signatures.get(acquisition_path, None)
+    if cached is not None and cached[1] == folder_mtime and time.monotonic() - cached[0] < median_bckgnd_signature_lifetime:
+        return cached[2]
+    signature = get_acquisition_signature(acquisition_path)
+    signature = None if signature is None else tuple(signature)
+    median_bckgnd_signatures[acquisition_path] = (time.monotonic(), folder_mtime, signature)
+    return signature
+
+def get_median_bckgnd_stats(acquisition_path:str, framenumbers:Framenumbers = None, subregion:Subregion = None,
+                            chunk_size:Optional[int] = None, verbose:Optional[int]=None) -> Optional[Dict[str, np.ndarray]]:
+    """
+    The per-pixel median and minimum of the frames, computed by chunks (see streaming_median) and cached.
+
+    The arrays are those of the cache: they are read-only.
+
+    :return: {'median': ..., 'minimum': ...}, or None if there are no frames.
+    """
+    acquisition = open_acquisition(acquisition_path, verbose=verbose)
+    if acquisition is None:
+        return None
+    with acquisition:
+        framenumbers = acquisition.format_framenumbers(framenumbers)
+        if framenumbers is None or len(framenumbers) == 0:
+            log_warn(f"No framenumbers specified: could not compute the background of {acquisition_path}", verbose=verbose)
+            return None
+
+        cache_key = (acquisition_path, get_recent_acquisition_signature(acquisition_path),
+                     None if subregion is None else tuple(subregion), hashlib.sha256(framenumbers.astype(np.int64).tobytes()).digest())
+        if cache_key in median_bckgnd_cache:
+            median_bckgnd_cache.move_to_end(cache_key)
+            return median_bckgnd_cache[cache_key]
+
+        length, height, width = acquisition.get_geometry(framenumbers=framenumbers, subregion=subregion)
+
+        def iter_chunks():
+            chunks = acquisition.iter_frames(framenumbers, subregion=subregion, chunk_size=chunk_size)
+            for frames, _, _ in prefetch(chunks, prefetch_depth=default_prefetch_depth):
+                yield frames
+
+        first_frames = acquisition.get_frames(framenumbers[:1], subregion=subregion)
+        if first_frames.dtype == np.uint8:
+            log_debug(f'Computing the median background of {acquisition_path} by chunks', verbose=verbose)
+            median, minimum = streaming_median(iter_chunks, height, width, length)
+        else:
+            # the histograms are for 8-bits frames only
+            frames = acquisition.get_frames(framenumbers, subregion=subregion)
+            median, minimum = np.median(frames, axis=0), np.min(frames, axis=0)
+
+    median.setflags(write=False)
+    minimum.setflags(write=False)
+    stats = {'median': median, 'minimum': minimum}
+    median_bckgnd_cache[cache_key] = stats
+    while len(median_bckgnd_cache) > median_bckgnd_cache_size:
+        median_bckgnd_cache.popitem(last=False)
+    return stats
+
+def get_median_bckgnd(acquisition_path:str, framenumbers:Framenumbers = None, subregion:Subregion = None,
+                      chunk_size:Optional[int] = None, verbose:Optional[int]=None) -> Optional[np.ndarray]:
+    """
+    The median image of the frames, i.e. the background of the parts that move.
+
+    This is the same as np.median(frames, axis=0), but the frames are never all in memory (see streaming_median) and
+    the result is cached for the given acquisition, framenumbers and subregion (it is read-only).
+
+    :param acquisition_path:
+    :param framenumbers:
+    :param subregion:
+    :param chunk_size: The number of frames read at once (see iter_frames)
+    :param verbose:
+    :return:
+    """
+    stats = get_median_bckgnd_stats(acquisition_path, framenumbers=framenumbers, subregion=subregion,
+                                    chunk_size=chunk_size, verbose=verbose)
+    return None if stats is None else stats['median']
+
+def iter_frames_without_median_bckgnd(acquisition_path:str, framenumbers:Framenumbers = None, subregion:Subregion = None,
+                                      chunk_size:Optional[int] = None, prefetch_depth:int = 0, verbose:Optional[int]=None):
+    """
+    Same as iter_frames, but the median background is removed from the frames (as floats) and the result is shifted so
+    that its minimum over all the frames is 0.
+
+    This gives by chunks the same frames as
+        frames = frames - np.median(frames, axis=0, keepdims=True)
+        frames -= frames.min()
+
+    :return: Yields (frames, framenumbers, times) for each chunk.
+    """
+    stats = get_median_bckgnd_stats(acquisition_path, framenumbers=framenumbers, subregion=subregion,
+                                    chunk_size=chunk_size, verbose=verbose)
+    if stats is None:
+        return
+    median = stats['median']
+    # the minimum over all the frames of frames - median
+    offset = np.min(stats['minimum'] - median)
+
+    with open_acquisition(acquisition_path, verbose=verbose) as acquisition:
+        # (the acquisition exists, since we got its background)
+        for frames, chunk_framenumbers, times in acquisition.iter_frames(framenumbers, subregion=subregion, chunk_size=chunk_size,
+                                                                         prefetch_depth=prefetch_depth):
+            frames = frames.astype(float)
+            frames -= median
+            frames -= offset
+            yield frames, chunk_framenumbers, times
+
+### ROLLING BACKGROUND
+
+def rolling_histogram_dtype(window:int) -> type:
+    """The smallest integer type that can count up to window."""
+    if window < 2**8:
+        return np.uint8
+    if window < 2**16:
+        return np.uint16
+    return np.uint32
+
+def rolling_histogram_value(coarse_hist:np.ndarray, fine_hist:np.ndarray, rank:int) -> np.ndarray:
+    """
+    The value of the given rank (0 is the smallest) for each pixel, from its histogram.
+
+    :param coarse_hist: The counts of the 16 bins of 16 grey levels of each pixel, shape (16, n_pixels)
+    :param fine_hist: The counts of the 256 grey levels of each pixel, shape (256, n_pixels)
+    :param rank:
+    :return:
+    """
+    n_pixels = coarse_hist.shape[1]
+    coarse_cumsum = np.add.accumulate(coarse_hist, axis=0, dtype=np.int64)
+    coarse_bin = np.sum(coarse_cumsum <= rank, axis=0)
+    below = np.where(coarse_bin > 0, np.take_along_axis(coarse_cumsum, np.maximum(coarse_bin - 1, 0)[None, :], axis=0)[0], 0)
+    # the 16 grey levels of the bin, for each pixel
+    fine_indices = (coarse_bin * 16 * n_pixels)[None, :] + (np.arange(16)[:, None] * n_pixels + np.arange(n_pixels)[None, :])
+    fine_cumsum = np.add.accumulate(fine_hist.ravel()[fine_indices], axis=0, dtype=np.int64)
+    fine_bin = np.sum(fine_cumsum <= (rank - below)[None, :], axis=0)
+    return coarse_bin * 16 + fine_bin
+
+def sorted_insert(sorted_values:np.ndarray, n_values:int, values:np.ndarray) -> None:
+    """
+    Inserts a value in each column of sorted values, keeping them sorted.
+
+    :param sorted_values: The sorted values of each column (its n_values first rows), shape (>n_values, n_columns)
+    :param n_values: The number of values in each column
+    :param values: The values to insert, one per column
+    """
+    position = np.sum(sorted_values[:n_values] < values, axis=0)
+    rows = np.arange(n_values + 1)[:, None]
+    # the values after the position move one row further
+    inserted = np.where(rows < position, sorted_values[:n_values + 1], sorted_values[np.maximum(rows[:, 0] - 1, 0)])
+    np.copyto(inserted, values[None, :], where=rows == position)
+    sorted_values[:n_values + 1] = inserted
+
+def sorted_delete(sorted_values:np.ndarray, n_values:int, values:np.ndarray) -> None:
+    """
+    Deletes a value from each column of sorted values (see sorted_insert), keeping them sorted.
+
+    :param values: The values to delete (which are in the columns), one per column
+    """
+    position = np.sum(sorted_values[:n_values] < values, axis=0)
+    rows = np.arange(n_values - 1)[:, None]
+    # the values after the position move one row back
+    sorted_values[:n_values - 1] = np.where(rows < position, sorted_values[:n_values - 1], sorted_values[1:n_values])
+
+def remove_rolling_bckgnd(chunks:Iterable[np.ndarray], window:int, method:str = 'mean', percentile:float = 50.):
+    """
+    Removes from each frame the background of the frames just before it, i.e. the mean (or a percentile) of the
+    `window` previous frames. This follows slow drifts of the illumination, which a global background cannot.
+
+    The first `window` frames have no previous frames enough: they all get the background of the first `window` frames
+    (of which they are part). The frames after them never are part of their background.
+
+    The background is updated incrementally from one frame to the next: only the last `window` frames are kept, with
+    their sum (method 'mean') or, for the method 'percentile', the histogram of each pixel (8-bits frames) or its
+    values in order (other frames, updated by one insertion and one deletion per frame), so nothing is sorted.
+    The histograms take 272 counters per pixel whatever the window (1 byte each for windows under 256 frames), and the
+    ordered values as much memory as the kept frames. The result is not shifted (see iter_frames_without_rolling_bckgnd).
+
+    :param chunks: The chunks of frames, shape (n, height, width), e.g. from iter_frames
+    :param window: The number of frames of the background
+    :param method: 'mean' or 'percentile'
+    :param percentile: From 0 to 100, the percentile used with the method 'percentile' (50 is the median)
+    :return: Yields the chunks of frames (float) without their background.
+    """
+    if method not in ['mean', 'percentile']:
+        log_error(f'Unknown rolling background method {method}, it should be "mean" or "percentile"')
+        return
+    window = max(int(window), 1)
+
+    last_frames, total, coarse_hist, fine_hist, pixels, sorted_frames = None, None, None, None, None, None
+    use_histograms = False
+    n_frames_in = 0 # the number of frames that entered the background
+
+    def add_to_bckgnd(frame:np.ndarray) -> None:
+        nonlocal last_frames, total, coarse_hist, fine_hist, pixels, sorted_frames, use_histograms, n_frames_in
+        if last_frames is None:
+            last_frames = np.empty((window,) + frame.shape, dtype=frame.dtype)
+            total = np.zeros(frame.shape, dtype=np.int64 if frame.dtype == np.uint8 else float)
+            use_histograms = method == 'percentile' and frame.dtype == np.uint8
+            if use_histograms:
+                pixels = np.arange(frame.size)
+                hist_dtype = rolling_histogram_dtype(window)
+                coarse_hist = np.zeros((16, frame.size), dtype=hist_dtype)
+                fine_hist = np.zeros((256, frame.size), dtype=hist_dtype)
+            elif method == 'percentile':
+                sorted_frames = np.empty((window, frame.size), dtype=frame.dtype)
+
+        slot = n_frames_in % window
+        if n_frames_in >= window:
+            # the oldest frame leaves the window
+            old_frame = last_frames[slot]
+            if method == 'mean':
+                total -= old_frame
+            elif use_histograms:
+                coarse_hist[old_frame.ravel() >> 4, pixels] -= 1
+                fine_hist[old_frame.ravel(), pixels] -= 1
+            else:
+                sorted_delete(sorted_frames, window, old_frame.ravel())
+        if method == 'mean':
+            total += frame
+        elif use_histograms:
+            coarse_hist[frame.ravel() >> 4, pixels] += 1
+            fine_hist[frame.ravel(), pixels] += 1
+        else:
+            sorted_insert(sorted_frames, min(n_frames_in, window - 1), frame.ravel())
+        last_frames[slot] = frame
+        n_frames_in += 1
+
+    def get_bckgnd(shape:Tuple[int, ...]) -> np.ndarray:
+        n_frames = min(n_frames_in, window)
+        if method == 'mean':
+            return total / n_frames
+        # same interpolation as np.percentile
+        position = percentile / 100 * (n_frames - 1)
+        rank_low, rank_high = int(np.floor(position)), int(np.ceil(position))
+        if use_histograms:
+            value_low = rolling_histogram_value(coarse_hist, fine_hist, rank_low).astype(float)
+            value_high = value_low if rank_high == rank_low else rolling_histogram_value(coarse_hist, fine_hist, rank_high)
+        else:
+            value_low, value_high = sorted_frames[rank_low].astype(float), sorted_frames[rank_high].astype(float)
+        # (np.percentile interpolates from the closest value)
+        fraction = position - rank_low
+        if fraction < 0.5:
+            return (value_low + (value_high - value_low) * fraction).reshape(shape)
+        return (value_high - (value_high - value_low) * (1 - fraction)).reshape(shape)
+
+    # warm-up: the first frames are held until the window is full, to compute their common background
+    warmup_chunks = []
+    n_warmup_frames = 0
+    chunks = iter(chunks)
+    for frames in chunks:
+        warmup_chunks.append(frames)
+        for frame in frames[:window - n_warmup_frames]:
+            add_to_bckgnd(frame)
+        n_warmup_frames += len(frames)
+        if n_warmup_frames >= window:
+            break
+    if len(warmup_chunks) == 0:
+        return
+    warmup_bckgnd = get_bckgnd(warmup_chunks[0].shape[1:])
+
+    def chained_chunks():
+        yield from warmup_chunks
+        yield from chunks
+
+    i_frame_total = 0
+    for frames in chained_chunks():
+        frames_without_bckgnd = np.empty(frames.shape, dtype=float)
+        for i_frame, frame in enumerate(frames):
+            if i_frame_total < window:
+                np.subtract(frame, warmup_bckgnd, out=frames_without_bckgnd[i_frame])
+            else:
+                np.subtract(frame, get_bckgnd(frame.shape), out=frames_without_bckgnd[i_frame])
+                add_to_bckgnd(frame)
+            i_frame_total += 1
+        yield frames_without_bckgnd
+
+def iter_frames_without_rolling_bckgnd(acquisition_path:str, window:int, method:str = 'mean', percentile:float = 50.,
+                                       framenumbers:Framenumbers = None, subregion:Subregion = None,
+                                       chunk_size:Optional[int] = None, prefetch_depth:int = 0, verbose:Optional[int]=None):
+    """
+    Same as iter_frames, but the rolling background of the frames is removed (see remove_rolling_bckgnd), and the
+    result is shifted so that its minimum over all the frames is 0.
+
+    This offset is only known once all the frames are seen: the frames are read, and their background removed, twice.
+
+    :return: Yields (frames, framenumbers, times) for each chunk.
+    """
+    acquisition = open_acquisition(acquisition_path, verbose=verbose)
+    if acquisition is None:
+        return
+    with acquisition:
+        def iter_chunks():
+            chunks = acquisition.iter_frames(framenumbers, subregion=subregion, chunk_size=chunk_size, prefetch_depth=prefetch_depth)
+            chunks_framenumbers, chunks_times = [], []
+            def frames_of(chunks):
+                # remember the framenumbers and times of the chunks, to yield them with the frames
+                for frames, chunk_framenumbers, times in chunks:
+                    chunks_framenumbers.append(chunk_framenumbers)
+                    chunks_times.append(times)
+                    yield frames
+            for frames in remove_rolling_bckgnd(frames_of(chunks), window, method=method, percentile=percentile):
+                yield frames, chunks_framenumbers.pop(0), chunks_times.pop(0)
+
+        # the minimum over all the frames without their background
+        offset = min([frames.min() for frames, _, _ in iter_chunks() if frames.size > 0], default=0.)
+
+        for frames, chunk_framenumbers, times in iter_chunks():
+            frames -= offset
+            yield frames, chunk_framenumbers, times
@@ -0,0 +1,173 @@
+from typing import Optional, Any, Tuple, Dict, List, Union
+import numpy as np
+import os # to navigate in the directories
+import json # to save the catalog
+from concurrent.futures import ThreadPoolExecutor
+
+from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace, log_subtrace
+
+from . import Acquisition
+
+# The catalog of a root folder is saved in this file, in the root folder
+catalog_filename:str = '.g2ltk_catalog.json'
+# The default number of threads used to scan the datasets (this is mostly waiting for the disk)
+default_catalog_workers:int = 8
+
+Catalog = Dict[str, Dict[str, Any]]
+
+###### DATASET CATALOG
+
+def find_acquisition_candidates(dataset_path:str) -> List[str]:
+    """
+    Lists the names that could be acquisitions in a dataset, only from the names of the files (nothing is opened).
+
+    :param dataset_path:
+    :return:
+    """
+    candidates = set()
+    for f in os.listdir(dataset_path):
+        if os.path.isdir(os.path.join(dataset_path, f)):
+            candidates.add(f[:-4] if f.endswith('.gcv') else f) # gcv or tiffs
+        elif f.endswith('.mkv') or f.endswith('.mp4') or f.endswith('.MOV'):
+            candidates.add(f[:-4])
+    return sorted(candidates)
+
+def get_acquisition_mtime(acquisition_path:str) -> Optional[int]:
+    """The modification time (ns) of the file or folder containing the acquisition, or None if there is none."""
+    for path in [acquisition_path + '.gcv', acquisition_path, acquisition_path + '.mkv', acquisition_path + '.mp4', acquisition_path + '.MOV']:
+        if os.path.exists(path):
+            return os.stat(path).st_mtime_ns
+    return None
+
+def get_acquisition_signature(acquisition_path:str) -> Optional[List[int]]:
+    """
+    Identifies the state of an acquisition, to know whether it was modified.
+
+    For a folder (gcv, tiffs), the files inside are looked at: modifying a file in place (e.g. the rawvideo of a gcv)
+    does not change the modification time of its folder.
+
+    :param acquisition_path:
+    :return: [latest modification time (ns), total size (bytes)] of the files of the acquisition, or None if there is none.
+    """
+    for path in [acquisition_path + '.gcv', acquisition_path, acquisition_path + '.mkv', acquisition_path + '.mp4', acquisition_path + '.MOV']:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            mtime, size = stat.st_mtime_ns, stat.st_size
+            if os.path.isdir(path):
+                size = 0
+                for entry in os.scandir(path):
+                    if entry.is_file():
+                        stat = entry.stat()
+                        mtime, size = max(mtime, stat.st_mtime_ns), size + stat.st_size
+            return [mtime, size]
+    return None
+
+def scan_acquisition(acquisition_path:str, verbose:Optional[int]=None) -> Optional[Dict[str, Any]]:
+    """
+    Gets the description of an acquisition: type, geometry, number of frames and frequency.
+
+    :param acquisition_path:
+    :param verbose:
+    :return: The description, or None if there is no video there.
+    """
+    try:
+        with Acquisition(acquisition_path, verbose=verbose) as acquisition:
+            if not acquisition.is_a_video():
+                return None
+            height, width = acquisition.get_frame_geometry()
+            description = {'type': acquisition.acquisition_type,
+                           'height': int(height),
+                           'width': int(width),
+                           'number_of_frames': int(acquisition.get_number_of_available_frames()),
+                           'frequency': float(acquisition.get_acquisition_frequency(unit='Hz')),
+                           'signature': get_acquisition_signature(acquisition_path)}
+        return description
+    except Exception as e:
+        log_debug(f'Could not scan {acquisition_path}: {e}', verbose=verbose)
+        return None
+
+def scan_dataset(dataset_path:str, previous_entry:Optional[Dict[str, Any]] = None, n_workers:Optional[int] = None,
+                 verbose:Optional[int]=None) -> Dict[str, Any]:
+    """
+    Describes all the acquisitions of a dataset.
+
+    Only the acquisitions which were modified since the previous scan are scanned again.
+
+    :param dataset_path:
+    :param previous_entry: The entry of the dataset in the catalog, if it was already scanned.
+    :param n_workers: The number of threads (default_catalog_workers by default)
+    :param verbose:
+    :return: The entry of the dataset in the catalog, {'mtime': ..., 'acquisitions': {acquisition: description}}
+    """
+    previous_acquisitions = {} if previous_entry is None else previous_entry['acquisitions']
+    mtime = os.stat(dataset_path).st_mtime_ns
+    if previous_entry is not None and previous_entry['mtime'] == mtime:
+        # no acquisition was added or removed
+        candidates = list(previous_acquisitions.keys())
+    else:
+        candidates = find_acquisition_candidates(dataset_path)
+
+    acquisitions = {}
+    to_scan = []
+    for candidate in candidates:
+        description = previous_acquisitions.get(candidate, None)
+        if description is not None and description.get('signature', None) == get_acquisition_signature(os.path.join(dataset_path, candidate)):
+            acquisitions[candidate] = description
+        else:
+            to_scan.append(candidate)
+
+    if len(to_scan) > 0:
+        log_debug(f'Scanning {len(to_scan)} acquisitions in {dataset_path}', verbose=verbose)
+        with ThreadPoolExecutor(max_workers=n_workers or default_catalog_workers) as executor:
+            descriptions = executor.map(lambda candidate: scan_acquisition(os.path.join(dataset_path, candidate), verbose=verbose), to_scan)
+            for candidate, description in zip(to_scan, descriptions):
+                if description is not None:
+                    acquisitions[candidate] = description
+
+    return {'mtime': mtime, 'acquisitions': dict(sorted(acquisitions.items()))}
+
+def load_catalog(root_path:str, verbose:Optional[int]=None) -> Catalog:
+    catalog_path = os.path.join(root_path, catalog_filename)
+    if not os.path.isfile(catalog_path):
+        return {}
+    try:
+        with open(catalog_path, 'r') as catalog_file:
+            return json.load(catalog_file)
+    except Exception as e:
+        log_warn(f'Could not read the catalog {catalog_path}: {e}', verbose=verbose)
+        return {}
+
+def save_catalog(root_path:str, catalog:Catalog, verbose:Optional[int]=None) -> None:
+    catalog_path = os.path.join(root_path, catalog_filename)
+    try:
+        with open(catalog_path, 'w') as catalog_file:
+            json.dump(catalog, catalog_file, indent=1)
+    except Exception as e:
+        # the catalog is only a cache, e.g. we might not be allowed to write there
+        log_debug(f'Could not save the catalog {catalog_path}: {e}', verbose=verbose)
+
+def get_catalog(root_path:str, refresh:bool = True, n_workers:Optional[int] = None, verbose:Optional[int]=None) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    Describes all the acquisitions of all the datasets in a root folder.
+
+    The catalog is saved in the root folder (see catalog_filename), and only what was modified since then is scanned
+    again. The datasets are scanned concurrently.
+
+    :param root_path:
+    :param refresh: Whether to look for modifications. If False, the saved catalog is returned as is.
+    :param n_workers: The number of threads (default_catalog_workers by default)
+    :param verbose:
+    :return: {dataset: {acquisition: {'type', 'height', 'width', 'number_of_frames', 'frequency', 'signature'}}}
+    """
+    log_subtrace('func:get_catalog')
+    catalog = load_catalog(root_path, verbose=verbose)
+    if refresh or len(catalog) == 0:
+        datasets = sorted([d for d in os.listdir(root_path) if os.path.isdir(os.path.join(root_path, d))])
+        with ThreadPoolExecutor(max_workers=n_workers or default_catalog_workers) as executor:
+            entries = executor.map(lambda dataset: scan_dataset(os.path.join(root_path, dataset), previous_entry=catalog.get(dataset, None),
+                                                                n_workers=1, verbose=verbose), datasets)
+            new_catalog = dict(zip(datasets, entries))
+        if new_catalog != catalog:
+            save_catalog(root_path, new_catalog, verbose=verbose)
+        catalog = new_catalog
+    return {dataset: entry['acquisitions'] for dataset, entry in catalog.items() if len(entry['acquisitions']) > 0}
@@ -0,0 +1,349 @@
+from typing import Optional, Any, Tuple, Dict, List, Union
+import numpy as np
+import cv2 # to manipulate images and videos
+import os # to navigate in the directories
+import shutil # to find ffprobe
+import subprocess
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+
+from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace, log_subtrace
+
+# The program used to find the keyframes of the compressed videos (comes with ffmpeg). If it is not available, we
+# cannot know where the keyframes are, and compressed_max_grab_gap is used instead.
+ffprobe_executable:str = 'ffprobe'
+# Without keyframe index, we seek (instead of decoding the frames in between) if the next frame to read is further than this
+compressed_max_grab_gap:int = 32
+# video_path -> (size, modification time, keyframes)
+keyframes_cache:Dict[str, Tuple[int, int, Optional[np.ndarray]]] = {}
+# How the compressed videos are decoded (see set_compressed_decoder), by default
+#   'bgr': OpenCV converts the frames to BGR, and we keep the first channel.
+#   'gray': the BGR conversion is turned off, and OpenCV gives the decoded luma (Y) plane as single-channel uint8.
+#       This skips the conversion and divides the memory traffic by 3, but for YUV videos with a limited range (16-235)
+#       the values are not stretched to 0-255 as the BGR conversion does.
+default_compressed_decoder:str = 'bgr'
+compressed_decoders:List[str] = ['bgr', 'gray']
+# The maximum number of captures of compressed videos kept open, for all the videos (see pooled_capture)
+max_open_decoders:int = 8
+# (video_path, decoder) -> (size, modification time, capture), the most recently used last
+decoders_pool:'OrderedDict[Tuple[str, str], Tuple[int, int, Any]]' = OrderedDict()
+decoders_pool_lock = threading.Lock()
+# The number of processes decoding a compressed video in parallel, each one a segment of the requested frames
+# (see get_frames_compressed_parallel). 1 means no parallel decoding.
+compressed_decoding_workers:int = 1
+# Parallel decoding is used only if each process has at least that many frames to decode
+compressed_decoding_min_frames_per_worker:int = 200
+
+###### COMPRESSED VIDEO (lcv, mp4, mov) READING
+
+def find_keyframes(video_path:str, verbose:Optional[int]=None) -> Optional[np.ndarray]:
+    """
+    Finds the keyframes of a compressed video, using ffprobe.
+
+    Seeking in a compressed video means decoding from the keyframe before the target frame.
+
+    :param video_path:
+    :param verbose:
+    :return: The sorted framenumbers of the keyframes, or None if they could not be found.
+    """
+    ffprobe = shutil.which(ffprobe_executable)
+    if ffprobe is None:
+        log_debug(f'{ffprobe_executable} is not available: the keyframes of {video_path} are unknown', verbose=verbose)
+        return None
+    try:
+        result = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts,flags',
+                                 '-of', 'csv=p=0', video_path], capture_output=True, text=True, check=True)
+        pts, is_key = [], []
+        for line in result.stdout.splitlines():
+            fields = line.split(',')
+            if len(fields) < 2 or fields[0] in ['', 'N/A']:
+                continue
+            pts.append(int(fields[0]))
+            is_key.append('K' in fields[1])
+    except Exception as e:
+        log_debug(f'Could not find the keyframes of {video_path}: {e}', verbose=verbose)
+        return None
+    # the packets are in decoding order: the framenumber is the rank of the presentation timestamp
+    presentation_order = np.argsort(np.array(pts, dtype=np.int64), kind='stable')
+    keyframes = np.nonzero(np.array(is_key, dtype=bool)[presentation_order])[0]
+    log_trace(f'{len(keyframes)} keyframes in {video_path} ({len(pts)} frames)', verbose=verbose)
+    return keyframes
+
+def get_keyframes(video_path:str, verbose:Optional[int]=None) -> Optional[np.ndarray]:
+    """
+    Same as find_keyframes, but cached as long as the video file is not modified.
+    """
+    stat = os.stat(video_path)
+    cached = keyframes_cache.get(video_path, None)
+    if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+        return cached[2]
+    keyframes = find_keyframes(video_path, verbose=verbose)
+    keyframes_cache[video_path] = (stat.st_size, stat.st_mtime_ns, keyframes)
+    return keyframes
+
+def set_compressed_decoder(video:Any, decoder:Optional[str] = None) -> None:
+    """
+    Chooses how the frames of an opened capture are decoded.
+
+    :param video: The opened capture
+    :param decoder: 'bgr' or 'gray' (default_compressed_decoder by default)
+    :return:
+    """
+    if decoder is None:
+        decoder = default_compressed_decoder
+    if decoder not in compressed_decoders:
+        log_error(f'Unknown decoder {decoder}, it should be one of {compressed_decoders}. Using bgr.')
+        decoder = 'bgr'
+    video.set(cv2.CAP_PROP_CONVERT_RGB, 1 if decoder == 'bgr' else 0)
+
+@contextmanager
+def pooled_capture(video_path:str, capture_fn, decoder:Optional[str] = None):
+    """
+    Gives an opened capture of a compressed video, taken from the pool of open captures if possible.
+
+    Opening a capture, and seeking in it, is slow: the captures are kept open after use (at most max_open_decoders,
+    the least recently used are released), so that the next reads continue from where the previous ones stopped.
+    A capture is used by one caller at a time: if it is already in use, a new one is opened.
+
+        with pooled_capture(video_path, lambda: capture_mp4(acquisition_path)) as video:
+            ...
+
+    :param video_path: The path of the video file
+    :param capture_fn: The function opening a new capture (returns None on failure)
+    :param decoder: see set_compressed_decoder
+    :return:
+    """
+    key = (video_path, decoder or default_compressed_decoder)
+    stat = os.stat(video_path) if os.path.isfile(video_path) else None
+    video = None
+    with decoders_pool_lock:
+        if key in decoders_pool:
+            size, mtime, video = decoders_pool.pop(key)
+            if stat is None or size != stat.st_size or mtime != stat.st_mtime_ns: # the file was modified
+                video.release()
+                video = None
+    if video is None:
+        video = capture_fn()
+    try:
+        yield video
+    finally:
+        if video is not None and stat is not None:
+            return_to_pool(key, stat, video)
+        elif video is not None:
+            video.release()
+
+def return_to_pool(key:Tuple[str, str], stat:Any, video:Any) -> None:
+    to_release = []
+    with decoders_pool_lock:
+        if key in decoders_pool: # someone else put a capture of this video meanwhile
+            to_release.append(decoders_pool.pop(key)[2])
+        decoders_pool[key] = (stat.st_size, stat.st_mtime_ns, video)
+        while len(decoders_pool) > max(max_open_decoders, 0):
+            to_release.append(decoders_pool.popitem(last=False)[1][2])
+    for old_video in to_release:
+        old_video.release()
+
+def release_pooled_captures() -> None:
+    """Releases all the captures kept open (see pooled_capture)."""
+    with decoders_pool_lock:
+        videos = [video for _, _, video in decoders_pool.values()]
+        decoders_pool.clear()
+    for video in videos:
+        video.release()
+
+def plan_compressed_reads(framenumbers:np.ndarray, start_position:int, keyframes:Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Plans how to read frames from a compressed video, sequentially.
+
+    The frames are read in increasing order. Before reading a frame, we seek only if there is a keyframe between
+    the current position and the frame (the decoder would start from there anyway) or if we have to go back.
+    Otherwise, the frames in between are decoded and thrown away.
+
+    :param framenumbers:
+    :param start_position: The framenumber of the next frame the decoder would give
+    :param keyframes: The sorted framenumbers of the keyframes (see get_keyframes). If None, compressed_max_grab_gap is used.
+    :return: (unique_framenumbers, seek, inverse):
+        the frames to read in that order, whether to seek before reading each of them,
+        and the indices such that the requested frames are unique_framenumbers[inverse].
+    """
+    unique_framenumbers, inverse = np.unique(framenumbers, return_inverse=True)
+    positions = np.concatenate(([start_position], unique_framenumbers[:-1] + 1)) # the position of the decoder before each read
+    if keyframes is None or len(keyframes) == 0:
+        seek = unique_framenumbers - positions > compressed_max_grab_gap
+    else:
+        last_keyframes = keyframes[np.maximum(np.searchsorted(keyframes, unique_framenumbers, side='right') - 1, 0)]
+        seek = last_keyframes > positions
+    seek |= unique_framenumbers < positions
+    return unique_framenumbers, seek, inverse.reshape(-1)
+
+def read_frames_compressed(video:Any, framenumbers:np.ndarray, frames:np.ndarray,
+                           keyframes:Optional[np.ndarray] = None, video_path:Optional[str] = None) -> None:
+    """
+    Reads frames from an opened capture of a compressed video, following plan_compressed_reads.
+
+    :param video: The opened capture
+    :param framenumbers:
+    :param frames: The array in which the frames are written, of shape (len(framenumbers), height, width)
+    :param keyframes: see plan_compressed_reads
+    :param video_path: Only used in the error messages
+    :return:
+    """
+    position = int(video.get(cv2.CAP_PROP_POS_FRAMES))
+    # with the 'gray' decoder, the frames are decoded directly in the output, otherwise in a reused BGR buffer
+    native_gray = video.get(cv2.CAP_PROP_CONVERT_RGB) == 0
+    buffer = None if native_gray else np.empty((frames.shape[1], frames.shape[2], 3), np.uint8)
+    unique_framenumbers, seek, inverse = plan_compressed_reads(framenumbers, position, keyframes=keyframes)
+    # where each read frame goes in frames (a frame can be requested several times)
+    destinations = np.split(np.argsort(inverse, kind='stable'), np.cumsum(np.bincount(inverse, minlength=len(unique_framenumbers)))[:-1])
+    log_trace(f'Reading {len(unique_framenumbers)} frames from {video_path} with {np.sum(seek)} seeks')
+    if native_gray:
+        # OpenCV warns at each frame that it gives only the first plane of multiplanar (YUV) formats, which is what we want
+        opencv_log_level = cv2.utils.logging.getLogLevel()
+        cv2.utils.logging.setLogLevel(cv2.utils.logging.LOG_LEVEL_ERROR)
+    try:
+        read_planned_frames(video, unique_framenumbers, seek, destinations, frames, buffer, position, video_path)
+    finally:
+        if native_gray:
+            cv2.utils.logging.setLogLevel(opencv_log_level)
+
+def read_planned_frames(video:Any, unique_framenumbers:np.ndarray, seek:np.ndarray, destinations:List[np.ndarray],
+                        frames:np.ndarray, buffer:Optional[np.ndarray], position:int, video_path:Optional[str]) -> None:
+    for i_read, framenumber in enumerate(unique_framenumbers):
+        if seek[i_read]:
+            video.set(cv2.CAP_PROP_POS_FRAMES, framenumber)
+        else:
+            for _ in range(framenumber - position):
+                video.grab() # decodes, but skips the conversion
+        position = framenumber + 1
+
+        destination = destinations[i_read]
+        ret, frame = video.read(frames[destination[0]] if buffer is None else buffer)
+        if ret == False:
+            log_error(f'Error opening frame {framenumber} of video at {video_path}')
+            continue
+        if frame.ndim == 3:
+            frame = frame[:,:,0]
+        if len(destination) > 1 or not np.shares_memory(frame, frames[destination[0]]):
+            frames[destination] = frame
+
+def get_frames_compressed(video_path:str, video:Any, framenumbers:np.ndarray, verbose:Optional[int]=None,
+                          n_workers:Optional[int]=None) -> np.ndarray:
+    """
+    Reads frames from an opened capture of a compressed video.
+
+    :param video_path:
+    :param video: The opened capture
+    :param framenumbers:
+    :param verbose:
+    :param n_workers: The number of processes decoding in parallel (compressed_decoding_workers by default),
+        see get_frames_compressed_parallel.
+    :return:
+    """
+    height:int = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    width:int = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+    length:int = len(framenumbers)
+    keyframes = get_keyframes(video_path, verbose=verbose)
+
+    if n_workers is None:
+        n_workers = compressed_decoding_workers
+    n_workers = min(n_workers, len(np.unique(framenumbers)) // max(compressed_decoding_min_frames_per_worker, 1))
+    if n_workers > 1:
+        decoder = 'gray' if video.get(cv2.CAP_PROP_CONVERT_RGB) == 0 else 'bgr'
+        return get_frames_compressed_parallel(video_path, np.asarray(framenumbers), (height, width), n_workers,
+                                              decoder=decoder, keyframes=keyframes, verbose=verbose)
+
+    frames = np.empty([length, height, width], np.uint8)
+
+    read_frames_compressed(video, np.asarray(framenumbers), frames, keyframes=keyframes, video_path=video_path)
+
+    return frames
+
+###### PARALLEL DECODING
+
+def split_compressed_reads(unique_framenumbers:np.ndarray, n_segments:int, keyframes:Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Splits sorted framenumbers in segments of similar lengths, to be decoded independently.
+
+    When the keyframes are known, the segments start just after a keyframe, where the decoder has to seek anyway, so
+    that splitting costs no extra decoding.
+
+    :param unique_framenumbers: The sorted framenumbers
+    :param n_segments:
+    :param keyframes: see plan_compressed_reads
+    :return: The indices (in unique_framenumbers) of the starts of the segments, and len(unique_framenumbers) at the end.
+    """
+    length = len(unique_framenumbers)
+    ideal_starts = np.rint(np.arange(1, n_segments) * length / n_segments).astype(int)
+    if keyframes is None or len(keyframes) == 0:
+        starts = ideal_starts
+    else:
+        # indices where there is a keyframe between the previous frame and this one
+        last_keyframes = keyframes[np.maximum(np.searchsorted(keyframes, unique_framenumbers, side='right') - 1, 0)]
+        possible_starts = np.nonzero(last_keyframes[1:] > unique_framenumbers[:-1])[0] + 1
+        if len(possible_starts) == 0:
+            starts = np.array([], dtype=int)
+        else:
+            # the possible start closest to each ideal start
+            starts = possible_starts[np.argmin(np.abs(possible_starts[None, :] - ideal_starts[:, None]), axis=1)]
+    return np.unique(np.concatenate(([0], starts, [length])))
+
+def decode_segment(video_path:str, decoder:str, framenumbers:np.ndarray, keyframes:Optional[np.ndarray],
+                   shared_memory_name:str, shape:Tuple[int, int, int], first_index:int) -> None:
+    """
+    Decodes a segment of frames in a new capture, into the shared memory. This runs in a worker process.
+    """
+    shm = shared_memory.SharedMemory(name=shared_memory_name)
+    try:
+        frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        video = cv2.VideoCapture(video_path)
+        set_compressed_decoder(video, decoder)
+        read_frames_compressed(video, framenumbers, frames[first_index:first_index + len(framenumbers)],
+                               keyframes=keyframes, video_path=video_path)
+        video.release()
+        del frames # the shared memory can only be closed once nothing views it
+    finally:
+        shm.close()
+
+def get_frames_compressed_parallel(video_path:str, framenumbers:np.ndarray, geometry:Tuple[int, int], n_workers:int,
+                                   decoder:str = 'bgr', keyframes:Optional[np.ndarray] = None, verbose:Optional[int]=None) -> np.ndarray:
+    """
+    Reads frames from a compressed video with several processes, each one with its own capture.
+
+    The requested frames are sorted and split in segments at keyframes (see split_compressed_reads), and each
+    process decodes its segment directly into a shared memory array.
+    Starting the processes takes time: this is worth it for long reads (converting or analysing a whole video).
+
+    :param video_path:
+    :param framenumbers:
+    :param geometry: (height, width)
+    :param n_workers: The number of processes
+    :param decoder: see set_compressed_decoder
+    :param keyframes: see plan_compressed_reads
+    :param verbose:
+    :return:
+    """
+    unique_framenumbers, inverse = np.unique(framenumbers, return_inverse=True)
+    segments = split_compressed_reads(unique_framenumbers, n_workers, keyframes=keyframes)
+    shape = (len(unique_framenumbers), geometry[0], geometry[1])
+    log_debug(f'Decoding {shape[0]} frames of {video_path} in {len(segments) - 1} segments', verbose=verbose)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)), 1))
+    try:
+        # spawn: the decoders do not like to be forked
+        with ProcessPoolExecutor(max_workers=len(segments) - 1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(decode_segment, video_path, decoder, unique_framenumbers[start:stop], keyframes,
+                                       shm.name, shape, start)
+                       for start, stop in zip(segments[:-1], segments[1:])]
+            for future in futures:
+                future.result()
+        unique_frames = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        frames = unique_frames[inverse.reshape(-1)] # this copies the frames out of the shared memory
+        del unique_frames
+    finally:
+        shm.close()
+        shm.unlink()
+    return frames
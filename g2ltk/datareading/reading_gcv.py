@@ -2,15 +2,27 @@ from typing import Optional, Any, Tuple, Dict, List, Union
 import numpy as np
 import cv2 # to manipulate images and videos
 import os # to navigate in the directories
+import hashlib # to name the stamps cache files
+import warnings
 
 from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace
 from .. import utility, datasaving
 
-from . import are_there_missing_frames
+from . import are_there_missing_frames, missing_runs_to_chunks, Subregion, MissingRuns
 
 Meta = Dict[str, str]
 Stamps = Dict[str, np.ndarray]
 
+# When reading only some rows of consecutive frames, the bytes in between are read anyway (and thrown away) if there
+# are less than this, since a few more bytes cost less than one more seek.
+rawvideo_max_gap_bytes:int = 2**18
+# The maximum size of the buffer used for that
+rawvideo_max_buffer_bytes:int = 2**26
+# Whether the parsed stamps are cached in binary files, to be loaded faster the next time
+stamps_cache_enabled:bool = False
+# The folder of these cache files. It is not in the videos folders, which are left untouched.
+stamps_cache_dir:str = os.path.join(os.path.expanduser('~'), '.cache', 'g2ltk', 'stamps')
+
 ###### GEVCAPTURE VIDEO (gcv) READING
 
 def find_available_gcv(dataset_path: str) ->List[str]:
@@ -92,8 +104,38 @@ def get_times_gcv(acquisition_path:str, framenumbers:np.ndarray, unit=None, verb
 
     return times
 
-def get_frames_gcv(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None) -> Optional[np.ndarray]:
-    return get_frames_rawvideo(acquisition_path, framenumbers=framenumbers, verbose=verbose)
+def get_frame_geometry_gcv(acquisition_path:str, meta:Optional[Meta]=None) -> Tuple[int, int]:
+    if meta is None:
+        meta = retrieve_meta(acquisition_path)
+    height:int = int(meta.get('subRegionHeight', '0'))
+    width:int = int(meta.get('subRegionWidth', '0'))
+    return height, width
+
+def get_frames_gcv(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None,
+                   meta:Optional[Meta]=None, rawvideo_file:Optional[Any]=None,
+                   use_memmap:bool=False, rawvideo_memmap:Optional[np.memmap]=None, subregion:Subregion=None) -> Optional[np.ndarray]:
+    """
+    Reads frames from a GCV. If a subregion is given, the frames are cropped.
+
+    :param acquisition_path:
+    :param framenumbers:
+    :param verbose:
+    :param meta: The meta info of the acquisition, if already known.
+    :param rawvideo_file: An already opened (binary) rawvideo file, which is left open.
+    :param use_memmap: see get_frames_rawvideo_memmap
+    :param rawvideo_memmap: The already memory-mapped rawvideo
+    :param subregion:
+    :return:
+    """
+    if use_memmap or rawvideo_memmap is not None:
+        frames = get_frames_rawvideo_memmap(acquisition_path, framenumbers=framenumbers, verbose=verbose,
+                                            meta=meta, rawvideo_memmap=rawvideo_memmap)
+        if subregion is not None:
+            start_x, start_y, end_x, end_y = subregion
+            frames = frames[:, start_y:end_y, start_x:end_x]
+        return frames
+    return get_frames_rawvideo(acquisition_path, framenumbers=framenumbers, verbose=verbose,
+                               meta=meta, rawvideo_file=rawvideo_file, subregion=subregion)
 
 ### META READING
 
@@ -121,33 +163,108 @@ def retrieve_meta(acquisition_path: str) -> Meta:
 
 ### STAMPS READING
 
+def get_stamps_path(acquisition_path:str) -> str:
+    gcv_path = acquisition_path + '.gcv'
+    stamps_filename = [f for f in os.listdir(gcv_path) if f.endswith('.stamps')][0]
+    return os.path.join(gcv_path, stamps_filename)
+
 def retrieve_stamps(acquisition_path:str, verbose:Optional[int]=None) -> Stamps:
     """
     Gets all the stamps of a video
 
+    The stamps file is parsed at once (see parse_stamps). If stamps_cache_enabled, the result is cached in a .npy file
+    in stamps_cache_dir, which is used as long as the stamps file keeps the same size and modification time.
+
     :param video_path:
     :param verbose:
     :return:
     """
     # get the info in the .stamps file
     # camera time is in ns and computer time in ms
-    gcv_path = acquisition_path + '.gcv'
-    stamps_filename = [f for f in os.listdir(gcv_path) if f.endswith('.stamps')][0]
-    stamps_path = os.path.join(gcv_path, stamps_filename)
+    stamps_path = get_stamps_path(acquisition_path)
     if not(os.path.isfile(stamps_path)): raise(Exception(f'ERROR: Problem with the {acquisition_path} stamps file (it does not exist).'))
 
-    framenumber, camera_time, computer_time = [], [], []
+    stamps_stat = os.stat(stamps_path)
+    # the first row of the cache identifies the stamps file (size, modification time) and the cache format version
+    cache_key = np.array([stamps_stat.st_size, stamps_stat.st_mtime_ns, 1], dtype=np.int64)
+    cache_name = hashlib.sha1(os.path.abspath(stamps_path).encode()).hexdigest()
+    cache_path = os.path.join(stamps_cache_dir, cache_name + '.npy')
+    if stamps_cache_enabled and os.path.isfile(cache_path):
+        try:
+            cached = np.load(cache_path)
+            if cached.ndim == 2 and cached.shape[1] == 3 and np.array_equal(cached[0], cache_key):
+                log_trace(f'Stamps of {acquisition_path} loaded from the cache', verbose=verbose)
+                return {'framenumber': cached[1:, 0].astype(int),
+                        'camera_time': cached[1:, 1].copy(),
+                        'computer_time': cached[1:, 2].copy()}
+            log_debug(f'The stamps cache of {acquisition_path} is outdated', verbose=verbose)
+        except Exception as e:
+            log_debug(f'Could not load the stamps cache of {acquisition_path}: {e}', verbose=verbose)
+
     try:
-        with open(stamps_path, 'r') as stamps_file:
-            for line in stamps_file.readlines():
-                if line.count('\t') == 2:
-                    framenumber.append(line[:-1].split('\t')[0])     # The frame number, an integer from 0 to N-1 (N number of frames) (int)
-                    camera_time.append(line[:-1].split('\t')[1])     # The time given by the camera, in ns (int)
-                    computer_time.append(line[:-1].split('\t')[2])   # The time given by the computer, in ms (int)
-                else:
-                    throw_G2L_warning(f'Could not parse correctly the {acquisition_path} stamps file.')
+        with open(stamps_path, 'rb') as stamps_file:
+            stamps_data = stamps_file.read()
     except:
         raise(Exception(f'ERROR: Problem with the {acquisition_path} stamps file (probably it could not be opened).'))
+
+    stamps = parse_stamps(stamps_data, verbose=verbose)
+    if stamps is None:
+        # the file is not well-formed: parse it line by line, ignoring the bad lines
+        stamps = parse_stamps_linewise(stamps_data, acquisition_path)
+
+    if stamps_cache_enabled:
+        try:
+            os.makedirs(stamps_cache_dir, exist_ok=True)
+            # written aside and then renamed, so that a cache file is never seen half-written
+            partial_cache_path = f'{cache_path}.{os.getpid()}.partial'
+            with open(partial_cache_path, 'wb') as cache_file:
+                np.save(cache_file, np.vstack([cache_key[None, :],
+                                               np.stack([stamps['framenumber'], stamps['camera_time'], stamps['computer_time']], axis=1).astype(np.int64)]))
+            os.replace(partial_cache_path, cache_path)
+        except Exception as e:
+            # the cache is optional, e.g. we might not be allowed to write there
+            log_debug(f'Could not write the stamps cache of {acquisition_path}: {e}', verbose=verbose)
+    return stamps
+
+def parse_stamps(stamps_data:bytes, verbose:Optional[int]=None) -> Optional[Stamps]:
+    """
+    Parses the content of a well-formed stamps file at once.
+
+    Each line is made of 3 integers separated by tabs: the framenumber, the camera time (ns) and the computer time (ms).
+
+    :param stamps_data: The content of the stamps file
+    :param verbose:
+    :return: The stamps, or None if the file is not well-formed.
+    """
+    n_lines = stamps_data.count(b'\n')
+    if len(stamps_data) > 0 and not stamps_data.endswith(b'\n'):
+        n_lines += 1
+    if stamps_data.count(b'\t') != 2 * n_lines:
+        return None
+    try:
+        with warnings.catch_warnings():
+            # numpy only warns when it cannot parse the whole string
+            warnings.simplefilter('error')
+            values = np.fromstring(stamps_data.decode(), dtype=np.int64, sep=' ')
+    except (ValueError, OverflowError, UnicodeDecodeError, DeprecationWarning):
+        return None
+    if len(values) != 3 * n_lines:
+        return None
+    values = values.reshape((n_lines, 3))
+    log_trace(f'Parsed {n_lines} stamps', verbose=verbose)
+    return {'framenumber': values[:, 0].astype(int),
+            'camera_time': values[:, 1].copy(),
+            'computer_time': values[:, 2].copy()}
+
+def parse_stamps_linewise(stamps_data:bytes, acquisition_path:str) -> Stamps:
+    framenumber, camera_time, computer_time = [], [], []
+    for line in stamps_data.decode().splitlines():
+        if line.count('\t') == 2:
+            framenumber.append(line.split('\t')[0])     # The frame number, an integer from 0 to N-1 (N number of frames) (int)
+            camera_time.append(line.split('\t')[1])     # The time given by the camera, in ns (int)
+            computer_time.append(line.split('\t')[2])   # The time given by the computer, in ms (int)
+        else:
+            throw_G2L_warning(f'Could not parse correctly the {acquisition_path} stamps file.')
     #Todo: check if a typecasting error can happen here ?
     stamps:Stamps = {'framenumber': np.array(framenumber, dtype=int),
                      'camera_time': np.array(camera_time, dtype=np.int64),
@@ -159,6 +276,24 @@ def get_number_of_available_frames_stamps(acquisition_path: str) -> int:
     n_frames_tot:int = len(full_stamps['framenumber'])
     return n_frames_tot
 
+def missing_runs_gcv(acquisition_path: str, verbose:Optional[int]=None, stamps:Optional[Stamps]=None) -> MissingRuns:
+    """
+    Identifies missing frame in a GCV video using the timestamps, as runs of consecutive missing frames.
+
+    :param acquisition_path:
+    :param verbose:
+    :param stamps: The stamps of the video, if they are already known
+    :return: (starts, lengths)
+    """
+    if stamps is None:
+        stamps = retrieve_stamps(acquisition_path, verbose=verbose)
+    framenumbers = stamps['framenumber']
+    gaps = framenumbers[1:] - framenumbers[:-1] - 1
+    gaps_positions = np.where(gaps > 0)[0]
+    starts = framenumbers[gaps_positions] + 1 - framenumbers[0] # relative numerotation of framenumbers
+    lengths = gaps[gaps_positions]
+    return starts, lengths
+
 def missing_framenumbers_gcv(acquisition_path: str, verbose:Optional[int]=None) -> List:
     """
     Identifies missing frame in a GCV video using the timestamps.
@@ -167,17 +302,7 @@ def missing_framenumbers_gcv(acquisition_path: str, verbose:Optional[int]=None)
     :param verbose:
     :return:
     """
-    full_stamps = retrieve_stamps(acquisition_path)
-    framenumbers = full_stamps['framenumber']
-    gaps = framenumbers[1:] - framenumbers[:-1] - 1
-    missing_gaps = gaps[np.where(gaps != 0)[0]]
-    first_missing_frames = framenumbers[np.where(gaps != 0)[0]]+1
-    first_missing_frames -= framenumbers[0] # relative numerotation of framenumbers
-    all_missing_chunks = []
-    for i in range(len(missing_gaps)):
-        all_missing_chunks.append([])
-        for j in range(missing_gaps[i]):
-            all_missing_chunks[i].append(first_missing_frames[i] + j)
+    all_missing_chunks = missing_runs_to_chunks(missing_runs_gcv(acquisition_path, verbose=verbose))
     log_trace(f'Missing frames for {acquisition_path}:', verbose=verbose)
     log_trace(f'{all_missing_chunks}', verbose=verbose)
     return all_missing_chunks
@@ -355,16 +480,19 @@ def get_regularly_spaced_stamps(full_stamps:Stamps, start_framenumber:int = 0, e
 
 ## RAWVIDEO READING
 
-def get_number_of_available_frames_rawvideo(acquisition_path: str) -> int:
+def get_rawvideo_path(acquisition_path: str) -> str:
     gcv_path = acquisition_path + '.gcv'
     rawvideo_filename = [f for f in os.listdir(gcv_path) if f.endswith('.raw')][0]
     rawvideo_path = os.path.join(gcv_path, rawvideo_filename)
     if not(os.path.isfile(rawvideo_path)): raise(Exception(f'ERROR: Problem with the {acquisition_path} rawvideo file (it does not exist).'))
-    f = open(rawvideo_path, "rb")
-    f.seek(0, 2)
-    file_size:int = f.tell()
+    return rawvideo_path
+
+def get_number_of_available_frames_rawvideo(acquisition_path: str, meta:Optional[Meta]=None) -> int:
+    rawvideo_path = get_rawvideo_path(acquisition_path)
+    file_size:int = os.path.getsize(rawvideo_path)
 
-    meta:Meta = retrieve_meta(acquisition_path)
+    if meta is None:
+        meta = retrieve_meta(acquisition_path)
     img_w:int = int(meta.get('subRegionWidth', '0'))
     img_h:int = int(meta.get('subRegionHeight', '0'))
     img_s:int = img_w * img_h
@@ -373,38 +501,194 @@ def get_number_of_available_frames_rawvideo(acquisition_path: str) -> int:
         throw_G2L_warning('Bad formatting of rawvideo file')
     return n_frames_tot
 
-def get_frames_rawvideo(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None) -> Optional[np.ndarray]:
-    meta = retrieve_meta(acquisition_path)
+def get_frames_rawvideo(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None,
+                        meta:Optional[Meta]=None, rawvideo_file:Optional[Any]=None, subregion:Subregion=None) -> Optional[np.ndarray]:
+    """
+    Reads frames from the rawvideo file of a GCV.
+
+    If a subregion is given, only the rows of the subregion are read from the file, and the frames are returned as a
+    compact array (not a view on bigger frames).
+
+    :param acquisition_path:
+    :param framenumbers:
+    :param verbose:
+    :param meta: The meta info of the acquisition, if already known.
+    :param rawvideo_file: An already opened (binary) rawvideo file, which is left open.
+    :param subregion:
+    :return:
+    """
+    if meta is None:
+        meta = retrieve_meta(acquisition_path)
 
     width:int = int(meta.get('subRegionWidth', '0'))
     height:int = int(meta.get('subRegionHeight', '0'))
     length:int = len(framenumbers)
 
-    bytes_per_image:int = width * height
+    # the rows and columns we want
+    rows, columns = range(height), range(width)
+    if subregion is not None:
+        start_x, start_y, end_x, end_y = subregion
+        rows, columns = rows[start_y:end_y], columns[start_x:end_x]
+
+    bytes_per_image:int = width * len(rows)
     filesize:int = bytes_per_image * length
     if filesize > 10**9:
         pass
         #todo: warn here is filesize > 1 GB
 
-    frames = np.empty([length, height, width], np.uint8)
+    frames = np.empty([length, len(rows), width], np.uint8)
 
-    gcv_path = acquisition_path + '.gcv'
-    rawvideo_filename = [f for f in os.listdir(gcv_path) if f.endswith('.raw')][0]
-    rawvideo_path = os.path.join(gcv_path, rawvideo_filename)
-    if not(os.path.isfile(rawvideo_path)): raise(Exception(f'ERROR: Problem with the {acquisition_path} rawvideo file (it does not exist).'))
+    if length > 0 and len(rows) > 0:
+        if rawvideo_file is None:
+            with open(get_rawvideo_path(acquisition_path), 'rb') as file:
+                read_frames_rawvideo(file, framenumbers, frames, frame_height=height, start_y=rows.start)
+        else:
+            read_frames_rawvideo(rawvideo_file, framenumbers, frames, frame_height=height, start_y=rows.start)
 
-    if length > 1 and (framenumbers[1:] - framenumbers[:-1]).max() == 1:
-        # for some reason np.frombuffer is faster than np.fromfile if not in a loop... don't ask me why.
-        with open(rawvideo_path, 'rb') as file:
-            frames = np.frombuffer(file.read((framenumbers[-1]+1) * bytes_per_image),
-                                   dtype = np.uint8,
-                                   offset = framenumbers[0] * bytes_per_image,
-                                   count = bytes_per_image * length).reshape((length, height, width))
-    else:
-        for i_framenumber, framenumber in enumerate(framenumbers):
-            frames[i_framenumber] = np.fromfile(rawvideo_path,
-                                                dtype=np.uint8,
-                                                offset = framenumber * bytes_per_image ,
-                                                count = bytes_per_image).reshape((height, width))
+    if len(columns) < width:
+        frames = np.ascontiguousarray(frames[:, :, columns.start:columns.stop])
+    return frames
+
+def plan_rawvideo_reads(framenumbers:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Plans the reading of framenumbers: they are sorted, and the consecutive ones are coalesced into runs,
+    so that each run can be read at once.
+
+    For example, if framenumbers is [7, 2, 3, 8, 2, 9]
+    Then the sorted unique framenumbers are [2, 3, 7, 8, 9], which are read as 2 runs:
+        run_starts = [0, 2] (position of the first frame of each run in the sorted unique framenumbers)
+        run_lengths = [2, 3]
+    and the frames are put back in the requested order with inverse = [2, 0, 1, 3, 0, 4].
+
+    :param framenumbers:
+    :return: unique_framenumbers, run_starts, run_lengths, inverse
+    """
+    unique_framenumbers, inverse = np.unique(framenumbers, return_inverse=True)
+    run_starts = np.concatenate(([0], np.flatnonzero(unique_framenumbers[1:] - unique_framenumbers[:-1] != 1) + 1))
+    run_lengths = np.diff(np.concatenate((run_starts, [len(unique_framenumbers)])))
+    return unique_framenumbers, run_starts, run_lengths, inverse.reshape(-1)
+
+def read_frames_rawvideo(file:Any, framenumbers:np.ndarray, frames:np.ndarray,
+                         frame_height:Optional[int]=None, start_y:int=0) -> np.ndarray:
+    """
+    Reads the framenumbers from an opened rawvideo file into frames, an array of shape (length, rows, width).
+
+    Each run of consecutive frames (see plan_rawvideo_reads) is read at once, directly at its position in the file,
+    so that the cost only depends on the number of frames requested and not on where they are in the file.
+
+    To read only some rows of the frames, give the real frame_height and the first row to read, start_y. Then only the
+    byte ranges containing those rows are read (see rawvideo_max_gap_bytes).
 
+    :param file:
+    :param framenumbers:
+    :param frames:
+    :param frame_height: The height of the frames in the file (by default, the height of frames)
+    :param start_y: The first row to read
+    :return:
+    """
+    length, n_rows, width = frames.shape
+    if frame_height is None:
+        frame_height = n_rows
+    bytes_per_image:int = width * frame_height
+    bytes_per_band:int = width * n_rows # the bytes we want in each frame
+    band_offset:int = width * start_y
+
+    unique_framenumbers, run_starts, run_lengths, inverse = plan_rawvideo_reads(framenumbers)
+
+    # if the framenumbers are sorted without duplicates, we can read directly in the output
+    are_sorted_and_unique:bool = len(unique_framenumbers) == length and (unique_framenumbers == framenumbers).all()
+    unique_frames = frames if are_sorted_and_unique else np.empty((len(unique_framenumbers), n_rows, width), np.uint8)
+
+    def readinto_exactly(buffer, n_bytes:int):
+        bytes_read = file.readinto(buffer)
+        if bytes_read != n_bytes:
+            raise(Exception(f'ERROR: Problem with the rawvideo file (could only read {bytes_read} bytes out of {n_bytes}).'))
+
+    for run_start, run_length in zip(run_starts, run_lengths):
+        first_framenumber:int = int(unique_framenumbers[run_start])
+        if bytes_per_band == bytes_per_image:
+            # whole frames: read the run at once
+            file.seek(first_framenumber * bytes_per_image)
+            readinto_exactly(unique_frames[run_start:run_start + run_length], run_length * bytes_per_image)
+        elif bytes_per_image - bytes_per_band <= rawvideo_max_gap_bytes:
+            # small gaps between the rows we want: read the run (by pieces), gaps included
+            frames_per_piece:int = max(1, rawvideo_max_buffer_bytes // bytes_per_image)
+            buffer = np.empty(min(frames_per_piece, run_length) * bytes_per_image, np.uint8)
+            for piece_start in range(0, run_length, frames_per_piece):
+                piece_length:int = min(frames_per_piece, run_length - piece_start)
+                n_bytes:int = (piece_length - 1) * bytes_per_image + bytes_per_band
+                file.seek((first_framenumber + piece_start) * bytes_per_image + band_offset)
+                readinto_exactly(buffer[:n_bytes], n_bytes)
+                bands = buffer[:piece_length * bytes_per_image].reshape((piece_length, bytes_per_image))[:, :bytes_per_band]
+                unique_frames[run_start + piece_start:run_start + piece_start + piece_length] = bands.reshape((piece_length, n_rows, width))
+        else:
+            # big gaps: read the rows of each frame separately
+            for i_frame in range(run_start, run_start + run_length):
+                file.seek(int(unique_framenumbers[i_frame]) * bytes_per_image + band_offset)
+                readinto_exactly(unique_frames[i_frame], bytes_per_band)
+
+    if are_sorted_and_unique:
+        return frames
+    # scatter the frames back in the requested order
+    np.take(unique_frames, inverse, axis=0, out=frames)
     return frames
+
+def memmap_rawvideo(acquisition_path:str, meta:Optional[Meta]=None) -> np.memmap:
+    """
+    Maps the whole rawvideo file of a GCV in memory (read-only), as an array of shape (length, height, width).
+    Nothing is read from the disk until the frames are actually used, and only the pages that are used are read.
+
+    :param acquisition_path:
+    :param meta: The meta info of the acquisition, if already known.
+    :return:
+    """
+    if meta is None:
+        meta = retrieve_meta(acquisition_path)
+    height, width = get_frame_geometry_gcv(acquisition_path, meta=meta)
+    length:int = get_number_of_available_frames_rawvideo(acquisition_path, meta=meta)
+    return np.memmap(get_rawvideo_path(acquisition_path), dtype=np.uint8, mode='r', shape=(length, height, width))
+
+def framenumbers_as_slice(framenumbers:np.ndarray) -> Optional[slice]:
+    """
+    Gives the slice equivalent to the framenumbers if they are regularly spaced and increasing (e.g. [3, 5, 7, 9]),
+    None otherwise.
+
+    :param framenumbers:
+    :return:
+    """
+    if len(framenumbers) == 0:
+        return None
+    start:int = int(framenumbers[0])
+    if len(framenumbers) == 1:
+        return slice(start, start + 1)
+    steps = framenumbers[1:] - framenumbers[:-1]
+    step:int = int(steps[0])
+    if step <= 0 or (steps != step).any():
+        return None
+    return slice(start, int(framenumbers[-1]) + 1, step)
+
+def get_frames_rawvideo_memmap(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None,
+                               meta:Optional[Meta]=None, rawvideo_memmap:Optional[np.memmap]=None) -> Optional[np.ndarray]:
+    """
+    Gets frames from the rawvideo file of a GCV without copying them, as a view on a memory-mapped rawvideo.
+    This is a view only if the framenumbers are regularly spaced (see framenumbers_as_slice), otherwise the
+    frames have to be copied.
+
+    The frames are read-only, and are read from the disk only when they are used: cropping them to a subregion
+    is also a view, and only the pages of the rawvideo containing the subregion will be read.
+
+    :param acquisition_path:
+    :param framenumbers:
+    :param verbose:
+    :param meta: The meta info of the acquisition, if already known.
+    :param rawvideo_memmap: The already memory-mapped rawvideo (see memmap_rawvideo).
+    :return:
+    """
+    if rawvideo_memmap is None:
+        rawvideo_memmap = memmap_rawvideo(acquisition_path, meta=meta)
+
+    framenumbers_slice = framenumbers_as_slice(framenumbers)
+    if framenumbers_slice is None:
+        log_trace(f'Framenumbers are not regularly spaced: memory-mapped frames are copied.', verbose=verbose)
+        return rawvideo_memmap[framenumbers]
+    return rawvideo_memmap[framenumbers_slice]
@@ -6,6 +6,8 @@ import os # to navigate in the directories
 from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace
 from .. import utility, datasaving
 
+from . import get_frames_compressed, set_compressed_decoder, pooled_capture
+
 ###### LOSSLESSLY COMPRESSED VIDEO (lcv) READING
 
 def find_available_lcv(dataset_path: str) ->List[str]:
@@ -20,14 +22,10 @@ def is_this_a_lcv(acquisition_path: str) -> bool:
     :param acquisition_path:
     :return:
     """
-    video:Optional[Any] = capture_lcv(acquisition_path)
-    if video is None:
-        return False
-    else:
-        video.release()
-        return True
+    with pooled_capture_lcv(acquisition_path) as video:
+        return video is not None
 
-def capture_lcv(acquisition_path:str) -> Optional[Any]:
+def capture_lcv(acquisition_path:str, decoder:Optional[str]=None) -> Optional[Any]:
     # This only captures LOSSLESSY COMPRESSED VIDEOS WITH CODEC FFV1 AND FILETYPE MKV
 
     # Check for existence
@@ -55,43 +53,53 @@ def capture_lcv(acquisition_path:str) -> Optional[Any]:
         print("Cannot read frames from video that is not losslessly compressed with codec FFV1")
         return None
 
-    return video
-
-def get_number_of_available_frames_lcv(acquisition_path: str) -> Optional[int]:
-    lcv = capture_lcv(acquisition_path)
-    n_framenumbers_tot:int = int(lcv.get(cv2.CAP_PROP_FRAME_COUNT))
-    lcv.release()
-    return n_framenumbers_tot
-
-def get_frames_lcv(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None) -> Optional[np.ndarray]:
-
-    # Capture the video
-    lcv = capture_lcv(acquisition_path)
-
-    height:int = int(lcv.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    width:int = int(lcv.get(cv2.CAP_PROP_FRAME_WIDTH))
-    length:int = len(framenumbers)
-
-    frames = np.empty([length, height, width], np.uint8)
+    set_compressed_decoder(video, decoder)
 
-    current_framenumber:int = framenumbers[0]
-    lcv.set(cv2.CAP_PROP_POS_FRAMES, current_framenumber)
-    for i_frame, framenumber in enumerate(framenumbers):
-        # Since the lcv is compressed, the reading without moving is optimized and faster
-        # so for speed purposes we avoid moving if we don't have to
-        if framenumber != current_framenumber + 1:
-            lcv.set(cv2.CAP_PROP_POS_FRAMES, framenumber)
+    return video
 
-        current_framenumber = framenumber
+def pooled_capture_lcv(acquisition_path:str, decoder:Optional[str]=None):
+    """
+    Same as capture_lcv, but the capture is kept open for the next calls, see reading_compressed.pooled_capture.
 
-        ret, frame = lcv.read()
-        if ret == False:
-            #Todo:ERROR here
-            print('Error opening frame')
-        else:
-            frames[i_frame] = frame[:,:,0]
+        with pooled_capture_lcv(acquisition_path) as video:
+            ...
+    """
+    return pooled_capture(acquisition_path + '.mkv', lambda: capture_lcv(acquisition_path, decoder=decoder), decoder=decoder)
 
-    lcv.release()
+def get_number_of_available_frames_lcv(acquisition_path: str) -> Optional[int]:
+    with pooled_capture_lcv(acquisition_path) as video:
+        if video is not None:
+            n_framenumbers_tot:int = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+            return n_framenumbers_tot
+    return None
+
+def get_frame_geometry_lcv(acquisition_path):
+    with pooled_capture_lcv(acquisition_path) as video:
+        if video is not None:
+            height:int = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            width:int = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+            return height, width
+    return None
+
+def get_frames_lcv(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None, video:Optional[Any]=None,
+                   decoder:Optional[str]=None, n_workers:Optional[int]=None) -> Optional[np.ndarray]:
+    """
+    Reads frames from a lcv video.
 
-    return frames
+    :param acquisition_path:
+    :param framenumbers:
+    :param verbose:
+    :param video: An already opened capture of the video, which is left open.
+    :param decoder: 'bgr' or 'gray', see reading_compressed.default_compressed_decoder (ignored if video is given)
+    :param n_workers: The number of decoding processes, see reading_compressed.compressed_decoding_workers
+    :return:
+    """
+    if video is not None:
+        return get_frames_compressed(acquisition_path + '.mkv', video, framenumbers, verbose=verbose, n_workers=n_workers)
+
+    # Capture the video (the capture is kept open, so that reading the next frames will not need to seek)
+    with pooled_capture_lcv(acquisition_path, decoder=decoder) as capture:
+        if capture is None:
+            return None
+        return get_frames_compressed(acquisition_path + '.mkv', capture, framenumbers, verbose=verbose, n_workers=n_workers)
 
@@ -6,6 +6,8 @@ import os # to navigate in the directories
 from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace, log_subtrace
 from .. import utility, datasaving
 
+from . import get_frames_compressed, set_compressed_decoder, pooled_capture
+
 ###### LOSSY COMPRESSED VIDEO (mp4) READING
 
 def find_available_mov(dataset_path: str) ->List[str]:
@@ -16,14 +18,10 @@ def find_available_mov(dataset_path: str) ->List[str]:
 
 def is_this_a_mov(acquisition_path: str) -> bool:
     log_subtrace(f'func:is_this_a_mov')
-    video:Optional[Any] = capture_mov(acquisition_path)
-    if video is None:
-        return False
-    else:
-        video.release()
-        return True
-
-def capture_mov(acquisition_path:str) -> Optional[Any]:
+    with pooled_capture_mov(acquisition_path) as video:
+        return video is not None
+
+def capture_mov(acquisition_path:str, decoder:Optional[str]=None) -> Optional[Any]:
     log_subtrace(f'func:capture_mov')
     # This only captures LOSSY COMPRESSED VIDEOS WITH CODEC H264 AND FILETYPE MP4
 
@@ -51,60 +49,59 @@ def capture_mov(acquisition_path:str) -> Optional[Any]:
     #     log_error(f"Codec is {codec}. Cannot read frames from video that is not lossy compressed with codec avc1")
     #     return None
 
+    set_compressed_decoder(video, decoder)
+
     return video
 
+def pooled_capture_mov(acquisition_path:str, decoder:Optional[str]=None):
+    """
+    Same as capture_mov, but the capture is kept open for the next calls, see reading_compressed.pooled_capture.
+
+        with pooled_capture_mov(acquisition_path) as video:
+            ...
+    """
+    return pooled_capture(acquisition_path + '.MOV', lambda: capture_mov(acquisition_path, decoder=decoder), decoder=decoder)
+
 def get_number_of_available_frames_mov(acquisition_path: str) -> Optional[int]:
-    video = capture_mov(acquisition_path)
-    if video is not None:
-        n_framenumbers_tot:int = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-        video.release()
-        return n_framenumbers_tot
+    with pooled_capture_mov(acquisition_path) as video:
+        if video is not None:
+            n_framenumbers_tot:int = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+            return n_framenumbers_tot
     return None
 
 def get_acquisition_frequency_mov(acquisition_path, unit='Hz', verbose=1):
-    video = capture_mov(acquisition_path)
-    if video is not None:
-        fps = video.get(cv2.CAP_PROP_FPS)
-        video.release()
-        return fps
+    with pooled_capture_mov(acquisition_path) as video:
+        if video is not None:
+            fps = video.get(cv2.CAP_PROP_FPS)
+            return fps
     return None
 
 def get_frame_geometry_mov(acquisition_path):
-    video = capture_mov(acquisition_path)
-    if video is not None:
-        height:int = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        width:int = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-        video.release()
-        return height, width
+    with pooled_capture_mov(acquisition_path) as video:
+        if video is not None:
+            height:int = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            width:int = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+            return height, width
     return None
 
-def get_frames_mov(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None) -> Optional[np.ndarray]:
-
-    # Capture the video
-    video = capture_mov(acquisition_path)
-
-    height:int = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    width:int = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-    length:int = len(framenumbers)
-
-    frames = np.empty([length, height, width], np.uint8)
-
-    current_framenumber:int = framenumbers[0]
-    video.set(cv2.CAP_PROP_POS_FRAMES, current_framenumber)
-    for i_frame, framenumber in enumerate(framenumbers):
-        # Since the mp4video is compressed, the reading without moving is optimized and faster
-        # so for speed purposes we avoid moving if we don't have to
-        if framenumber != current_framenumber + 1:
-            video.set(cv2.CAP_PROP_POS_FRAMES, framenumber)
-
-        current_framenumber = framenumber
-
-        ret, frame = video.read()
-        if ret == False:
-            log_error(f'Error opening frame {framenumber} of video at {acquisition_path}')
-        else:
-            frames[i_frame] = frame[:,:,0]
-
-    video.release()
+def get_frames_mov(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None, video:Optional[Any]=None,
+                   decoder:Optional[str]=None, n_workers:Optional[int]=None) -> Optional[np.ndarray]:
+    """
+    Reads frames from a mov video.
+
+    :param acquisition_path:
+    :param framenumbers:
+    :param verbose:
+    :param video: An already opened capture of the video, which is left open.
+    :param decoder: 'bgr' or 'gray', see reading_compressed.default_compressed_decoder (ignored if video is given)
+    :param n_workers: The number of decoding processes, see reading_compressed.compressed_decoding_workers
+    :return:
+    """
+    if video is not None:
+        return get_frames_compressed(acquisition_path + '.MOV', video, framenumbers, verbose=verbose, n_workers=n_workers)
 
-    return frames
\ No newline at end of file
+    # Capture the video (the capture is kept open, so that reading the next frames will not need to seek)
+    with pooled_capture_mov(acquisition_path, decoder=decoder) as capture:
+        if capture is None:
+            return None
+        return get_frames_compressed(acquisition_path + '.MOV', capture, framenumbers, verbose=verbose, n_workers=n_workers)
@@ -6,6 +6,14 @@ import os # to navigate in the directories
 from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace
 from .. import utility, datasaving
 
+from . import get_frames_compressed, set_compressed_decoder, pooled_capture
+
+# The size of the letters written by the Chronos camera in the timestamps
+chronos_letter_height:int = 23
+chronos_letter_width:int = 16
+# save directory -> table of the timestamps letters, see get_chronos_letters_table
+chronos_letters_tables:Dict[str, Dict[bytes, str]] = {}
+
 ###### LOSSY COMPRESSED VIDEO (mp4) READING
 
 def find_available_mp4(dataset_path: str) ->List[str]:
@@ -20,14 +28,10 @@ def is_this_a_mp4(acquisition_path: str) -> bool:
     :param acquisition_path:
     :return:
     """
-    video:Optional[Any] = capture_mp4(acquisition_path)
-    if video is None:
-        return False
-    else:
-        video.release()
-        return True
+    with pooled_capture_mp4(acquisition_path) as video:
+        return video is not None
 
-def capture_mp4(acquisition_path:str) -> Optional[Any]:
+def capture_mp4(acquisition_path:str, decoder:Optional[str]=None) -> Optional[Any]:
     # This only captures LOSSY COMPRESSED VIDEOS WITH CODEC H264 AND FILETYPE MP4
 
     # Check for existence
@@ -53,118 +57,131 @@ def capture_mp4(acquisition_path:str) -> Optional[Any]:
         log_error(f"Codec is {codec}. Cannot read frames from video that is not lossy compressed with codec avc1")
         return None
 
+    set_compressed_decoder(video, decoder)
+
     return video
 
+def pooled_capture_mp4(acquisition_path:str, decoder:Optional[str]=None):
+    """
+    Same as capture_mp4, but the capture is kept open for the next calls, see reading_compressed.pooled_capture.
+
+        with pooled_capture_mp4(acquisition_path) as video:
+            ...
+    """
+    return pooled_capture(acquisition_path + '.mp4', lambda: capture_mp4(acquisition_path, decoder=decoder), decoder=decoder)
+
 def get_number_of_available_frames_mp4(acquisition_path: str) -> Optional[int]:
-    lcv = capture_mp4(acquisition_path)
-    n_framenumbers_tot:int = int(lcv.get(cv2.CAP_PROP_FRAME_COUNT))
-    lcv.release()
-    return n_framenumbers_tot
+    with pooled_capture_mp4(acquisition_path) as video:
+        if video is not None:
+            n_framenumbers_tot:int = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+            return n_framenumbers_tot
+    return None
 
 
 def get_acquisition_frequency_mp4(acquisition_path, unit='Hz', verbose=1):
-    video = capture_mp4(acquisition_path)
-    if video is not None:
-        fps = video.get(cv2.CAP_PROP_FPS)
-        video.release()
-        return fps
+    with pooled_capture_mp4(acquisition_path) as video:
+        if video is not None:
+            fps = video.get(cv2.CAP_PROP_FPS)
+            return fps
     return None
 def get_frame_geometry_mp4(acquisition_path):
-    video = capture_mp4(acquisition_path)
-    if video is not None:
-        height:int = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        width:int = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
-        video.release()
-        return height, width
+    with pooled_capture_mp4(acquisition_path) as video:
+        if video is not None:
+            height:int = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            width:int = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+            return height, width
     return None
 
-def get_frames_mp4(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None) -> Optional[np.ndarray]:
-
-    # Capture the video
-    mp4video = capture_mp4(acquisition_path)
-
-    height:int = int(mp4video.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    width:int = int(mp4video.get(cv2.CAP_PROP_FRAME_WIDTH))
-    length:int = len(framenumbers)
-
-    frames = np.empty([length, height, width], np.uint8)
+def get_frames_mp4(acquisition_path:str, framenumbers:np.ndarray, verbose:Optional[int]=None, video:Optional[Any]=None,
+                   decoder:Optional[str]=None, n_workers:Optional[int]=None) -> Optional[np.ndarray]:
+    """
+    Reads frames from a mp4 video.
 
-    current_framenumber:int = framenumbers[0]
-    mp4video.set(cv2.CAP_PROP_POS_FRAMES, current_framenumber)
-    for i_frame, framenumber in enumerate(framenumbers):
-        # Since the mp4video is compressed, the reading without moving is optimized and faster
-        # so for speed purposes we avoid moving if we don't have to
-        if framenumber != current_framenumber + 1:
-            mp4video.set(cv2.CAP_PROP_POS_FRAMES, framenumber)
+    :param acquisition_path:
+    :param framenumbers:
+    :param verbose:
+    :param video: An already opened capture of the video, which is left open.
+    :param decoder: 'bgr' or 'gray', see reading_compressed.default_compressed_decoder (ignored if video is given)
+    :param n_workers: The number of decoding processes, see reading_compressed.compressed_decoding_workers
+    :return:
+    """
+    if video is not None:
+        return get_frames_compressed(acquisition_path + '.mp4', video, framenumbers, verbose=verbose, n_workers=n_workers)
 
-        current_framenumber = framenumber
+    # Capture the video (the capture is kept open, so that reading the next frames will not need to seek)
+    with pooled_capture_mp4(acquisition_path, decoder=decoder) as capture:
+        if capture is None:
+            return None
+        return get_frames_compressed(acquisition_path + '.mp4', capture, framenumbers, verbose=verbose, n_workers=n_workers)
 
-        ret, frame = mp4video.read()
-        if ret == False:
-            #Todo:ERROR here
-            print('Error opening frame')
-        else:
-            frames[i_frame] = frame[:,:,0]
+def get_chronos_letters_table(verbose:Optional[int]=None) -> Optional[Dict[bytes, str]]:
+    """
+    Gets the table to recognize the letters of the Chronos timestamps, from the saved letters dict.
 
-    mp4video.release()
+    The table maps each letter image, as packed bits (see read_chronos_timestamps_letters), to the letter.
+    It is cached for each save directory.
 
-    return frames
+    :param verbose:
+    :return:
+    """
+    save_directory = os.path.abspath(datasaving.save_directory)
+    if save_directory in chronos_letters_tables:
+        return chronos_letters_tables[save_directory]
 
-def get_chronos_timestamps_from_mp4_video(**parameters) -> Optional[np.ndarray]:
-    # Dataset selection
-    dataset = parameters.get('dataset', 'unspecified-dataset')
-    dataset_path = '../' + dataset
-    if not(os.path.isdir(dataset_path)):
-        print(f'ERROR: There is no dataset {dataset}.')
+    letters_dict_parameters = {'datatype': 'h264_timestamp_letters_dict'}
+    try:
+        letters_dict = datasaving.fetch_saved_data(letters_dict_parameters, verbose=verbose)
+    except:
+        letters_dict = None
+    if letters_dict is None:
         return None
 
-    # Acquisition selection
-    acquisition = parameters.get('acquisition', 'unspecified-acquisition')
-    acquisition_path = os.path.join(dataset_path, acquisition)
-    if not (is_this_a_mp4(acquisition_path)):
-        acquisition_path = acquisition_path.replace('tiff', 'mp4')
-        if not (is_this_a_mp4(acquisition_path)):
-            print(f'ERROR: There is no acquisition named {acquisition} for the dataset {dataset}.')
-            return None
+    table:Dict[bytes, str] = {}
+    for key in letters_dict.keys():
+        letter = np.asarray(letters_dict[key], dtype=float)
+        # only images made of 0 and 1 can be equal to a thresholded letter
+        if letter.shape == (chronos_letter_height, chronos_letter_width) and np.all((letter == 0) | (letter == 1)):
+            table.setdefault(np.packbits(letter.reshape(-1) == 1).tobytes(), key) # the first key wins
+    chronos_letters_tables[save_directory] = table
+    return table
 
-    # Parameters getting
-    roi = parameters.get('roi', None)
-    framenumbers = parameters.get('framenumbers', None)
+def read_chronos_timestamps_letters(frames:np.ndarray, verbose:Optional[int]=None) -> Optional[np.ndarray]:
+    """
+    Reads the letters of the timestamps written by the Chronos camera at the bottom of the frames.
 
-    # Data fetching
-    frames = get_frames_mp4(acquisition_path, framenumbers=framenumbers, subregion=roi)
+    The letters are thresholded, packed to bits and looked up in the letters table (see get_chronos_letters_table):
+    each distinct letter image is recognized once.
+
+    :param frames:
+    :param verbose:
+    :return: The letters, of shape (length, number of letters), or None if they could not be read.
+    """
     length, height, width = frames.shape
 
     raw_tstamps = frames[:, -40:, :]
 
     threshold_luminosity = 185
 
-    tstamps = raw_tstamps[:, 6:29, :] > threshold_luminosity
+    tstamps = raw_tstamps[:, 6:6 + chronos_letter_height, :] > threshold_luminosity
 
     # Separate the letters
     offset = 9
-    letter_width = 16
+    letter_width = chronos_letter_width
     n_letters = (tstamps.shape[2] - offset) // letter_width
 
-    letters = np.empty((tstamps.shape[0], n_letters, tstamps.shape[1], letter_width))
-
-    for i_frame in range(tstamps.shape[0]):
-        for i_letter in range(n_letters):
-            letters[i_frame][i_letter] = tstamps[i_frame, :,
-                                         offset + i_letter * letter_width:offset + (i_letter + 1) * letter_width]
+    letters = tstamps[:, :, offset:offset + n_letters * letter_width].reshape((length, tstamps.shape[1], n_letters, letter_width))
+    letters = letters.transpose((0, 2, 1, 3)) # frame, letter, row, column
 
     # Check that the letters are well formatted
-    residue = np.sum([np.sum([np.sum(letter) % 4 for letter in letter_sequence]) for letter_sequence in letters])
+    residue = np.sum(np.sum(letters, axis=(2, 3)) % 4)
     if residue > 0:
         # todo error here
         print("ERROR: non zero residue")
         return None
 
     # Fetch the dict
-    letters_dict_parameters = {'datatype': 'h264_timestamp_letters_dict'}
-    try:
-        letters_dict = datasaving.fetch_saved_data(letters_dict_parameters)
-    except:
+    letters_table = get_chronos_letters_table(verbose=verbose)
+    if letters_table is None:
         # todo error here
         print("ERROR: no timestamp letters dict saved")
         return None
@@ -172,14 +189,10 @@ def get_chronos_timestamps_from_mp4_video(**parameters) -> Optional[np.ndarray]:
     placeholder_letter = 'X'
 
     # Transform to letters
-    letters_formatted = np.full((letters.shape[0], letters.shape[1]), placeholder_letter, dtype=str)
-
-    for i_key, key in enumerate(letters_dict.keys()):
-        print(f'{i_key+1}/{len(letters_dict.keys())}\r', end='')
-        for i_frame in range(tstamps.shape[0]):
-            for i_letter in range(n_letters):
-                if letters_formatted[i_frame][i_letter] == placeholder_letter and (letters[i_frame][i_letter] == letters_dict[key]).all():
-                    letters_formatted[i_frame][i_letter] = key
+    packed_letters = np.packbits(letters.reshape((length * n_letters, -1)), axis=1)
+    distinct_letters, inverse = np.unique(packed_letters, axis=0, return_inverse=True)
+    distinct_keys = np.array([letters_table.get(packed.tobytes(), placeholder_letter) for packed in distinct_letters], dtype=str)
+    letters_formatted = distinct_keys[inverse.reshape(-1)].reshape((length, n_letters))
 
     # Check that it works
     if placeholder_letter in letters_formatted:
@@ -187,6 +200,37 @@ def get_chronos_timestamps_from_mp4_video(**parameters) -> Optional[np.ndarray]:
         print("ERROR: Unrecognized letter")
         return None
 
+    return letters_formatted
+
+def get_chronos_timestamps_from_mp4_video(**parameters) -> Optional[np.ndarray]:
+    # Dataset selection
+    dataset = parameters.get('dataset', 'unspecified-dataset')
+    dataset_path = '../' + dataset
+    if not(os.path.isdir(dataset_path)):
+        print(f'ERROR: There is no dataset {dataset}.')
+        return None
+
+    # Acquisition selection
+    acquisition = parameters.get('acquisition', 'unspecified-acquisition')
+    acquisition_path = os.path.join(dataset_path, acquisition)
+    if not (is_this_a_mp4(acquisition_path)):
+        acquisition_path = acquisition_path.replace('tiff', 'mp4')
+        if not (is_this_a_mp4(acquisition_path)):
+            print(f'ERROR: There is no acquisition named {acquisition} for the dataset {dataset}.')
+            return None
+
+    # Parameters getting
+    roi = parameters.get('roi', None)
+    framenumbers = parameters.get('framenumbers', None)
+
+    # Data fetching
+    from . import format_framenumbers, compact_crop_frames # defined after this module is imported
+    frames = compact_crop_frames(get_frames_mp4(acquisition_path, format_framenumbers(acquisition_path, framenumbers)), subregion=roi)
+
+    letters_formatted = read_chronos_timestamps_letters(frames)
+    if letters_formatted is None:
+        return None
+
     timestamps = [''.join(letters_sequence) for letters_sequence in letters_formatted]
 
     all_times = np.zeros(len(timestamps), dtype=float)
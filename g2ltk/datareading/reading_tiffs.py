@@ -2,14 +2,28 @@ from typing import Optional, Any, Tuple, Dict, List, Union
 import numpy as np
 import cv2 # to manipulate images and videos
 import os # to navigate in the directories
+import struct # to parse the tiff headers
+from concurrent.futures import ThreadPoolExecutor
 
 from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace
 from .. import utility, datasaving
 
+from . import Subregion
+
 ###### TIFF 16-BITS VIDEO (t16) READING
 from PIL import Image
 from PIL.TiffTags import TAGS
 
+# The number of threads decoding the tiff images
+tiff_decoding_workers:int = min(8, os.cpu_count() or 1)
+# acquisition_path -> (modification time of the folder, sorted names of the images)
+tiff_filenames_cache:Dict[str, Tuple[int, List[str]]] = {}
+# The layout of uncompressed tiff images: offset of the pixels, size of the file, type of the pixels, and the bytes
+# (position, content) of the header which must be the same in every image for the pixels to be at this offset
+TiffLayout = Tuple[int, int, np.dtype, List[Tuple[int, bytes]]]
+# acquisition_path -> (modification time of the folder, layout of the uncompressed images, see get_tiff_layout)
+tiff_layout_cache:Dict[str, Tuple[int, Optional[TiffLayout]]] = {}
+
 def find_available_tiffs(dataset_path: str) ->List[str]:
     available_acquisitions = [f for f in os.listdir(dataset_path) if os.path.isdir(os.path.join(dataset_path, f)) and
                               np.prod([tifffile.endswith('.tiff') for tifffile in os.listdir(os.path.join(dataset_path, f))])]
@@ -72,112 +86,212 @@ def is_this_a_t8(acquisition_path: str) -> bool:
 
 def get_number_of_available_frames_t16(acquisition_path: str) -> int:
     if is_this_a_t16(acquisition_path):
-        return len(os.listdir(acquisition_path))
+        return len(get_tiff_filenames(acquisition_path))
     else:
         return 0
 
 def get_number_of_available_frames_t8(acquisition_path: str) -> int:
     if is_this_a_t8(acquisition_path):
-        return len(os.listdir(acquisition_path))
+        return len(get_tiff_filenames(acquisition_path))
     else:
         return 0
 
-def get_frames_t16(acquisition_path:str, framenumbers:np.ndarray) -> Optional[np.ndarray]:
-
-    all_images = os.listdir(acquisition_path)
-    all_images.sort()
-
-    img_metaprobe = Image.open(os.path.join(acquisition_path, all_images[0]))
-    meta_dict = {TAGS[key] : img_metaprobe.tag[key] for key in img_metaprobe.tag_v2}
-
-    width:int = meta_dict['ImageWidth'][0]
-    height:int = meta_dict['ImageLength'][0]
-    length:int = len(framenumbers)
-
-    frames = np.empty([length, height, width], np.uint16)
-
-    for i_frame, framenumber in enumerate(framenumbers):
-        frames[i_frame] = cv2.imread(os.path.join(acquisition_path, all_images[framenumber]), cv2.IMREAD_UNCHANGED)
-
-    import time
-    from imagecodecs import imread
-    import matplotlib.pyplot as plt
-
-    frames = np.empty([length, height, width], np.uint16)
-
-
-    for i_frame, framenumber in enumerate(framenumbers):
-        frames[i_frame] = imread(os.path.join(acquisition_path, all_images[framenumber]), codec='tiff') # this is the fastest
-        # frames[i_frame] = cv2.imread(os.path.join(acquisition_path, all_images[framenumber]), cv2.IMREAD_UNCHANGED) # this is the 2nd fastest
-        # frames[i_frame] = np.array(Image.open(os.path.join(acquisition_path, all_images[framenumber]))) # this is the 3rd fastest
-
-    frames = (frames // 2**8).astype(np.uint8, copy=False)
-    log_info('Quality was degraded from 16-bits to 8-bits depth')
-
-    return frames
+def get_tiff_filenames(acquisition_path:str) -> List[str]:
+    """
+    The sorted names of the images of a tiff video.
 
-def get_frames_t16_conservequality(acquisition_path:str, framenumbers:np.ndarray) -> Optional[np.ndarray]:
+    The list is cached, and listed again only if the folder was modified.
 
+    :param acquisition_path:
+    :return:
+    """
+    mtime = os.stat(acquisition_path).st_mtime_ns
+    cached = tiff_filenames_cache.get(acquisition_path, None)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
     all_images = os.listdir(acquisition_path)
     all_images.sort()
+    tiff_filenames_cache[acquisition_path] = (mtime, all_images)
+    return all_images
+
+def get_frame_geometry_tiff(acquisition_path:str) -> Tuple[int, int]:
+    all_images = get_tiff_filenames(acquisition_path)
 
     img_metaprobe = Image.open(os.path.join(acquisition_path, all_images[0]))
     meta_dict = {TAGS[key] : img_metaprobe.tag[key] for key in img_metaprobe.tag_v2}
 
-    width:int = meta_dict['ImageWidth'][0]
     height:int = meta_dict['ImageLength'][0]
-    length:int = len(framenumbers)
-
-    frames = np.empty([length, height, width], np.uint16)
+    width:int = meta_dict['ImageWidth'][0]
+    return height, width
 
-    for i_frame, framenumber in enumerate(framenumbers):
-        frames[i_frame] = cv2.imread(os.path.join(acquisition_path, all_images[framenumber]), cv2.IMREAD_UNCHANGED)
+def get_tiff_layout(acquisition_path:str) -> Optional[TiffLayout]:
+    """
+    Finds where the pixels are in the images of a tiff video, if they are stored uncompressed in one block.
 
-    import time
-    from imagecodecs import imread
-    import matplotlib.pyplot as plt
+    Only the first image is parsed (the images of a video are written the same way), and the result is cached.
+    The header of the image and its StripOffsets entry are kept, to check that each image is indeed written the same
+    way before reading its pixels (see read_uncompressed_tiff).
 
-    frames = np.empty([length, height, width], np.uint16)
+    :param acquisition_path:
+    :return: (offset of the pixels, size of the file, type of the pixels, header bytes to check) or None if the images
+        are compressed (or stored in a way that would need decoding).
+    """
+    mtime = os.stat(acquisition_path).st_mtime_ns
+    cached = tiff_layout_cache.get(acquisition_path, None)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
 
+    layout = None
+    first_image_path = os.path.join(acquisition_path, get_tiff_filenames(acquisition_path)[0])
+    try:
+        with Image.open(first_image_path) as img_metaprobe:
+            tags = img_metaprobe.tag_v2
+            width:int = tags[256]
+            height:int = tags[257]
+            bits_per_sample = tags[258][0] if isinstance(tags[258], tuple) else tags[258]
+            compression = tags.get(259, 1)
+            samples_per_pixel = tags.get(277, 1)
+            strip_offsets = np.array(tags[273], dtype=np.int64).reshape(-1)
+            strip_byte_counts = np.array(tags[279], dtype=np.int64).reshape(-1)
+        with open(first_image_path, 'rb') as image_file:
+            header = image_file.read(8)
+            endianness = '>' if header[:2] == b'MM' else '<' # 'II' for little-endian (Intel), 'MM' for big-endian (Motorola)
+            magic, ifd_offset = struct.unpack(endianness + 'HI', header[2:8])
+            checks = [(0, header)]
+            if magic == 42: # not a BigTIFF
+                image_file.seek(ifd_offset)
+                n_entries, = struct.unpack(endianness + 'H', image_file.read(2))
+                entries = image_file.read(12 * n_entries)
+                for i_entry in range(n_entries):
+                    entry = entries[12 * i_entry:12 * (i_entry + 1)]
+                    tag, value_type, count = struct.unpack(endianness + 'HHI', entry[:8])
+                    if tag == 273: # StripOffsets
+                        checks.append((ifd_offset + 2 + 12 * i_entry, entry))
+                        value_size = 2 if value_type == 3 else 4
+                        if count * value_size > 4: # the entry points to the offsets
+                            pointer, = struct.unpack(endianness + 'I', entry[8:12])
+                            image_file.seek(pointer)
+                            checks.append((pointer, image_file.read(value_size)))
+        dtype = np.dtype({8: np.uint8, 16: np.uint16}.get(bits_per_sample, np.void)).newbyteorder(endianness)
+        strips_are_contiguous = np.array_equal(strip_offsets[1:], strip_offsets[:-1] + strip_byte_counts[:-1])
+        if magic == 42 and len(checks) > 1 and compression == 1 and samples_per_pixel == 1 and dtype.kind == 'u' \
+                and strips_are_contiguous and np.sum(strip_byte_counts) == height * width * dtype.itemsize:
+            layout = (int(strip_offsets[0]), os.path.getsize(first_image_path), dtype, checks)
+    except Exception as e:
+        log_debug(f'Could not parse the layout of {first_image_path}: {e}')
+    log_trace(f'Layout of the tiff images in {acquisition_path}: {None if layout is None else layout[:3]}')
+
+    tiff_layout_cache[acquisition_path] = (mtime, layout)
+    return layout
+
+def read_uncompressed_tiff(image_path:str, layout:TiffLayout, out:np.ndarray, start_y:int = 0) -> bool:
+    """
+    Reads the pixels of an uncompressed tiff image in out, at the offset given by layout (see get_tiff_layout).
 
-    for i_frame, framenumber in enumerate(framenumbers):
-        frames[i_frame] = imread(os.path.join(acquisition_path, all_images[framenumber]), codec='tiff') # this is the fastest
-        # frames[i_frame] = cv2.imread(os.path.join(acquisition_path, all_images[framenumber]), cv2.IMREAD_UNCHANGED) # this is the 2nd fastest
-        # frames[i_frame] = np.array(Image.open(os.path.join(acquisition_path, all_images[framenumber]))) # this is the 3rd fastest
+    Only the rows start_y:start_y+len(out) are read (out has the full width of the image).
 
-    return frames
+    :return: False if the image does not have the expected layout (then nothing is read).
+    """
+    offset, file_size, dtype, checks = layout
+    with open(image_path, 'rb') as image_file:
+        if os.fstat(image_file.fileno()).st_size != file_size:
+            return False
+        # the header and the position of the pixels must be those of the first image
+        for position, expected in checks:
+            image_file.seek(position)
+            if image_file.read(len(expected)) != expected:
+                return False
+        image_file.seek(offset + start_y * out.shape[-1] * dtype.itemsize)
+        if out.dtype == dtype:
+            return image_file.readinto(out) == out.nbytes
+        frame = np.empty(out.shape, dtype)
+        if image_file.readinto(frame) != frame.nbytes:
+            return False
+        out[...] = frame
+    return True
 
+def decode_tiff_frames(acquisition_path:str, framenumbers:np.ndarray, dtype:Any, to_8_bits:bool = False,
+                       subregion:Subregion = None) -> np.ndarray:
+    """
+    Decodes the images of a tiff video, each one once and directly into the output array.
 
-def get_frames_t8(acquisition_path:str, framenumbers:np.ndarray) -> Optional[np.ndarray]:
+    The images are decoded concurrently (see tiff_decoding_workers), imagecodecs releasing the GIL.
 
-    all_images = os.listdir(acquisition_path)
-    all_images.sort()
+    When the images are not compressed, their pixels are directly read in the output array, without decoding
+    (see get_tiff_layout), and only the rows of the subregion are read. The images which are compressed, or differ
+    from the first one, are decoded entirely and then cropped.
 
-    img_metaprobe = Image.open(os.path.join(acquisition_path, all_images[0]))
-    meta_dict = {TAGS[key] : img_metaprobe.tag[key] for key in img_metaprobe.tag_v2}
+    :param acquisition_path:
+    :param framenumbers:
+    :param dtype: The type of the data in the tiff files
+    :param to_8_bits: Whether to convert 16-bits data to 8-bits (keeping the most significant bits)
+    :param subregion:
+    :return: The frames, cropped to the subregion
+    """
+    from imagecodecs import imread
 
-    width:int = meta_dict['ImageWidth'][0]
-    height:int = meta_dict['ImageLength'][0]
+    all_images = get_tiff_filenames(acquisition_path)
+    height, width = get_frame_geometry_tiff(acquisition_path)
     length:int = len(framenumbers)
+    layout = get_tiff_layout(acquisition_path)
+
+    # the rows and columns we want
+    rows, columns = range(height), range(width)
+    if subregion is not None:
+        start_x, start_y, end_x, end_y = subregion
+        rows, columns = rows[start_y:end_y], columns[start_x:end_x]
+    full_width:bool = len(columns) == width
+
+    frames = np.empty([length, len(rows), len(columns)], np.uint8 if to_8_bits else dtype)
+
+    def store_frame(i_frame:int, frame:np.ndarray) -> None:
+        if frame.shape[0] > len(rows): # the whole image was decoded
+            frame = frame[rows.start:rows.stop]
+        frame = frame[:, columns.start:columns.stop]
+        if to_8_bits:
+            np.right_shift(frame, 8, out=frames[i_frame], casting='unsafe')
+        else:
+            frames[i_frame] = frame
+
+    def decode_frame(i_frame:int) -> None:
+        image_path = os.path.join(acquisition_path, all_images[framenumbers[i_frame]])
+        if layout is not None:
+            if full_width and not to_8_bits:
+                if read_uncompressed_tiff(image_path, layout, frames[i_frame], start_y=rows.start):
+                    return
+            else:
+                band = np.empty((len(rows), width), dtype)
+                if read_uncompressed_tiff(image_path, layout, band, start_y=rows.start):
+                    store_frame(i_frame, band)
+                    return
+            log_debug(f'Image {image_path} could not be read without decoding')
+        if full_width and len(rows) == height and not to_8_bits:
+            frame = imread(image_path, codec='tiff', out=frames[i_frame])
+            if not np.shares_memory(frame, frames[i_frame]):
+                frames[i_frame] = frame
+        else:
+            store_frame(i_frame, imread(image_path, codec='tiff')) # this is the fastest
+
+    if length > 1 and tiff_decoding_workers > 1:
+        with ThreadPoolExecutor(max_workers=tiff_decoding_workers) as executor:
+            list(executor.map(decode_frame, range(length)))
+    else:
+        for i_frame in range(length):
+            decode_frame(i_frame)
 
-    frames = np.empty([length, height, width], np.uint16)
-
-    for i_frame, framenumber in enumerate(framenumbers):
-        frames[i_frame] = cv2.imread(os.path.join(acquisition_path, all_images[framenumber]), cv2.IMREAD_UNCHANGED)
-
-    import time
-    from imagecodecs import imread
-    import matplotlib.pyplot as plt
+    return frames
 
-    frames = np.empty([length, height, width], np.uint8)
+def get_frames_t16(acquisition_path:str, framenumbers:np.ndarray, subregion:Subregion = None) -> Optional[np.ndarray]:
+    frames = decode_tiff_frames(acquisition_path, framenumbers, np.uint16, to_8_bits=True, subregion=subregion)
+    log_info('Quality was degraded from 16-bits to 8-bits depth')
 
+    return frames
 
-    for i_frame, framenumber in enumerate(framenumbers):
-        frames[i_frame] = imread(os.path.join(acquisition_path, all_images[framenumber]), codec='tiff') # this is the fastest
-        # frames[i_frame] = cv2.imread(os.path.join(acquisition_path, all_images[framenumber]), cv2.IMREAD_UNCHANGED) # this is the 2nd fastest
-        # frames[i_frame] = np.array(Image.open(os.path.join(acquisition_path, all_images[framenumber]))) # this is the 3rd fastest
+def get_frames_t16_conservequality(acquisition_path:str, framenumbers:np.ndarray, subregion:Subregion = None) -> Optional[np.ndarray]:
+    return decode_tiff_frames(acquisition_path, framenumbers, np.uint16, subregion=subregion)
 
-    return frames
+def get_frames_t8(acquisition_path:str, framenumbers:np.ndarray, subregion:Subregion = None) -> Optional[np.ndarray]:
+    return decode_tiff_frames(acquisition_path, framenumbers, np.uint8, subregion=subregion)
 
 def get_acquisition_frequency_t16(acquisition_path: str, unit = None) -> float:
     if '20230309_chronos_b' in acquisition_path:
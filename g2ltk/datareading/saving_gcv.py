@@ -0,0 +1,162 @@
+from typing import Optional, Any, Tuple, Dict, List, Union
+import numpy as np
+import os # to navigate in the directories
+
+from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace
+
+from . import Framenumbers, Subregion
+from . import open_acquisition, crop_geometry, get_tiff_filenames, prefetch, default_prefetch_depth
+
+# The names of the files in the GCV folder
+gcv_meta_filename:str = 'metainfo.meta'
+gcv_stamps_filename:str = 'timestamps.stamps'
+gcv_rawvideo_filename:str = 'rawvideo.raw'
+# While the conversion is not finished, the raw video is written in this file (with the suffix)
+gcv_partial_suffix:str = '.part'
+
+###### CONVERSION TO GCV
+
+def get_tiff_meta(acquisition_path:str) -> Dict[str, str]:
+    """The tags of the first tiff image of a tiff video, as GCV meta."""
+    from PIL import Image
+    from PIL.TiffTags import TAGS
+
+    all_images = get_tiff_filenames(acquisition_path)
+    img_metaprobe = Image.open(os.path.join(acquisition_path, all_images[0]))
+    tiff_meta_dict = {TAGS[key] : img_metaprobe.tag[key] for key in img_metaprobe.tag_v2 if key in TAGS}
+
+    return {key: str(tiff_meta_dict[key][0]) for key in tiff_meta_dict}
+
+def format_meta(meta:Dict[str, str]) -> str:
+    return ''.join([key + '=' + meta[key] + '\n' for key in meta])
+
+def format_stamps(stamps:Dict[str, np.ndarray]) -> str:
+    table = np.stack([stamps['framenumber'], stamps['camera_time'], stamps['computer_time']], axis=1).astype(np.int64)
+    return '\n'.join(['\t'.join(row) for row in table.astype(str)]) + ('\n' if len(table) > 0 else '')
+
+def read_text_file(path:str) -> Optional[str]:
+    """The content of a text file, or None if there is none."""
+    if not os.path.isfile(path):
+        return None
+    with open(path) as text_file:
+        return text_file.read()
+
+def write_text_file(path:str, text:str) -> None:
+    """Writes a text file aside and then renames it, so that it is never seen half-written."""
+    partial_path = path + gcv_partial_suffix
+    with open(partial_path, 'w') as text_file:
+        text_file.write(text)
+    os.replace(partial_path, path)
+
+def convert_to_gcv(acquisition_path:str, destination_path:str, framenumbers:Framenumbers = None, subregion:Subregion = None,
+                   acquisition_frequency:Optional[float] = None, exposure_time:Optional[float] = None,
+                   chunk_size:Optional[int] = None, verbose:Optional[int]=None) -> bool:
+    """
+    Converts a video of any kind to a GevCapture Video (GCV).
+
+    The frames are read by chunks (in the background, see prefetch) and appended to the raw video file, so that the
+    memory used does not depend on the length of the video. The raw video is written as rawvideo.raw.part, and renamed
+    at the end: if the conversion is interrupted, calling this function again with the same arguments resumes it.
+
+    The stamps of a GCV are copied; for other kinds of videos they are made up from the acquisition frequency.
+
+    :param acquisition_path: The video to convert
+    :param destination_path: The GCV to create (without the .gcv extension)
+    :param framenumbers:
+    :param subregion:
+    :param acquisition_frequency: In Hz (by default, the one of the video)
+    :param exposure_time: In us, written in the meta file if given
+    :param chunk_size: The number of frames read at once (see iter_frames)
+    :param verbose:
+    :return: Whether the conversion is complete.
+    """
+    acquisition = open_acquisition(acquisition_path, verbose=verbose)
+    if acquisition is None:
+        return False
+    with acquisition:
+        framenumbers = acquisition.format_framenumbers(framenumbers)
+        if framenumbers is None:
+            log_error(f'Wrong framenumbers: could not convert {acquisition_path}', verbose=verbose)
+            return False
+        height, width = crop_geometry(*acquisition.get_frame_geometry(), subregion=subregion)
+        if acquisition_frequency is None:
+            acquisition_frequency = acquisition.get_acquisition_frequency(unit='Hz')
+
+        ### META FILE
+        if acquisition.acquisition_type == 'gcv':
+            meta = dict(acquisition.meta)
+        elif acquisition.acquisition_type in ['t8', 't16']:
+            meta = get_tiff_meta(acquisition_path)
+        else:
+            meta = {}
+        start_x = 0 if subregion is None or subregion[0] is None else subregion[0]
+        start_y = 0 if subregion is None or subregion[1] is None else subregion[1]
+        meta['usingROI'] = 'false' if (height, width) == acquisition.get_frame_geometry() else 'true'
+        meta['subRegionX'] = str(int(meta.get('subRegionX', '0')) + start_x)
+        meta['subRegionY'] = str(int(meta.get('subRegionY', '0')) + start_y)
+        meta['subRegionWidth'] = str(width)
+        meta['subRegionHeight'] = str(height)
+        meta['captureCameraName'] = meta.get('captureCameraName', meta.get('UniqueCameraModel', 'unknown'))
+        meta['captureFrequency'] = str(acquisition_frequency)
+        if exposure_time is not None:
+            meta['captureExposureTime'] = str(exposure_time) # in us
+        meta['captureProg'] = meta.get('captureProg', meta.get('UniqueCameraModel', 'g2ltk'))
+
+        ### STAMPS FILE
+        if acquisition.acquisition_type == 'gcv':
+            stamps = {key: acquisition.stamps[key][framenumbers] for key in ['framenumber', 'camera_time', 'computer_time']}
+        else:
+            # make up for the stamps data
+            stamps = {'framenumber': framenumbers.astype(int),
+                      'camera_time': np.rint(framenumbers / acquisition_frequency * 1e9).astype(np.int64), # mock camera time
+                      'computer_time': np.rint(framenumbers / acquisition_frequency * 1e6).astype(np.int64)} # mock computer time
+
+        meta_text, stamps_text = format_meta(meta), format_stamps(stamps)
+
+        ### FOLDER
+        gcv_path = destination_path + '.gcv'
+        meta_path = os.path.join(gcv_path, gcv_meta_filename)
+        stamps_path = os.path.join(gcv_path, gcv_stamps_filename)
+        rawvideo_path = os.path.join(gcv_path, gcv_rawvideo_filename)
+        partial_rawvideo_path = rawvideo_path + gcv_partial_suffix
+
+        # a conversion interrupted before writing frames left at most its meta and stamps files: it starts again
+        conversion_files = {gcv_meta_filename, gcv_stamps_filename,
+                            gcv_meta_filename + gcv_partial_suffix, gcv_stamps_filename + gcv_partial_suffix}
+        if os.path.isdir(gcv_path) and not set(os.listdir(gcv_path)) <= conversion_files:
+            # this is fine only if we are resuming the same conversion
+            same_conversion = read_text_file(meta_path) == meta_text and read_text_file(stamps_path) == stamps_text
+            if os.path.isfile(rawvideo_path) and not os.path.isfile(partial_rawvideo_path):
+                if same_conversion:
+                    log_info(f'{gcv_path} was already converted', verbose=verbose)
+                    return True
+                log_warn(f'FILE "{gcv_path}" ALREADY EXISTS. Aborting.', verbose=verbose)
+                return False
+            if not same_conversion:
+                log_warn(f'FILE "{gcv_path}" ALREADY EXISTS and is not a conversion of {acquisition_path} with these parameters. Aborting.', verbose=verbose)
+                return False
+        else:
+            os.makedirs(gcv_path, exist_ok=True)
+            write_text_file(meta_path, meta_text)
+            write_text_file(stamps_path, stamps_text)
+
+        ### DATA FILE
+        frame_size = height * width
+        n_frames_done = 0
+        if os.path.isfile(partial_rawvideo_path):
+            n_frames_done = min(os.path.getsize(partial_rawvideo_path) // max(frame_size, 1), len(framenumbers))
+            log_info(f'Resuming the conversion of {acquisition_path} at frame {n_frames_done}/{len(framenumbers)}', verbose=verbose)
+
+        with open(partial_rawvideo_path, 'ab') as rawvideo_file:
+            rawvideo_file.truncate(n_frames_done * frame_size) # remove the last frame if it was not written completely
+            rawvideo_file.seek(n_frames_done * frame_size)
+            chunks = acquisition.iter_frames(framenumbers[n_frames_done:], subregion=subregion, chunk_size=chunk_size)
+            for frames, chunk_framenumbers, _ in prefetch(chunks, prefetch_depth=default_prefetch_depth):
+                rawvideo_file.write(np.ascontiguousarray(frames, dtype=np.uint8).data)
+                rawvideo_file.flush()
+                n_frames_done += len(chunk_framenumbers)
+                display(f'Converting {acquisition_path} to GCV: {n_frames_done}/{len(framenumbers)}', end='\r')
+
+        os.replace(partial_rawvideo_path, rawvideo_path)
+        display(f'Converted {acquisition_path} to {gcv_path}', end='\n')
+        return True
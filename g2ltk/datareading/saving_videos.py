@@ -2,16 +2,29 @@ from typing import Optional, Any, Tuple, Dict, List, Union
 import numpy as np
 import cv2 # to manipulate images and videos
 import os # to navigate in the directories
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace
 from .. import utility, datasaving
 
-from . import are_there_missing_frames, resize_frames, find_available_videos, get_frames, get_times
+from . import find_available_videos
 from . import is_this_a_gcv, is_this_a_t16
 
 # save videos for easyvisualisation
 
-def save_frames_to_video(video_rawpath:str, frames:np.ndarray, fps:float = 25., filetype:str = 'mkv', codec:Optional[str] = None, resize_factor:int = 1):
+# The number of frames read at once when saving an acquisition (see iter_frames)
+video_saving_chunk_size:int = 200
+# The rendered characters of the timestamps, for each frame geometry, see get_timestamp_atlas
+timestamp_atlases:Dict[Tuple[int, int], Dict[str, Any]] = {}
+timestamp_characters:str = 't =0123456789.-s'
+# The number of acquisitions saved at the same time by save_all_gcv_videos (one process each)
+video_saving_workers:int = min(4, os.cpu_count() or 1)
+# The memory (in bytes) that saving one acquisition may use for its frames, see get_video_saving_chunk_size
+video_saving_memory_budget:int = 512 * 2**20
+
+def get_video_codec(filetype:str = 'mkv', codec:Optional[str] = None) -> str:
     # codec ok : DIVX, XVID (trow error with mp4)
     # couple ok : codec mp4v, filetype mp4
     # couple ok : codec H264, filetype avi
@@ -26,86 +39,243 @@ def save_frames_to_video(video_rawpath:str, frames:np.ndarray, fps:float = 25.,
         else:
             throw_G2L_warning(f'Did not find appropriate codec for filetype {filetype}.')
             codec = 'XVID'
+    return codec
+
+def open_video_writer(video_path:str, height:int, width:int, fps:float = 25., codec:str = 'FFV1') -> Tuple[Any, bool]:
+    """
+    Opens a video writer fed with grayscale frames, so that the frames do not need to be converted to 3 channels.
+
+    :return: The writer, and whether it expects 3-channels frames (if the single-channel writer could not be opened).
+    """
+    fourcc = cv2.VideoWriter_fourcc(*codec)
+    writer = cv2.VideoWriter(video_path, fourcc, fps, (width, height), isColor=False)
+    if writer.isOpened():
+        return writer, False
+    writer.release()
+    log_debug(f'Could not open a single-channel writer for {video_path}, writing 3-channels frames')
+    return cv2.VideoWriter(video_path, fourcc, fps, (width, height)), True
 
-    frames = frames.astype(np.uint8, copy=False)
-    frames = resize_frames(frames, resize_factor=resize_factor)
+def write_frames(writer:Any, frames:np.ndarray, resize_factor:int = 1, is_color:bool = False) -> None:
+    """Writes the frames one by one, resizing them on the fly."""
+    length, height, width = frames.shape
+    resized = np.empty((height * resize_factor, width * resize_factor), dtype=np.uint8)
+    colored = np.empty((height * resize_factor, width * resize_factor, 3), dtype=np.uint8) if is_color else None
+    for i_frame in range(length):
+        frame = frames[i_frame].astype(np.uint8, copy=False)
+        if resize_factor != 1:
+            # Other possibilites were skimage.resize but it is more than 10 times slower.
+            frame = cv2.resize(frame, (width * resize_factor, height * resize_factor), dst=resized)
+        if is_color:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR, dst=colored)
+        writer.write(frame)
+
+def save_frames_to_video(video_rawpath:str, frames:np.ndarray, fps:float = 25., filetype:str = 'mkv', codec:Optional[str] = None, resize_factor:int = 1):
+    codec = get_video_codec(filetype=filetype, codec=codec)
 
     # frames doit être 3-dimensionnel [length, height, width]
     length, height, width = frames.shape
 
     video_path = video_rawpath + '.' + filetype
 
-    # THE NEW WAY
-
     display(f'Saving video {video_path}...', end='\r')
 
-    fourcc = cv2.VideoWriter_fourcc(*codec)
-    writer= cv2.VideoWriter(video_path, fourcc, fps, (width, height))
-
-    for framenumber in range(length):
-        writer.write( np.repeat(frames[framenumber], 3).reshape((height, width, 3)).astype(np.uint8, copy=False) )
-
+    writer, is_color = open_video_writer(video_path, height * resize_factor, width * resize_factor, fps=fps, codec=codec)
+    write_frames(writer, frames, resize_factor=resize_factor, is_color=is_color)
     writer.release()
 
     display(f'Video {video_path} saved', end='\n')
 
-def save_acquisition_to_video(acquisition_path:str, do_timestamp:bool = True, fps:float = 25., filetype:str = 'mkv', codec:Optional[str] = None, resize_factor:int = 1):
+def get_timestamp_atlas(height:int, width:int) -> Dict[str, Any]:
+    """
+    Renders once the characters of the timestamps, for frames of the given geometry.
+
+    Each character is stored as two coverage masks (between 0 and 1): the white background, and the black text.
+
+    :param height:
+    :param width:
+    :return: {'glyphs': {char: (background, text)}, 'advances': {char: int}, 'widths': {char: int}, 'pad', 'ascent', 'offset'}
+    """
+    if (height, width) in timestamp_atlases:
+        return timestamp_atlases[(height, width)]
+
+    text_offset = 10 if height >= 45 else 1
+
+    thickness = 1 if height < 35 else 2
+
+    antialiasing = height >= 20
+
+    scale = 0.15 # this value can be from 0 to 1 (0,1] to change the size of the text relative to the image
+    fontScale = max(min(width,height)/(25/scale), 0.8)
+
+    ascent = max([cv2.getTextSize(char, fontFace=cv2.FONT_HERSHEY_SIMPLEX, fontScale=fontScale, thickness=thickness)[0][1] for char in timestamp_characters])
+    descent = max([cv2.getTextSize(char, fontFace=cv2.FONT_HERSHEY_SIMPLEX, fontScale=fontScale, thickness=thickness)[1] for char in timestamp_characters])
+    pad = 2 * thickness + 1 # the white background goes beyond the letters
+
+    glyphs, advances, widths = {}, {}, {}
+    for char in timestamp_characters:
+        width_1 = cv2.getTextSize(char, fontFace=cv2.FONT_HERSHEY_SIMPLEX, fontScale=fontScale, thickness=thickness)[0][0]
+        width_2 = cv2.getTextSize(char*2, fontFace=cv2.FONT_HERSHEY_SIMPLEX, fontScale=fontScale, thickness=thickness)[0][0]
+        advance = width_2 - width_1
+        layers = []
+        for color_thickness in [thickness*3, thickness]:
+            canvas = np.zeros((pad + ascent + descent + pad, pad + width_1 + pad), dtype=np.uint8)
+            cv2.putText(canvas, char,
+                        (pad, pad + ascent),
+                        cv2.FONT_HERSHEY_SIMPLEX, # font
+                        fontScale, # font scale
+                        255, # color
+                        color_thickness, # writing thickness
+                        cv2.LINE_AA if antialiasing else cv2.FILLED,
+                        False # Use the bottom left as origin (invert image)
+                        )
+            layers.append(canvas.astype(np.float32) / 255)
+        glyphs[char] = tuple(layers)
+        advances[char] = advance
+        widths[char] = width_1
+
+    atlas = {'glyphs': glyphs, 'advances': advances, 'widths': widths, 'pad': pad, 'ascent': ascent, 'offset': text_offset}
+    timestamp_atlases[(height, width)] = atlas
+    return atlas
+
+def draw_timestamp(frame:np.ndarray, text:str, atlas:Dict[str, Any]) -> None:
+    """Writes the text (in black on white) in the bottom right corner of the frame, in place, using the glyphs of the atlas."""
+    height, width = frame.shape
+    glyphs, advances, pad = atlas['glyphs'], atlas['advances'], atlas['pad']
+    text = ''.join([char for char in text if char in glyphs])
+    glyph_height = next(iter(glyphs.values()))[0].shape[0]
+
+    if len(text) == 0:
+        return
+    # the same width as cv2.getTextSize
+    text_width = sum([advances[char] for char in text[:-1]]) + atlas['widths'][text[-1]]
+    # the origin of the text (bottom left), then the top left of the glyph canvas
+    x0 = width - 1 - atlas['offset'] - text_width - pad
+    y0 = height - 1 - atlas['offset'] - atlas['ascent'] - pad
+
+    background = np.zeros((glyph_height, text_width + 2 * pad), dtype=np.float32)
+    foreground = np.zeros((glyph_height, text_width + 2 * pad), dtype=np.float32)
+    x = 0
+    for char in text:
+        char_background, char_foreground = glyphs[char]
+        char_width = char_background.shape[1]
+        np.maximum(background[:, x:x + char_width], char_background, out=background[:, x:x + char_width])
+        np.maximum(foreground[:, x:x + char_width], char_foreground, out=foreground[:, x:x + char_width])
+        x += advances[char]
+
+    # crop what is outside of the frame
+    top, left = max(0, -y0), max(0, -x0)
+    bottom, right = min(glyph_height, height - y0), min(background.shape[1], width - x0)
+    if bottom <= top or right <= left:
+        return
+    region = frame[y0 + top:y0 + bottom, x0 + left:x0 + right]
+    background, foreground = background[top:bottom, left:right], foreground[top:bottom, left:right]
+
+    blended = region * (1 - background) + 255 * background
+    blended *= 1 - foreground
+    region[:] = np.rint(blended).astype(np.uint8)
+
+def get_video_saving_chunk_size(height:int, width:int, memory_budget:Optional[int] = None) -> int:
+    """
+    The number of frames per chunk so that saving a video of the given geometry fits in the memory budget.
+
+    The chunk being processed, the one being read and the prefetched ones are in memory at the same time.
+
+    :param height:
+    :param width:
+    :param memory_budget: In bytes (video_saving_memory_budget by default)
+    :return:
+    """
+    from . import default_prefetch_depth
+
+    if memory_budget is None:
+        memory_budget = video_saving_memory_budget
+    chunks_in_memory = default_prefetch_depth + 2
+    return int(max(1, min(video_saving_chunk_size, memory_budget // (chunks_in_memory * max(height * width, 1)))))
+
+def save_acquisition_to_video(acquisition_path:str, do_timestamp:bool = True, fps:float = 25., filetype:str = 'mkv', codec:Optional[str] = None, resize_factor:int = 1,
+                              chunk_size:Optional[int] = None, memory_budget:Optional[int] = None, show_progress:bool = True) -> Optional[int]:
+    """
+    Saves an acquisition as a video, with the timestamps written on the frames.
+
+    The frames are read by chunks of chunk_size frames (video_saving_chunk_size by default, less if it does not fit in
+    the memory budget), so that the memory used does not depend on the length of the acquisition.
+
+    :return: The number of frames saved, or None if there was no acquisition to save.
+    """
+    from . import open_acquisition, prefetch, default_prefetch_depth
+
     if not(is_this_a_gcv(acquisition_path)) and not(is_this_a_t16(acquisition_path)):
         # todo error ERROR here
         log_error(f'WAW')
         return
 
-    frames = get_frames(acquisition_path, framenumbers = None, subregion=None)
-    frames = np.copy(frames)
-    length, height, width = frames.shape
+    codec = get_video_codec(filetype=filetype, codec=codec)
+    video_path = acquisition_path + '.' + filetype
 
-    if do_timestamp and not(are_there_missing_frames(acquisition_path)):
-        t = get_times(acquisition_path, framenumbers = None, unit='s')
+    with open_acquisition(acquisition_path) as acquisition:
+        height, width = acquisition.get_frame_geometry()
+        length = acquisition.get_number_of_available_frames()
 
-        do_white_bckgnd = True
+        do_timestamp = do_timestamp and not(acquisition.are_there_missing_frames())
+        atlas = get_timestamp_atlas(height, width) if do_timestamp else None
 
-        text_offset = 10 if height >= 45 else 1
+        if chunk_size is None:
+            chunk_size = get_video_saving_chunk_size(height, width, memory_budget=memory_budget)
 
-        thickness = 1 if height < 35 else 2
+        if show_progress:
+            display(f'Saving video {video_path}...', end='\r')
 
-        antialiasing = height >= 20
+        writer, is_color = open_video_writer(video_path, height * resize_factor, width * resize_factor, fps=fps, codec=codec)
+        chunks = acquisition.iter_frames(None, chunk_size=chunk_size)
+        n_frames_done = 0
+        for frames, framenumbers, t in prefetch(chunks, prefetch_depth=default_prefetch_depth):
+            frames = frames.astype(np.uint8, copy=False)
+            if do_timestamp:
+                if not frames.flags.writeable:
+                    frames = np.copy(frames)
+                for i_frame in range(len(frames)):
+                    draw_timestamp(frames[i_frame], f't = {"{:05.3f}".format(t[i_frame])} s', atlas)
+            write_frames(writer, frames, resize_factor=resize_factor, is_color=is_color)
+            n_frames_done += len(framenumbers)
+            if show_progress:
+                display(f'Saving video {video_path}: {n_frames_done}/{length}', end='\r')
+        writer.release()
 
-        scale = 0.15 # this value can be from 0 to 1 (0,1] to change the size of the text relative to the image
-        fontScale = max(min(width,height)/(25/scale), 0.8)
+    if show_progress:
+        display(f'Video {video_path} saved', end='\n')
+    return n_frames_done
 
-        for i_frame in range(length):
-            text = f't = {"{:05.3f}".format(t[i_frame])} s'
+def is_video_up_to_date(acquisition_path:str, filetype:str = 'mkv') -> bool:
+    """
+    Whether the video of the acquisition was saved after the last modification of the acquisition.
 
-            testSize = cv2.getTextSize(text,
-                                       fontFace=cv2.FONT_HERSHEY_SIMPLEX,
-                                       fontScale=fontScale,
-                                       thickness=thickness)[0][0]
+    The files inside the acquisition folder are looked at (see get_acquisition_signature), since modifying them in
+    place does not change the modification time of the folder.
+    """
+    from . import get_acquisition_signature
 
-            if do_white_bckgnd:
-                cv2.putText(frames[i_frame], text,
-                            (width - 1 - text_offset-testSize, height-1 - text_offset),
-                            cv2.FONT_HERSHEY_SIMPLEX, # font
-                            fontScale, # font scale
-                            255, # color
-                            thickness*3, # writing thickness
-                            cv2.LINE_AA if antialiasing else cv2.FILLED,
-                            False # Use the bottom left as origin (invert image)
-                            )
+    video_path = acquisition_path + '.' + filetype
+    acquisition_signature = get_acquisition_signature(acquisition_path)
+    return os.path.isfile(video_path) and acquisition_signature is not None and os.stat(video_path).st_mtime_ns >= acquisition_signature[0]
 
-            cv2.putText(frames[i_frame], text,
-                        (width - 1 - text_offset - testSize, height-1 - text_offset),
-                        cv2.FONT_HERSHEY_SIMPLEX, # font
-                        fontScale, # font scale
-                        0, # color
-                        thickness, # writing thickness
-                        cv2.LINE_AA if antialiasing else cv2.FILLED,
-                        False # Use the bottom left as origin (invert image)
-                        )
+def save_all_gcv_videos(dataset:str, do_timestamp:bool = True, fps:float = 25., filetype:str = 'mkv', codec:Optional[str] = None, resize_factor:int = 1,
+                        n_workers:Optional[int] = None, memory_budget:Optional[int] = None, overwrite:bool = False):
+    """
+    Saves all the gcv acquisitions of a dataset as videos, see save_acquisition_to_video.
 
-    save_frames_to_video(acquisition_path, frames,
-                         fps = fps, filetype=filetype, codec=codec, resize_factor=resize_factor)
+    The acquisitions are saved concurrently, each one in its own process.
 
-def save_all_gcv_videos(dataset:str, do_timestamp:bool = True, fps:float = 25., filetype:str = 'mkv', codec:Optional[str] = None, resize_factor:int = 1):
+    :param dataset:
+    :param do_timestamp:
+    :param fps:
+    :param filetype:
+    :param codec:
+    :param resize_factor:
+    :param n_workers: The number of acquisitions saved at the same time (video_saving_workers by default)
+    :param memory_budget: The memory (in bytes) used by each acquisition (video_saving_memory_budget by default)
+    :param overwrite: Whether to save again the videos which are more recent than their acquisition.
+    :return:
+    """
     log_info(f'Saving all the gcv acquisition in the dataset: {dataset}')
 
     dataset_path = '../' + dataset
@@ -113,10 +283,48 @@ def save_all_gcv_videos(dataset:str, do_timestamp:bool = True, fps:float = 25.,
     available_acquisitions =  find_available_videos(dataset_path, type='gcv')
     log_info(f'The following acquisition will be saved: {available_acquisitions}')
 
+    acquisition_paths = []
     for acquisition in available_acquisitions:
         acquisition_path = os.path.join(dataset_path, acquisition)
 
-        if is_this_a_gcv(acquisition_path):
-            save_acquisition_to_video(acquisition_path, do_timestamp=do_timestamp, fps=fps, filetype=filetype, codec=codec, resize_factor=resize_factor)
-        else:
+        if not is_this_a_gcv(acquisition_path):
             throw_G2L_warning(f'GCV acquisition {acquisition} is found but does not exist ?')
+        elif not overwrite and is_video_up_to_date(acquisition_path, filetype=filetype):
+            log_info(f'The video of {acquisition} is up to date, skipping it')
+        else:
+            acquisition_paths.append(acquisition_path)
+
+    if len(acquisition_paths) == 0:
+        return
+
+    if n_workers is None:
+        n_workers = video_saving_workers
+    n_workers = max(1, min(n_workers, len(acquisition_paths)))
+    save_parameters = {'do_timestamp': do_timestamp, 'fps': fps, 'filetype': filetype, 'codec': codec,
+                       'resize_factor': resize_factor, 'memory_budget': memory_budget}
+
+    time_start = time.time()
+    n_videos_done, n_frames_done = 0, 0
+    def show_progress(n_frames:Optional[int]) -> None:
+        nonlocal n_videos_done, n_frames_done
+        n_videos_done += 1
+        n_frames_done += n_frames or 0
+        throughput = n_frames_done / max(time.time() - time_start, 1e-9)
+        display(f'Saved {n_videos_done}/{len(acquisition_paths)} videos ({n_frames_done} frames, {throughput:.0f} frames/s)',
+                end='\r' if n_videos_done < len(acquisition_paths) else '\n')
+
+    if n_workers == 1:
+        for acquisition_path in acquisition_paths:
+            show_progress(save_acquisition_to_video(acquisition_path, show_progress=False, **save_parameters))
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {executor.submit(save_acquisition_to_video, acquisition_path, show_progress=False, **save_parameters): acquisition_path
+                   for acquisition_path in acquisition_paths}
+        for future in as_completed(futures):
+            try:
+                n_frames = future.result()
+            except Exception as e:
+                log_error(f'Could not save the video of {futures[future]}: {e}')
+                n_frames = None
+            show_progress(n_frames)
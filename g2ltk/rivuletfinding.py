@@ -2,10 +2,14 @@ from typing import Optional, Any, Tuple, Dict, List
 import numpy as np
 import os
 import cv2 # to manipulate images and videos
+import atexit
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait
 from scipy.optimize import curve_fit # to fit functions
 
 from g2ltk import datareading, datasaving, utility
-from g2ltk import display, log_info, log_debug
+from g2ltk import display, log_warn, log_info, log_debug
 
 # Custom typing
 Meta = Dict[str, str]
@@ -17,7 +21,11 @@ Subregion = Optional[Tuple[Optional[int], Optional[int], Optional[int], Optional
 """
 Default value for finding functions parameters
  - resize_factor        (int, 1 - 3):       resizing image pour une meilleure precision
+ - native_resolution    (bool):             Do not resize the frames, get the sub-pixel precision analytically instead (parabolic interpolation of the peaks, centers of mass). The results still have width * resize_factor points
  - remove_median_bckgnd (bool):             Remove the median image for all the frames. only use when the whole rivulet is moving. Should be unnecessary on clean videos
+ - rolling_bckgnd_window (int, 0 - ):       Remove from each frame the background of the rolling_bckgnd_window frames before it (0 to disable), instead of the median image. Use it when the illumination drifts
+ - rolling_bckgnd_method (str):             How the rolling background is computed: 'mean' or 'percentile'
+ - rolling_bckgnd_percentile (float, 0 - 100): The percentile used by the rolling background method 'percentile' (50 is the median)
  - white_tolerance      (float, 0 - 255):   Difference between the channel white background and the black borders
  - rivulet_size_factor  (float, 1. - 5.):   How much wider is the rivulet compared to the size occupied by low luminosity extremapoints
  - std_factor           (float, 1. - 5.):   How much of the noise to remove
@@ -28,7 +36,11 @@ Default value for finding functions parameters
 """
 default_kwargs = {
     'resize_factor': 2,
+    'native_resolution': False,
     'remove_median_bckgnd': False,
+    'rolling_bckgnd_window': 0,
+    'rolling_bckgnd_method': 'mean',
+    'rolling_bckgnd_percentile': 50.,
     'white_tolerance': 70.,
     'rivulet_size_factor': 2.,
     'std_factor': 3.,
@@ -133,6 +145,29 @@ def mean_shadowmax_linewise(z:np.ndarray, y:np.ndarray, **kwargs)-> float:
     return position
 
 
+### NATIVE RESOLUTION
+
+def upsample_columns(values:np.ndarray, resize_factor:int) -> np.ndarray:
+    """
+    Interpolates values given for each column of a frame (last axis) on the columns of the frame resized by resize_factor,
+    i.e. at x = i / resize_factor. This is how the results at native resolution keep the width * resize_factor shape.
+
+    :param values:
+    :param resize_factor:
+    :return:
+    """
+    if resize_factor == 1:
+        return values
+    width = values.shape[-1]
+    x_resized = np.arange(width * resize_factor) / resize_factor
+    flat_values = values.reshape((-1, width))
+    upsampled = np.array([np.interp(x_resized, np.arange(width), line) for line in flat_values])
+    return upsampled.reshape(values.shape[:-1] + (width * resize_factor,))
+
+def native_columns(values:np.ndarray, resize_factor:int) -> np.ndarray:
+    """The values at the columns of the frame at native resolution, from values given for the columns of the resized frame (inverse of upsample_columns)."""
+    return values[..., ::resize_factor]
+
 ### FRAMEWISE METHODS
 def cos_framewise(frame:np.ndarray, **kwargs)-> float:
     """
@@ -145,7 +180,12 @@ def cos_framewise(frame:np.ndarray, **kwargs)-> float:
         if not key in kwargs.keys():
             kwargs[key] = default_kwargs[key]
 
-    l = datareading.resize_frame(frame, resize_factor=kwargs['resize_factor'])
+    # at native resolution, the center of mass is already sub-pixel: there is no need to resize
+    resize_factor = 1 if kwargs['native_resolution'] else kwargs['resize_factor']
+    if kwargs['native_resolution']:
+        l = frame.astype(float, copy=False)
+    else:
+        l = datareading.resize_frame(frame, resize_factor=resize_factor)
     height, width = l.shape
 
     # the z coordinate ('horizontal' in real life)
@@ -192,7 +232,10 @@ def cos_framewise(frame:np.ndarray, **kwargs)-> float:
     rivulet = np.sum(z_channel * weights, axis=0) / np.sum(weights, axis=0)
 
     # take into account the resizing
-    rivulet /= kwargs['resize_factor']
+    rivulet /= resize_factor
+
+    if kwargs['native_resolution']:
+        rivulet = upsample_columns(rivulet, kwargs['resize_factor'])
 
     return rivulet
 
@@ -334,6 +377,29 @@ def bimax_fit(x, y, w0:float = 1.):
 
     return popt
 
+def bimax_fit_batch(z:np.ndarray, y:np.ndarray, w0:float = 1.):
+    """
+    Same as bimax_fit, for many lines at once (see utility.fit_double_gauss_batch), giving the fitted maxs.
+
+    :param z: The positions (m)
+    :param y: The lines (n, m)
+    :param w0: The initial width of the gaussians
+    :return: x1, y1, x2, y2 (n each). The lines where the fit did not converge get the maxs of bimax_naive.
+    """
+    y = y.astype(float, copy=False)
+    x10, y10, x20, y20 = np.array([bimax_naive(z, line) for line in y], dtype=float).reshape(-1, 4).T
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p0, lbounds, ubounds = double_gauss_initial_guess(z, y, x10, y10, x20, y20, np.full(len(y), float(w0)))
+    popt, converged = utility.fit_double_gauss_batch(z, y, p0, lbounds, ubounds)
+
+    x1, x2 = np.where(converged, popt[:, 0], x10), np.where(converged, popt[:, 3], x20)
+    params = [popt[:, i] for i in range(7)]
+    with np.errstate(under='ignore', invalid='ignore'):
+        y1 = np.where(converged, utility.double_gauss(x1, *params), y10)
+        y2 = np.where(converged, utility.double_gauss(x2, *params), y20)
+    return x1, y1, x2, y2
+
 def bimax(x, y, do_fit:bool = False, w0:float = 1., **kwargs):
     if do_fit:
         return bimax_fit(x, y, w0)
@@ -354,6 +420,14 @@ def bimax_by_peakfinder(z, y, distance:float = 1, prominence:float = 1):
 
     return x1, y1, x2, y2
 
+def bimax_indices_by_peakfinder(y, distance:float = 1, prominence:float = 1):
+    """The indices of the 2 bigger maxs of y (the same as bimax_by_peakfinder)."""
+    peaks, _ = find_peaks(y, distance = distance, prominence = prominence)
+
+    # take the 2 bigger maxs
+    sorted = y[peaks].argsort()
+    return peaks[sorted][-1], peaks[sorted][-2]
+
 def bimax_fit_by_peakfinder(z, y, distance:float = 1, prominence:float = 1):
     x10, y10, x20, y20 = bimax_by_peakfinder(z, y, distance=distance, prominence=prominence)
 
@@ -384,6 +458,98 @@ def bimax_fit_by_peakfinder(z, y, distance:float = 1, prominence:float = 1):
 
     return x1, y1, x2, y2
 
+def double_gauss_initial_guess(z:np.ndarray, y:np.ndarray, x10:np.ndarray, y10:np.ndarray, x20:np.ndarray, y20:np.ndarray,
+                               w0:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The initial parameters and the bounds of the fit of a double gaussian on many lines at once, from their 2 maxs
+    (the same as bimax_fit and bimax_fit_by_peakfinder).
+
+    :param z: The positions (m)
+    :param y: The lines (n, m)
+    :param x10, y10, x20, y20: The 2 maxs of each line (n each)
+    :param w0: The initial width of the gaussians of each line (n)
+    :return: p0 (n, 7), lbounds (7), ubounds (7)
+    """
+    # amplitude of the maxs (see bimax_fit)
+    g = utility.gaussian_unnormalized(x10-x20, 0, w0)
+    a10 = (y10 - g*y20)/(1-g**2)
+    a20 = (y20 - g*y10)/(1-g**2)
+
+    # noise
+    bckgnd_noise0 = np.maximum(0., y.min(axis=1))
+
+    p0 = np.stack([x10, a10, w0, x20, a20, w0, bckgnd_noise0], axis=1)
+    lbounds = np.array([z.min(), 0., 0., z.min(), 0., 0., 0.])
+    ubounds = np.array([z.max(), 255, z.max()-z.min(), z.max(), 255, z.max()-z.min(), 255])
+    return p0, lbounds, ubounds
+
+def bimax_fit_initial_guess(z:np.ndarray, y:np.ndarray, peaks:np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The initial parameters and the bounds of the fit of bimax_fit_by_peakfinder, for many lines at once.
+
+    :param z: The positions (m)
+    :param y: The lines (n, m)
+    :param peaks: The indices of the 2 bigger maxs of each line (n, 2), see bimax_indices_batch
+    :return: p0 (n, 7), lbounds (7), ubounds (7)
+    """
+    y = y.astype(float, copy=False)
+    x10, x20 = z[peaks[:, 0]], z[peaks[:, 1]]
+    y10, y20 = np.take_along_axis(y, peaks, axis=1).T
+
+    w0 = np.abs(x20-x10)/4
+
+    return double_gauss_initial_guess(z, y, x10, y10, x20, y20, w0)
+
+def bimax_fit_by_peakfinder_batch(z:np.ndarray, y:np.ndarray, peaks:np.ndarray, fit_params:Optional[np.ndarray] = None):
+    """
+    Same as bimax_fit_by_peakfinder, for many lines at once (see utility.fit_double_gauss_batch).
+
+    :param z: The positions (m)
+    :param y: The lines (n, m)
+    :param peaks: The indices of the 2 bigger maxs of each line (n, 2), see bimax_indices_batch
+    :param fit_params: Parameters fitted before (e.g. on the previous frame, n x 7), used as initial guess for the lines
+        where they match the peaks. NaN for no guess. It is updated with the new fitted parameters.
+    :return: x1, y1, x2, y2 (n each). The lines where the fit did not converge get the positions of the peaks.
+    """
+    p0, lbounds, ubounds = bimax_fit_initial_guess(z, y, peaks)
+    x10, x20 = p0[:, 0], p0[:, 3]
+    y10, y20 = np.take_along_axis(y, peaks, axis=1).astype(float).T
+
+    warm = np.zeros(len(y), dtype=bool)
+    p0_warm = p0.copy()
+    if fit_params is not None:
+        # warm start where the gaussians fitted before are on the peaks (in the same order or not), and not wider
+        # than those of the initial guess (a wide gaussian matches any peak)
+        swapped_params = fit_params[:, [3, 4, 5, 0, 1, 2, 6]]
+        w0 = p0[:, 2]
+        with np.errstate(invalid='ignore'):
+            narrow = (fit_params[:, 2] <= w0) & (fit_params[:, 5] <= w0)
+            same = narrow & (np.abs(fit_params[:, 0] - x10) <= fit_params[:, 2]) & (np.abs(fit_params[:, 3] - x20) <= fit_params[:, 5])
+            swapped = narrow & (np.abs(swapped_params[:, 0] - x10) <= swapped_params[:, 2]) & (np.abs(swapped_params[:, 3] - x20) <= swapped_params[:, 5])
+        p0_warm[swapped] = swapped_params[swapped]
+        p0_warm[same] = fit_params[same]
+        warm = same | swapped
+
+    popt, converged = utility.fit_double_gauss_batch(z, y, p0_warm, lbounds, ubounds)
+
+    # the warm fits which did not converge, or ended worse than the initial guess, are done again from the peaks
+    def cost(params):
+        with np.errstate(all='ignore'):
+            return ((y - utility.double_gauss(z, *[params[:, i, None] for i in range(7)]))**2).sum(axis=1)
+    retry = warm & ~(converged & (cost(popt) <= cost(p0)))
+    if retry.any():
+        popt[retry], converged[retry] = utility.fit_double_gauss_batch(z, y[retry], p0[retry], lbounds, ubounds)
+
+    if fit_params is not None:
+        fit_params[:] = np.where(converged[:, None], popt, np.nan)
+
+    x1, x2 = np.where(converged, popt[:, 0], x10), np.where(converged, popt[:, 3], x20)
+    params = [popt[:, i] for i in range(7)]
+    with np.errstate(under='ignore', invalid='ignore'):
+        y1 = np.where(converged, utility.double_gauss(x1, *params), y10)
+        y2 = np.where(converged, utility.double_gauss(x2, *params), y20)
+    return x1, y1, x2, y2
+
 def borders_linewise(z:np.ndarray, y:np.ndarray, do_fit:bool = False, w0:float = 1., **kwargs):
     for key in default_kwargs.keys():
         if not key in kwargs.keys():
@@ -432,11 +598,15 @@ def borders(frame:np.ndarray, do_fit:bool = False, w0:float = 1., **kwargs) -> n
 
     z = np.arange(height) / kwargs['resize_factor']
 
-    for l in range(width):
+    if do_fit:
+        # all the columns are fitted at once
+        zz[:] = np.stack(bimax_fit_batch(z, (255 - frame_resized.astype(float)).T, w0=w0), axis=1)
+    else:
+        for l in range(width):
 
-        y = 255 - frame_resized[:, l].astype(float)
+            y = 255 - frame_resized[:, l].astype(float)
 
-        zz[l] = bimax(z, y, do_fit=do_fit, w0=w0, **kwargs)
+            zz[l] = bimax(z, y, do_fit=do_fit, w0=w0, **kwargs)
 
     z1, y1, z2, y2 = zz[:,0], zz[:,1], zz[:,2], zz[:,3]
 
@@ -486,23 +656,43 @@ def borders_via_peakfinder(frame:np.ndarray, prominence:float = 1, do_fit:bool=F
         if not key in kwargs.keys():
             kwargs[key] = default_kwargs[key]
 
-    frame_resized = datareading.resize_frame(frame, resize_factor=kwargs['resize_factor'])
+    # at native resolution, the peaks are located with a sub-pixel precision instead of resizing
+    resize_factor = 1 if kwargs['native_resolution'] else kwargs['resize_factor']
+    # the min distance is in resized pixels
+    distance = max(1., kwargs['borders_min_distance'] / kwargs['resize_factor']) if kwargs['native_resolution'] else kwargs['borders_min_distance']
+    if kwargs['native_resolution']:
+        frame_resized = frame.astype(float, copy=False)
+    else:
+        frame_resized = datareading.resize_frame(frame, resize_factor=resize_factor)
     height, width = frame_resized.shape
 
     zz = np.zeros((width, 4), dtype=float)
 
-    z = np.arange(height) / kwargs['resize_factor']
+    z = np.arange(height) / resize_factor
 
     if do_fit:
+        y = (255 - frame_resized).T
+        peaks = np.zeros((width, 2), dtype=int)
         for l in range(width):
-            zz[l] = bimax_fit_by_peakfinder(z, 255 - frame_resized[:, l], distance = kwargs['borders_min_distance'], prominence = prominence)
+            peaks[l] = bimax_indices_by_peakfinder(y[l], distance = distance, prominence = prominence)
+        # fit all the lines at once
+        zz[:, 0], zz[:, 1], zz[:, 2], zz[:, 3] = bimax_fit_by_peakfinder_batch(z, y, peaks)
+    elif kwargs['native_resolution']:
+        y = (255 - frame_resized).T
+        peaks = np.zeros((width, 2), dtype=int)
+        for l in range(width):
+            peaks[l] = bimax_indices_by_peakfinder(y[l], distance = distance, prominence = prominence)
+        # the sub-pixel position of the maxs, for all the lines at once
+        positions, values = utility.refine_peaks_parabolic(y, peaks)
+        zz[:, 0], zz[:, 2] = positions[:, 0], positions[:, 1]
+        zz[:, 1], zz[:, 3] = values[:, 0], values[:, 1]
     else:
         for l in range(width):
-            zz[l] = bimax_by_peakfinder(z, 255 - frame_resized[:, l], distance = kwargs['borders_min_distance'], prominence = prominence)
+            zz[l] = bimax_by_peakfinder(z, 255 - frame_resized[:, l], distance = distance, prominence = prominence)
 
     z1, y1, z2, y2 = zz[:,0], zz[:,1], zz[:,2], zz[:,3]
 
-    x = np.linspace(0, width / kwargs['resize_factor'], width, endpoint=False)
+    x = np.linspace(0, width / resize_factor, width, endpoint=False)
 
     x1, x2 = x.copy(), x.copy()
 
@@ -535,8 +725,203 @@ def borders_via_peakfinder(frame:np.ndarray, prominence:float = 1, do_fit:bool=F
     infrightorder = x_zinf.argsort()
     x_zinf, zinf = x_zinf[infrightorder], zinf[infrightorder]
 
+    if kwargs['native_resolution']:
+        return upsample_columns(np.array([zinf, zsup]), kwargs['resize_factor'])
+
     return np.array([zinf, zsup])
 
+### BATCHED BORDERS FINDING
+
+# The maximum number of samples (frames * height * width, after resizing) processed at once by borders_via_peakfinder_batch
+borders_batch_max_samples:int = 2**22
+
+def find_peaks_batch(y:np.ndarray, distance:float = 1, prominence:float = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the peaks of all the lines of y at once, exactly like scipy.signal.find_peaks(y[i], distance=distance, prominence=prominence).
+
+    The local maxima (the middle of the plateaus) are found with array operations. The distance selection only needs
+    a loop on the lines where two peaks are closer than distance (never for distance <= 2). The prominence of all
+    the peaks is checked at once, by going away from each peak until a sample low enough or higher than the peak is met.
+
+    :param y: The lines (2D, one line per row)
+    :param distance: The min distance between two peaks
+    :param prominence: The min prominence of the peaks
+    :return: The rows and the indices of the peaks, sorted by row then by index
+    """
+    n_lines, length = y.shape
+    if length < 3:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+    ### LOCAL MAXIMA
+    # ascent[:, i] (resp. descent) if y goes up (resp. down) between i and i+1
+    ascent = y[:, 1:] > y[:, :-1]
+    descent = y[:, 1:] < y[:, :-1]
+    # the next step which is not flat (length - 1 if there is none)
+    steps = np.where(ascent | descent, np.arange(length - 1), length - 1)
+    next_step = np.minimum.accumulate(steps[:, ::-1], axis=1)[:, ::-1]
+    # a plateau (possibly of length 1) starting with an ascent and ending with a descent is a peak
+    rows, left_edges = np.divmod(np.flatnonzero(ascent[:, :-1]), length - 2)
+    left_edges += 1
+    right_edges = next_step.ravel()[rows * (length - 1) + left_edges]
+    is_peak = right_edges < length - 1
+    is_peak[is_peak] = descent.ravel()[rows[is_peak] * (length - 1) + right_edges[is_peak]]
+    rows, peaks = rows[is_peak], (left_edges[is_peak] + right_edges[is_peak]) // 2
+
+    ### DISTANCE
+    min_distance = int(np.ceil(distance))
+    if min_distance > 2: # consecutive peaks are always at least 2 samples apart
+        too_close = (rows[1:] == rows[:-1]) & (peaks[1:] - peaks[:-1] < min_distance)
+        keep = np.ones(len(peaks), dtype=bool)
+        for row in np.unique(rows[1:][too_close]):
+            row_start, row_stop = np.searchsorted(rows, [row, row + 1])
+            row_peaks = peaks[row_start:row_stop]
+            row_keep = keep[row_start:row_stop] # a view
+            # the biggest peaks first, sorted as in scipy.signal._peak_finding_utils._select_by_peak_distance
+            for j in np.argsort(y[row, row_peaks].astype(float))[::-1]:
+                if row_keep[j]:
+                    close = np.abs(row_peaks - row_peaks[j]) < min_distance
+                    close[j] = False
+                    row_keep[close] = False
+        rows, peaks = rows[keep], peaks[keep]
+
+    ### PROMINENCE
+    if prominence > 0:
+        y_flat = y.astype(float, copy=False).ravel()
+        heights = y_flat[rows * length + peaks]
+        prominent = np.ones(len(peaks), dtype=bool)
+        for direction in [-1, 1]:
+            side_ok = np.zeros(len(peaks), dtype=bool)
+            # the peaks for which we do not know yet, with their rows, heights and the position we are at
+            active, active_rows, active_heights, positions = np.arange(len(peaks)), rows, heights, peaks + direction
+            while len(active) > 0:
+                inside = (positions >= 0) & (positions < length)
+                values = y_flat[active_rows * length + np.clip(positions, 0, length - 1)]
+                low_enough = inside & (active_heights - values >= prominence)
+                side_ok[active[low_enough]] = True
+                # stop at the edges, at the samples low enough, and at the samples higher than the peak
+                unresolved = inside & ~low_enough & (values <= active_heights)
+                active, active_rows, active_heights = active[unresolved], active_rows[unresolved], active_heights[unresolved]
+                positions = positions[unresolved] + direction
+            prominent &= side_ok
+        rows, peaks = rows[prominent], peaks[prominent]
+
+    return rows, peaks
+
+def bimax_indices_batch(y:np.ndarray, distance:float = 1, prominence:float = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The indices of the 2 bigger maxs of each line of y, the same as bimax_indices_by_peakfinder (for equal maxs,
+    the last one is taken first).
+
+    :param y: The lines (2D, one line per row)
+    :param distance:
+    :param prominence:
+    :return: The indices (n_lines, 2) and whether each line has 2 peaks (n_lines)
+    """
+    n_lines, length = y.shape
+    rows, peaks = find_peaks_batch(y, distance=distance, prominence=prominence)
+    found = np.bincount(rows, minlength=n_lines) >= 2
+
+    heights = np.full((n_lines, length), -np.inf)
+    heights[rows, peaks] = y[rows, peaks]
+    # the 3 bigger peaks of each line (looking from the end, so that the last of equal peaks comes first)
+    indices = np.zeros((n_lines, 3), dtype=int)
+    top_heights = np.zeros((n_lines, 3))
+    lines = np.arange(n_lines)
+    for i in range(3):
+        indices[:, i] = length - 1 - np.argmax(heights[:, ::-1], axis=1)
+        top_heights[:, i] = heights[lines, indices[:, i]]
+        heights[lines, indices[:, i]] = -np.inf
+
+    # when the second peak is as big as another one, which one is taken depends on the sort: we use the same one
+    ambiguous = found & ((top_heights[:, 1] == top_heights[:, 0]) | (top_heights[:, 1] == top_heights[:, 2]))
+    for line in np.nonzero(ambiguous)[0]:
+        line_start, line_stop = np.searchsorted(rows, [line, line + 1])
+        line_peaks = peaks[line_start:line_stop]
+        sorted = y[line, line_peaks].argsort()
+        indices[line, :2] = line_peaks[sorted][-1], line_peaks[sorted][-2]
+
+    return indices[:, :2], found
+
+def borders_via_peakfinder_batch(frames:np.ndarray, prominence:float = 1, do_fit:bool = False,
+                                 fit_params:Optional[np.ndarray] = None, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Same as borders_via_peakfinder, for a whole stack of frames at once.
+
+    The frames are processed by blocks of borders_batch_max_samples samples, all the columns of a block at once
+    (see find_peaks_batch). The results are identical to those of borders_via_peakfinder on each frame.
+    With do_fit, the columns of each frame are fitted at once, starting from the parameters fitted on the frame before.
+
+    :param frames: The frames (length, height, width)
+    :param prominence:
+    :param do_fit:
+    :param fit_params: With do_fit, the parameters fitted on the frame before this stack (one line per column of the
+        resized frame, see bimax_fit_by_peakfinder_batch), updated with those of the last frame.
+    :param kwargs: see borders_via_peakfinder
+    :return: The borders (length, 2, width * resize_factor), and whether the borders could not be found for each frame
+        (some column has less than 2 peaks, the borders of this frame are then zeros)
+    """
+    for key in default_kwargs.keys():
+        if not key in kwargs.keys():
+            kwargs[key] = default_kwargs[key]
+
+    # see borders_via_peakfinder
+    resize_factor = 1 if kwargs['native_resolution'] else kwargs['resize_factor']
+    distance = max(1., kwargs['borders_min_distance'] / kwargs['resize_factor']) if kwargs['native_resolution'] else kwargs['borders_min_distance']
+
+    length, height, width = frames.shape
+    brds = np.zeros((length, 2, width * kwargs['resize_factor']), dtype=float)
+    failed = np.zeros(length, dtype=bool)
+
+    block_size = max(1, borders_batch_max_samples // max(1, height * width * resize_factor**2))
+    for start in range(0, length, block_size):
+        block = frames[start:start + block_size]
+        n_frames = len(block)
+        if kwargs['native_resolution']:
+            block_resized = block.astype(float, copy=False)
+        else:
+            block_resized = datareading.resize_frames(block, resize_factor=resize_factor)
+        _, height_resized, width_resized = block_resized.shape
+
+        # one line per column of each frame
+        y = np.ascontiguousarray((255 - block_resized).transpose(0, 2, 1)).reshape(n_frames * width_resized, height_resized)
+        peaks, found = bimax_indices_batch(y, distance=distance, prominence=prominence)
+
+        if do_fit:
+            z = np.arange(height_resized) / resize_factor
+            if fit_params is None:
+                fit_params = np.full((width_resized, 7), np.nan)
+            z1, y1, z2, y2 = np.zeros((4, n_frames * width_resized))
+            for i_frame in range(n_frames):
+                lines = slice(i_frame * width_resized, (i_frame + 1) * width_resized)
+                if found[lines].all():
+                    z1[lines], y1[lines], z2[lines], y2[lines] = bimax_fit_by_peakfinder_batch(z, y[lines], peaks[lines], fit_params=fit_params)
+        elif kwargs['native_resolution']:
+            positions, values = utility.refine_peaks_parabolic(y, peaks)
+            z1, z2 = positions[:, 0], positions[:, 1]
+            y1, y2 = values[:, 0], values[:, 1]
+        else:
+            values = np.take_along_axis(y, peaks, axis=1).astype(float)
+            z1, z2 = peaks[:, 0] / resize_factor, peaks[:, 1] / resize_factor
+            y1, y2 = values[:, 0], values[:, 1]
+
+        # remove too spaced away, and too different peaks
+        deuxmax = (np.abs(z1 - z2) < kwargs['max_rivulet_width']) & (np.abs(y1 - y2) < kwargs['max_borders_luminosity_difference'])
+        # if there is only one max, we keep the bigger one
+        zbig = np.where(y1 > y2, z1, z2)
+        zinf = np.where(deuxmax, np.minimum(z1, z2), zbig).reshape(n_frames, width_resized)
+        zsup = np.where(deuxmax, np.maximum(z1, z2), zbig).reshape(n_frames, width_resized)
+
+        block_brds = np.stack([zinf, zsup], axis=1)
+        if kwargs['native_resolution']:
+            block_brds = upsample_columns(block_brds, kwargs['resize_factor'])
+        block_failed = ~found.reshape(n_frames, width_resized).all(axis=1)
+        block_brds[block_failed] = 0.
+
+        brds[start:start + n_frames] = block_brds
+        failed[start:start + n_frames] = block_failed
+
+    return brds, failed
+
 ### GLOBAL METHOD
 
 def get_acquisition_path_from_parameters(**parameters) -> str:
@@ -554,46 +939,333 @@ def get_acquisition_path_from_parameters(**parameters) -> str:
 
     return acquisition_path
 
+def get_rolling_bckgnd_parameters(**parameters) -> Tuple[int, str, float]:
+    return (parameters.get('rolling_bckgnd_window', default_kwargs['rolling_bckgnd_window']),
+            parameters.get('rolling_bckgnd_method', default_kwargs['rolling_bckgnd_method']),
+            parameters.get('rolling_bckgnd_percentile', default_kwargs['rolling_bckgnd_percentile']))
+
 def get_frames_from_parameters(**parameters):
     acquisition_path = get_acquisition_path_from_parameters(**parameters)
 
     # Parameters getting
     roi = parameters.get('roi', None)
     framenumbers = parameters.get('framenumbers', None)
+    window, method, percentile = get_rolling_bckgnd_parameters(**parameters)
 
     # Data fetching
-    frames = datareading.get_frames(acquisition_path, framenumbers = framenumbers, subregion=roi)
+    frames = datareading.get_frames(acquisition_path, framenumbers = framenumbers, subregion=roi, use_memmap=True)
     length, height, width = frames.shape
 
+    # the rolling background replaces the median one
+    # (the frames without background are shifted to a minimum of 0, see datareading.iter_frames_without_rolling_bckgnd)
+    if window > 0:
+        frames = np.concatenate(list(datareading.remove_rolling_bckgnd([frames], window, method=method, percentile=percentile)))
+        frames -= frames.min()
+        return frames
+
     frames = frames.astype(float, copy=False)
 
     if parameters.get('remove_median_bckgnd', default_kwargs['remove_median_bckgnd']):
-        frames = frames - np.median(frames, axis=0, keepdims=True)
+        frames -= datareading.get_median_bckgnd(acquisition_path, framenumbers=framenumbers, subregion=roi)
         frames -= frames.min()
 
     return frames
 
+def iter_frames_from_parameters(**parameters):
+    """
+    Same as get_frames_from_parameters, but yields the frames by chunks (of datareading.default_chunk_size frames)
+    so that they are never all in memory. The next chunks are read in the background while the current one is used
+    (see datareading.prefetch).
+    The median background is computed by chunks too (see datareading.get_median_bckgnd), and removed from each chunk.
+    The rolling background is updated as the frames come (see datareading.remove_rolling_bckgnd). As in
+    get_frames_from_parameters, it replaces the median background.
+
+    :param parameters:
+    :return:
+    """
+    acquisition_path = get_acquisition_path_from_parameters(**parameters)
+
+    # Parameters getting
+    roi = parameters.get('roi', None)
+    framenumbers = parameters.get('framenumbers', None)
+    window, method, percentile = get_rolling_bckgnd_parameters(**parameters)
+
+    if window > 0:
+        for frames, _, _ in datareading.iter_frames_without_rolling_bckgnd(acquisition_path, window, method=method, percentile=percentile,
+                                                                           framenumbers=framenumbers, subregion=roi,
+                                                                           prefetch_depth=datareading.default_prefetch_depth):
+            yield frames
+        return
+
+    if parameters.get('remove_median_bckgnd', default_kwargs['remove_median_bckgnd']):
+        for frames, _, _ in datareading.iter_frames_without_median_bckgnd(acquisition_path, framenumbers=framenumbers, subregion=roi,
+                                                                          prefetch_depth=datareading.default_prefetch_depth):
+            yield frames
+        return
+
+    chunks = datareading.iter_frames(acquisition_path, framenumbers=framenumbers, subregion=roi)
+    for frames, _, _ in datareading.prefetch(chunks, prefetch_depth=datareading.default_prefetch_depth):
+        yield frames.astype(float, copy=False)
+
+def get_geometry_from_parameters(**parameters):
+    acquisition_path = get_acquisition_path_from_parameters(**parameters)
+    return datareading.get_geometry(acquisition_path, framenumbers=parameters.get('framenumbers', None), subregion=parameters.get('roi', None))
+
+
+### PARALLEL FINDING
+
+# The number of processes used by the finders (find_borders, find_cos, find_bol). 1 to find in this process.
+finding_workers:int = 1
+# The processes are used only if each one has at least that many frames to process
+finding_min_frames_per_worker:int = 100
+# The finders starting from the result of the frame before (the fits of find_borders) start afresh every that many
+# frames of the video, so that their results depend neither on the chunks nor on the workers (see find_framewise)
+finding_range_frames:int = 100
+# The pool of processes, created the first time it is needed and kept for the next finders (see get_finding_executor)
+finding_executor:Optional[ProcessPoolExecutor] = None
+
+SharedArray = Tuple[str, Tuple[int, ...], str] # name, shape, dtype of an array in shared memory
+
+def create_shared_array(shape:Tuple[int, ...], dtype:Any) -> Tuple[shared_memory.SharedMemory, np.ndarray, SharedArray]:
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf), (shm.name, tuple(shape), dtype.str)
+
+def attach_shared_array(shared_array:SharedArray) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    name, shape, dtype = shared_array
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+def find_frames(finder, frames:np.ndarray, results:np.ndarray, failed:np.ndarray, borders:Optional[np.ndarray] = None,
+                batched:bool = False, range_size:Optional[int] = None, **parameters) -> None:
+    """
+    Applies a finder to frames, writing the results and whether it failed for each frame.
+
+    :param finder: A framewise function (cos_framewise, bol_framewise_opti...), or with batched a function of a stack
+        of frames returning the results and the failures (borders_via_peakfinder_batch)
+    :param frames:
+    :param results: Where to write the results, one per frame
+    :param failed: Where to write whether the finder failed, one per frame
+    :param borders: The borders of each frame, given to the finder as borders_for_this_frame
+    :param batched:
+    :param range_size: With batched, the finder is given the frames by ranges of that many frames (all at once by default)
+    :param parameters: Given to the finder
+    :return:
+    """
+    # the floating point errors make the finder fail instead of giving nans (only here, not for the caller)
+    with np.errstate(all='raise'):
+        if batched:
+            range_size = len(frames) if range_size is None else range_size
+            for start in range(0, len(frames), max(range_size, 1)):
+                target = slice(start, start + range_size)
+                try:
+                    results[target], failed[target] = finder(frames[target], **parameters)
+                except Exception:
+                    # only the frames on which the finder fails are lost, not the whole range
+                    for i_frame in range(start, min(start + range_size, len(frames))):
+                        try:
+                            frame_results, frame_failed = finder(frames[i_frame:i_frame+1], **parameters)
+                            results[i_frame], failed[i_frame] = frame_results[0], frame_failed[0]
+                        except Exception:
+                            results[i_frame], failed[i_frame] = 0., True
+            return
+        for i_frame, frame in enumerate(frames):
+            try:
+                if borders is None:
+                    results[i_frame] = finder(frame, **parameters)
+                else:
+                    results[i_frame] = finder(frame, borders_for_this_frame=borders[i_frame], **parameters)
+                failed[i_frame] = False
+            except Exception:
+                failed[i_frame] = True
+
+def find_frames_in_shared_memory(finder, frames_array:SharedArray, frames_range:Tuple[int, int], first_index:int,
+                                 results_array:SharedArray, failed_array:SharedArray, borders_array:Optional[SharedArray],
+                                 batched:bool, range_size:Optional[int], parameters:Dict[str, Any]) -> None:
+    """
+    Applies find_frames to a range of the frames in shared memory, writing in the results in shared memory at
+    first_index + range. This runs in a worker process.
+    """
+    shms = []
+    try:
+        frames_shm, frames = attach_shared_array(frames_array)
+        results_shm, results = attach_shared_array(results_array)
+        failed_shm, failed = attach_shared_array(failed_array)
+        shms += [frames_shm, results_shm, failed_shm]
+        borders = None
+        if borders_array is not None:
+            borders_shm, borders = attach_shared_array(borders_array)
+            shms.append(borders_shm)
+
+        start, stop = frames_range
+        target = slice(first_index + start, first_index + stop)
+        find_frames(finder, frames[start:stop], results[target], failed[target],
+                    borders=None if borders is None else borders[target], batched=batched, range_size=range_size, **parameters)
+        del frames, results, failed, borders # the shared memory can only be closed once nothing views it
+    finally:
+        for shm in shms:
+            shm.close()
+
+def shutdown_finding_executor() -> None:
+    global finding_executor
+    if finding_executor is not None:
+        finding_executor.shutdown(wait=True, cancel_futures=True)
+        finding_executor = None
+
+def get_finding_executor(n_workers:int) -> ProcessPoolExecutor:
+    """
+    The pool of processes of the finders, with n_workers processes. Starting processes takes seconds, so the pool is
+    kept from one call to the next (and shut down at exit), and only created again if n_workers changes.
+    """
+    global finding_executor
+    if finding_executor is not None and finding_executor._max_workers != n_workers:
+        shutdown_finding_executor()
+    if finding_executor is None:
+        finding_executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'))
+    return finding_executor
+
+atexit.register(shutdown_finding_executor)
+
+def iter_aligned_chunks(chunks, range_size:int):
+    """
+    Regroups chunks of frames so that each one starts at a multiple of range_size frames from the beginning of the
+    video, and holds a whole number of ranges (except the last one).
+    """
+    leftover = None
+    for frames in chunks:
+        if leftover is not None:
+            frames = np.concatenate([leftover, frames])
+        n_aligned = len(frames) - len(frames) % range_size
+        if n_aligned > 0:
+            yield frames[:n_aligned]
+        leftover = frames[n_aligned:] if n_aligned < len(frames) else None
+    if leftover is not None:
+        yield leftover
+
+def find_framewise(finder, chunks, length:int, result_shape:Tuple[int, ...], borders:Optional[np.ndarray] = None,
+                   batched:bool = False, chained:bool = False, n_workers:Optional[int] = None, description:Optional[str] = None,
+                   **parameters) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Applies a finder to all the frames of a video, given by chunks (see iter_frames_from_parameters).
+
+    With several workers, each chunk is put in shared memory and split in ranges of frames, one per worker process,
+    which write their results in a shared array: the frames and the results are never pickled. The next chunk is
+    put in another shared memory while the workers process the current one. The processes are used only if each one
+    gets at least finding_min_frames_per_worker frames, and they are kept for the next calls (see get_finding_executor).
+
+    A chained finder starts from the result of the previous frame within each call (e.g. the fits of
+    borders_via_peakfinder_batch). It is then given the frames by ranges of finding_range_frames frames, at the same
+    places of the video whatever the chunks and the workers (see iter_aligned_chunks), so that its results do not
+    depend on them.
+
+    :param finder: see find_frames
+    :param chunks: The frames, by chunks
+    :param length: The total number of frames
+    :param result_shape: The shape of the result for one frame
+    :param borders: The borders of each frame (length, ...), see find_frames
+    :param batched: see find_frames
+    :param chained: With batched, if the result of each frame depends on the frames before in the same call
+    :param n_workers: The number of processes (finding_workers by default)
+    :param description: Displayed with the progress
+    :param parameters: Given to the finder
+    :return: The results (length, *result_shape), and whether the finder failed on each frame (the results are then 0)
+    """
+    if n_workers is None:
+        n_workers = finding_workers
+    n_workers = min(n_workers, length // max(finding_min_frames_per_worker, 1))
+    range_size = max(finding_range_frames, 1) if batched and chained else None
+    if range_size is not None:
+        chunks = iter_aligned_chunks(chunks, range_size)
+
+    if n_workers <= 1:
+        results = np.zeros((length,) + tuple(result_shape), dtype=float)
+        failed = np.zeros(length, dtype=bool)
+        framenumber = 0
+        for frames in chunks:
+            target = slice(framenumber, framenumber + len(frames))
+            find_frames(finder, frames, results[target], failed[target],
+                        borders=None if borders is None else borders[target], batched=batched, range_size=range_size, **parameters)
+            framenumber += len(frames)
+            if description is not None:
+                display(f'{description} ({round(100*framenumber/length, 2)} %)', end = '\r')
+        return results, failed
+
+    shms = []
+    views:Dict[str, np.ndarray] = {} # the arrays viewing the shared memories, which must be deleted before closing them
+    pending = [[], []]
+    try:
+        results_shm, views['results'], results_array = create_shared_array((length,) + tuple(result_shape), float)
+        failed_shm, views['failed'], failed_array = create_shared_array((length,), bool)
+        shms += [results_shm, failed_shm]
+        views['results'][:], views['failed'][:] = 0., False
+        borders_array = None
+        if borders is not None:
+            borders_shm, views['borders'], borders_array = create_shared_array(borders.shape, float)
+            shms.append(borders_shm)
+            views['borders'][:] = borders
+
+        # 2 shared memories for the frames, used alternately
+        frames_arrays:List[Optional[SharedArray]] = [None, None]
+        executor = get_finding_executor(n_workers)
+        framenumber = 0
+        for i_chunk, frames in enumerate(chunks):
+            slot = i_chunk % 2
+            for future in pending[slot]:
+                future.result()
+            if frames_arrays[slot] is None or frames_arrays[slot][1:] != (frames.shape, frames.dtype.str):
+                frames_shm, views[f'frames{slot}'], frames_arrays[slot] = create_shared_array(frames.shape, frames.dtype)
+                shms.append(frames_shm)
+            views[f'frames{slot}'][:] = frames
+
+            # the frames are split between the workers (by whole ranges for a chained finder)
+            unit = 1 if range_size is None else range_size
+            n_units = -(-len(frames) // unit)
+            ranges = np.minimum(np.linspace(0, n_units, min(n_workers, n_units) + 1).astype(int) * unit, len(frames))
+            pending[slot] = [executor.submit(find_frames_in_shared_memory, finder, frames_arrays[slot], (start, stop), framenumber,
+                                             results_array, failed_array, borders_array, batched, range_size, parameters)
+                             for start, stop in zip(ranges[:-1], ranges[1:])]
+            framenumber += len(frames)
+            if description is not None:
+                display(f'{description} ({round(100*framenumber/length, 2)} %)', end = '\r')
+        for future in pending[0] + pending[1]:
+            future.result()
+
+        results, failed = views['results'].copy(), views['failed'].copy()
+    except BaseException:
+        # a process which died leaves the pool broken: the next call starts a new one
+        if finding_executor is not None and finding_executor._broken:
+            shutdown_finding_executor()
+        raise
+    finally:
+        # the pool is kept, so the ranges still waiting must not run on freed memory
+        for future in pending[0] + pending[1]:
+            future.cancel()
+        wait(pending[0] + pending[1])
+        views.clear()
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+    return results, failed
+
+def report_failed_frames(failed:np.ndarray, description:str, verbose:Optional[int] = None) -> None:
+    if failed.any():
+        log_warn(f'{description} failed on {failed.sum()} frames: {np.nonzero(failed)[0]}', verbose=verbose)
+
 
 def find_borders(**parameters):
     # Get the frames
-    frames = get_frames_from_parameters(**parameters)
-    length, height, width = frames.shape
+    length, height, width = get_geometry_from_parameters(**parameters)
 
     for key in default_kwargs.keys():
         if not key in parameters.keys():
             parameters[key] = default_kwargs[key]
 
-    brds = np.zeros((length, 2, width * parameters['resize_factor']), float)
-
-    np.seterr(all='raise')
-    for framenumber in range(length):
-        try:
-            brds[framenumber] = borders_via_peakfinder(frames[framenumber], **parameters)
-        except:
-            print(f'Error frame {framenumber}')
-        if framenumber%10 == 0:
-            display(f'Borders finding ({round(100*(framenumber+1)/length, 2)} %)', end = '\r')
+    # all the frames of a chunk at once. With do_fit, the fit of each frame starts from the one of the frame before
+    brds, failed = find_framewise(borders_via_peakfinder_batch, iter_frames_from_parameters(**parameters), length,
+                                  (2, width * parameters['resize_factor']), batched=True, chained=parameters.get('do_fit', False),
+                                  description='Borders finding', **parameters)
     display(f'', end = '\r')
+    report_failed_frames(failed, 'Borders finding', verbose=parameters['verbose'])
     log_debug(f'Borders found', verbose=parameters['verbose'])
 
     return brds
@@ -615,26 +1287,27 @@ def find_cos(**parameters):
     # Parameters getting
     roi = parameters.get('roi', None)
     framenumbers = parameters.get('framenumbers', None)
+    window, method, percentile = get_rolling_bckgnd_parameters(**parameters)
 
     # Data fetching
-    frames = datareading.get_frames(acquisition_path, framenumbers = framenumbers, subregion=roi)
-    length, height, width = frames.shape
-
-    if parameters['remove_median_bckgnd']:
-        frames = frames - np.median(frames, axis=0, keepdims=True)
+    length, height, width = datareading.get_geometry(acquisition_path, framenumbers = framenumbers, subregion=roi)
+    if window > 0:
+        chunks = (frames for frames, _, _ in datareading.iter_frames_without_rolling_bckgnd(acquisition_path, window, method=method, percentile=percentile,
+                                                                                            framenumbers=framenumbers, subregion=roi,
+                                                                                            prefetch_depth=datareading.default_prefetch_depth))
+    elif parameters.get('remove_median_bckgnd', default_kwargs['remove_median_bckgnd']):
+        chunks = (frames for frames, _, _ in datareading.iter_frames_without_median_bckgnd(acquisition_path, framenumbers=framenumbers, subregion=roi,
+                                                                                           prefetch_depth=datareading.default_prefetch_depth))
+    else:
+        chunks = (frames for frames, _, _ in datareading.iter_frames(acquisition_path, framenumbers = framenumbers, subregion=roi,
+                                                                     prefetch_depth=datareading.default_prefetch_depth))
 
     for key in default_kwargs.keys():
         if not key in parameters.keys():
             parameters[key] = default_kwargs[key]
 
-    rivs = np.zeros((length, width * parameters['resize_factor']), float)
-
-    np.seterr(all='raise')
-    for framenumber in range(length):
-        try:
-            rivs[framenumber] = cos_framewise(frames[framenumber], **parameters)
-        except:
-            print(f'Error frame {framenumber}')
+    rivs, failed = find_framewise(cos_framewise, chunks, length, (width * parameters['resize_factor'],), **parameters)
+    report_failed_frames(failed, 'COS finding', verbose=parameters['verbose'])
 
     return rivs
 
@@ -801,7 +1474,12 @@ def bol_framewise_opti(frame:np.ndarray, borders_for_this_frame = None, **kwargs
 
     height, width = frame.shape
 
-    l = datareading.resize_frame(frame, resize_factor=kwargs['resize_factor']).astype(float, copy=False)
+    if kwargs['native_resolution']:
+        # the center of mass is already sub-pixel, there is no need to resize
+        borders_for_this_frame = native_columns(borders_for_this_frame, kwargs['resize_factor'])
+        l = frame.astype(float, copy=False)
+    else:
+        l = datareading.resize_frame(frame, resize_factor=kwargs['resize_factor']).astype(float, copy=False)
 
     height_resized, width_resized= l.shape
 
@@ -840,6 +1518,9 @@ def bol_framewise_opti(frame:np.ndarray, borders_for_this_frame = None, **kwargs
     rivulet[nonzerosum] = np.sum(z_channel * weights, axis=0)[nonzerosum] / np.sum(weights, axis=0)[nonzerosum]
     rivulet[np.bitwise_not(nonzerosum)] = ((z_bot+z_top)/2)[np.bitwise_not(nonzerosum)]
 
+    if kwargs['native_resolution']:
+        rivulet = upsample_columns(rivulet, kwargs['resize_factor'])
+
     return rivulet
 
 def find_bol(verbose:int = 1, **parameters):
@@ -847,24 +1528,16 @@ def find_bol(verbose:int = 1, **parameters):
     borders_for_this_video = datasaving.fetch_or_generate_data_from_parameters('borders', parameters, verbose=verbose)
 
     # Then the frames
-    frames = get_frames_from_parameters(**parameters)
-    length, height, width = frames.shape
+    length, height, width = get_geometry_from_parameters(**parameters)
 
     for key in default_kwargs.keys():
         if not key in parameters.keys():
             parameters[key] = default_kwargs[key]
 
-    rivs = np.zeros((length, width * parameters['resize_factor']), float)
-
-    np.seterr(all='raise')
-    for framenumber in range(length):
-        try:
-            rivs[framenumber] = bol_framewise_opti(frames[framenumber], borders_for_this_frame=borders_for_this_video[framenumber], **parameters)
-        except:
-            print(f'Error frame {framenumber}')
-        if framenumber%10 == 0:
-            display(f'BOL finding ({round(100*(framenumber+1)/length,2)} %)', end='\r')
+    rivs, failed = find_framewise(bol_framewise_opti, iter_frames_from_parameters(**parameters), length, (width * parameters['resize_factor'],),
+                                  borders=borders_for_this_video, description='BOL finding', **parameters)
     display(f'', end = '\r')
+    report_failed_frames(failed, 'BOL finding', verbose=parameters['verbose'])
     log_debug(f'BOL computed', verbose=parameters['verbose'])
 
     return rivs
@@ -946,7 +1619,12 @@ def bbs_framewise(frame:np.ndarray, **kwargs)-> np.ndarray:
 
     all_borders: np.ndarray = borders_via_peakfinder(frame, **kwargs)
 
-    frame = datareading.resize_frame(frame, resize_factor=kwargs['resize_factor'])
+    resize_factor = 1 if kwargs['native_resolution'] else kwargs['resize_factor']
+    if kwargs['native_resolution']:
+        all_borders = native_columns(all_borders, kwargs['resize_factor'])
+        frame = frame.astype(float, copy=False)
+    else:
+        frame = datareading.resize_frame(frame, resize_factor=resize_factor)
 
     height, width = frame.shape
     z = np.arange(height)
@@ -954,14 +1632,17 @@ def bbs_framewise(frame:np.ndarray, **kwargs)-> np.ndarray:
     zz = np.empty(width, dtype=float)
 
     for i_line in range(width):
-        these_borders = all_borders[:,i_line] * kwargs['resize_factor']
+        these_borders = all_borders[:,i_line] * resize_factor
         # plt.scatter([i_line/2], these_borders[0], color='w')
         # plt.scatter([i_line/2], these_borders[1], color='w')
 
         zz[i_line] = bbs_linewise(z, frame[:, i_line], borders=these_borders, **kwargs)
 
     # take into account the resizing
-    zz /= kwargs['resize_factor']
+    zz /= resize_factor
+
+    if kwargs['native_resolution']:
+        zz = upsample_columns(zz, kwargs['resize_factor'])
 
     return zz
 
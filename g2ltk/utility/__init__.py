@@ -134,6 +134,25 @@ def find_global_max(x: np.ndarray, y: np.ndarray) -> Optional[float]:
     """
     return find_global_peak(x, y, 'max')
 
+def refine_peaks_parabolic(y: np.ndarray, peaks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gets a subpixel resolution on peaks of a sampled function, by fitting a parabola on each peak and its 2 neighbours.
+
+    :param y: The samples (1D), or several series of samples along the last axis.
+    :param peaks: The indices of the peaks in y (not on the edges), same shape as y except for the last axis.
+    :return: The positions (in samples, float) and values of the summits of the parabolas.
+    """
+    peaks = np.asarray(peaks)
+    y = np.asarray(y, dtype=float)
+    y_left = np.take_along_axis(y, np.clip(peaks - 1, 0, y.shape[-1] - 1), axis=-1)
+    y_peak = np.take_along_axis(y, peaks, axis=-1)
+    y_right = np.take_along_axis(y, np.clip(peaks + 1, 0, y.shape[-1] - 1), axis=-1)
+    curvature = y_left - 2 * y_peak + y_right
+    # flat peaks (zero curvature) stay where they are
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = np.where(curvature < 0, 0.5 * (y_left - y_right) / np.where(curvature < 0, curvature, -1.), 0.)
+    return peaks + delta, y_peak - 0.25 * (y_left - y_right) * delta
+
 def find_inflexion_point(x: np.ndarray, y: np.ndarray):
     dx, dy = der1(x, y)
     return find_global_peak(dx, dy)
@@ -203,6 +222,10 @@ def correct_extent(arr_x:np.ndarray, arr_y:np.ndarray, origin='upper') -> Tuple[
 
 from .fourier import *
 
+### BATCHED FITS
+
+from .fitting import *
+
 ########## SAVE GRAPHE
 
 from .genfig import *
@@ -0,0 +1,122 @@
+from typing import Optional, Any, Tuple, Dict, List, Union
+import numpy as np
+
+from .. import display, throw_G2L_warning, log_error, log_warn, log_info, log_debug, log_trace, log_subtrace
+
+from . import double_gauss
+
+### BATCHED FITS
+
+# Default stopping criteria of the batched fits (the same as scipy.optimize.curve_fit with bounds, which evaluates
+# the function at most 100 times per parameter)
+fit_max_iterations:int = 700
+fit_ftol:float = 1e-8
+fit_xtol:float = 1e-8
+
+def double_gauss_jacobian(x:np.ndarray, params:np.ndarray) -> np.ndarray:
+    """
+    The derivatives of double_gauss with respect to its 7 parameters (x1, a1, w1, x2, a2, w2, bckgnd_noise),
+    for several sets of parameters at once.
+
+    :param x: The points (m), or the points for each set of parameters (n, m)
+    :param params: The sets of parameters (n, 7)
+    :return: The jacobians (n, m, 7)
+    """
+    n_sets = params.shape[0]
+    n_points = np.shape(x)[-1]
+    jacobian = np.empty((n_sets, n_points, 7))
+    for i_gauss in range(2):
+        xi, ai, wi = [params[:, 3 * i_gauss + i, None] for i in range(3)]
+        u = (x - xi) / wi
+        e = np.exp(-u**2 / 2)
+        jacobian[:, :, 3 * i_gauss] = ai * e * u / wi
+        jacobian[:, :, 3 * i_gauss + 1] = e
+        jacobian[:, :, 3 * i_gauss + 2] = ai * e * u**2 / wi
+    jacobian[:, :, 6] = 1.
+    return jacobian
+
+def fit_double_gauss_batch(x:np.ndarray, y:np.ndarray, p0:np.ndarray, lbounds:np.ndarray, ubounds:np.ndarray,
+                           max_iterations:Optional[int] = None, ftol:Optional[float] = None, xtol:Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Fits double_gauss on many series of samples at once, with a Levenberg-Marquardt algorithm.
+
+    Each series has its own damping. The steps are projected on the bounds, and the parameters on a bound are fixed
+    while the fit pushes them out of it. The series which have converged are not computed anymore.
+    This replaces one scipy.optimize.curve_fit per series.
+
+    :param x: The points (m), or the points for each series (n, m)
+    :param y: The series (n, m)
+    :param p0: The initial parameters (n, 7), e.g. those fitted on the previous frame
+    :param lbounds: The lower bounds of the parameters (7) or (n, 7)
+    :param ubounds: The upper bounds of the parameters (7) or (n, 7)
+    :param max_iterations: Maximum number of iterations (fit_max_iterations by default)
+    :param ftol: Stop when the relative decrease of the cost is smaller (fit_ftol by default)
+    :param xtol: Stop when the relative change of the parameters is smaller (fit_xtol by default)
+    :return: The fitted parameters (n, 7), and whether each fit has converged (n)
+    """
+    max_iterations = fit_max_iterations if max_iterations is None else max_iterations
+    ftol = fit_ftol if ftol is None else ftol
+    xtol = fit_xtol if xtol is None else xtol
+
+    y = np.asarray(y, dtype=float)
+    n_series = y.shape[0]
+    x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+    lbounds = np.broadcast_to(np.asarray(lbounds, dtype=float), (n_series, 7))
+    ubounds = np.broadcast_to(np.asarray(ubounds, dtype=float), (n_series, 7))
+
+    # the parameters are kept strictly within the bounds (e.g. a null width is not a gaussian)
+    margin = 1e-6 * (ubounds - lbounds)
+    lbounds, ubounds = lbounds + margin, ubounds - margin
+    params = np.clip(np.asarray(p0, dtype=float), lbounds, ubounds)
+    converged = np.zeros(n_series, dtype=bool)
+
+    def residuals(x_, y_, params_):
+        return y_ - double_gauss(x_, *[params_[:, i, None] for i in range(7)])
+
+    # the computations can overflow for degenerate parameters (e.g. null widths): these steps are rejected
+    with np.errstate(all='ignore'):
+        cost = (residuals(x, y, params)**2).sum(axis=1)
+        damping = np.full(n_series, 1.)
+        active = np.nonzero(np.isfinite(cost))[0]
+
+        for iteration in range(max_iterations):
+            if len(active) == 0:
+                break
+            x_a, y_a, params_a = x[active], y[active], params[active]
+            jacobian = double_gauss_jacobian(x_a, params_a)
+            residual = residuals(x_a, y_a, params_a)
+            jtj = np.einsum('nmi,nmj->nij', jacobian, jacobian)
+            jtr = np.einsum('nmi,nm->ni', jacobian, residual)
+
+            # the parameters on a bound which would go out of it are fixed
+            fixed = ((params_a <= lbounds[active]) & (jtr < 0)) | ((params_a >= ubounds[active]) & (jtr > 0))
+            jtj[fixed[:, :, None] | fixed[:, None, :]] = 0.
+            jtr[fixed] = 0.
+
+            # solve (JtJ + damping * diag(JtJ)) step = Jt r, for all the series at once
+            diagonal = np.diagonal(jtj, axis1=1, axis2=2)
+            regularization = 1e-9 * (diagonal.max(axis=1, keepdims=True) + 1.)
+            damped = jtj + np.eye(7) * (damping[active, None] * (diagonal + regularization))[:, None, :]
+            solvable = np.isfinite(damped).all(axis=(1, 2)) & np.isfinite(jtr).all(axis=1)
+            step = np.zeros_like(params_a)
+            if solvable.any():
+                step[solvable] = np.linalg.solve(damped[solvable], jtr[solvable][..., None])[..., 0]
+
+            # the steps going out of the bounds stop on them
+            new_params = np.clip(params_a + step, lbounds[active], ubounds[active])
+            step = new_params - params_a
+            new_cost = (residuals(x_a, y_a, new_params)**2).sum(axis=1)
+
+            better = solvable & (new_cost < cost[active])
+            small_step = np.sqrt((step**2).sum(axis=1)) <= xtol * (np.sqrt((params_a**2).sum(axis=1)) + xtol)
+            small_decrease = better & (cost[active] - new_cost <= ftol * cost[active])
+
+            params[active[better]] = new_params[better]
+            cost[active[better]] = new_cost[better]
+            damping[active] = np.where(better, np.maximum(damping[active] / 10, 1e-7), damping[active] * 10)
+
+            done = solvable & (small_step | small_decrease)
+            converged[active[done]] = True
+            active = active[~done & solvable & (damping[active] < 1e16)]
+
+    return params, converged